@@ -0,0 +1,485 @@
+"""Benchmarks for the replay scripts, run against the replays already sorted
+into the team folders.
+Usage: python benchmark.py decode [--max-jobs N]
+Usage: python benchmark.py read
+  Reads the files decoding needs from each replay, with mpyq and with
+  mpq_reader.MPQReader, and compares the bytes read and the throughput.
+Usage: python benchmark.py download [--max-jobs N]
+  Downloads zips of the replays from a local stand-in for Google Drive.
+Usage: python benchmark.py vault
+  Fetches the saved replay vault page (fixtures/replay_vault.html) from a
+  local stand-in server, unchanged and changed, and checks the links found.
+Usage: python benchmark.py players [--players N] [--games N]
+  Aggregates synthetic games into player stats and writes the stats CSV.
+Usage: python benchmark.py stages [--output FILE] [--compare FILE]
+  Times each step of processing the replays, with a cold and a warm cache,
+  and saves the timings as JSON (data/benchmarks/<commit>.json by default)
+  to compare them with the timings of another commit.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+from collections import Counter
+
+import protocols
+import replay_parser
+
+BENCHMARK_DIRECTORY = "data/benchmarks/"
+VAULT_FIXTURE = "fixtures/replay_vault.html"
+PARSE_REPEATS = 20
+
+
+def benchmark_decode(replays, max_jobs):
+  """Times replay_parser.decode_replays with 1 to max_jobs processes.
+
+  Args:
+      replays (list of string): paths of the replays to decode
+      max_jobs (int): largest number of processes to try
+  """
+  print("Decoding %d replays" % len(replays))
+  print("%5s %10s %10s %8s" % ("jobs", "seconds", "replays/s", "speedup"))
+  baseline = None
+  for jobs in range(1, max_jobs + 1):
+    start = time.perf_counter()
+    results = replay_parser.decode_replays(replays, jobs)
+    elapsed = time.perf_counter() - start
+    baseline = baseline or elapsed
+    errors = sum(1 for record, error in results if error)
+    print("%5d %10.2f %10.1f %7.2fx%s" % (
+        jobs, elapsed, len(replays) / elapsed, baseline / elapsed,
+        "  (%d errors)" % errors if errors else ""))
+
+
+class CountingFile:
+
+  """Binary file that counts the bytes read from it."""
+
+  def __init__(self, path):
+    self.file = open(path, 'rb')
+    self.bytes_read = 0
+
+  def read(self, size=-1):
+    data = self.file.read(size)
+    self.bytes_read += len(data)
+    return data
+
+  def seek(self, offset, whence=0):
+    return self.file.seek(offset, whence)
+
+  def tell(self):
+    return self.file.tell()
+
+  def close(self):
+    self.file.close()
+
+
+def benchmark_read(replays):
+  """Times reading the replay header, replay.details and
+  replay.gamemetadata.json of each replay, what decoding its record needs,
+  and then also replay.tracker.events, what the analytics need, with mpyq
+  and with mpq_reader.MPQReader.
+
+  Args:
+      replays (list of string): paths of the replays to read
+  """
+  import mpyq
+  import mpq_reader
+
+  def read_mpyq(path, names):
+    f = CountingFile(path)
+    try:
+      archive = mpyq.MPQArchive(f)
+      archive.header['user_data_header']['content']
+      for name in names:
+        archive.read_file(name)
+    finally:
+      f.close()
+    return f.bytes_read
+
+  def read_mmap(path, names):
+    with mpq_reader.MPQReader(path) as archive:
+      archive.user_data
+      for name in names:
+        archive.read_file(name)
+      return archive.bytes_read
+
+  total_size = sum(os.path.getsize(replay) for replay in replays)
+  record_files = ['replay.details', 'replay.gamemetadata.json']
+  print("Reading %d replays, %.1f MiB" % (len(replays), total_size / (1 << 20)))
+  print("%8s %8s %10s %12s %10s %8s" % (
+      "files", "reader", "seconds", "replays/s", "KiB/replay", "% read"))
+  for files, names in (("record", record_files),
+                       ("tracker", record_files + ['replay.tracker.events'])):
+    for reader, read in (("mpyq", read_mpyq), ("mmap", read_mmap)):
+      start = time.perf_counter()
+      bytes_read = sum(read(replay, names) for replay in replays)
+      elapsed = time.perf_counter() - start
+      print("%8s %8s %10.2f %12.1f %10.1f %7.1f%%" % (
+          files, reader, elapsed, len(replays) / elapsed,
+          bytes_read / len(replays) / 1024, bytes_read / total_size * 100))
+
+
+def make_zips(replays, replays_per_zip):
+  """Zips replays together, like the uploads in the replay vault.
+
+  Returns:
+      dict: fake Drive ID => zip file contents
+  """
+  zips = {}
+  for i in range(0, len(replays), replays_per_zip):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+      for replay in replays[i:i + replays_per_zip]:
+        z.write(replay, os.path.join("replays", os.path.basename(replay)))
+    zips["fake-drive-id-%d" % (i // replays_per_zip)] = buffer.getvalue()
+  return zips
+
+
+def benchmark_download(replays, max_jobs):
+  """Times download_replays.download_drive_files against a local stand-in for
+  Google Drive with 1 to max_jobs simultaneous downloads, then with every
+  download cut off halfway so that it has to resume.
+
+  Args:
+      replays (list of string): paths of the replays to serve
+      max_jobs (int): largest number of simultaneous downloads to try
+  """
+  # Only import the downloader's dependencies when they're needed.
+  import download_replays
+  from drive_downloader import GoogleDriveDownloader
+  from fake_drive_server import FakeDriveServer
+  from replay_store import ReplayStore
+
+  zips = make_zips(replays, 10)
+  total_size = sum(len(data) for data in zips.values())
+  drive_files = list(enumerate(sorted(zips), 1))
+  GoogleDriveDownloader.RETRY_BACKOFF = 0
+  print("Downloading %d zips, %.1f MiB" % (len(zips), total_size / (1 << 20)))
+
+  def run(server, jobs):
+    with tempfile.TemporaryDirectory() as directory:
+      start = time.perf_counter()
+      downloaded = download_replays.download_drive_files(
+          drive_files, directory + "/", jobs, server.download_url,
+          ReplayStore(os.path.join(directory, "store")))
+      elapsed = time.perf_counter() - start
+      extracted = len(replay_parser.list_replays(directory))
+    return elapsed, len(downloaded), extracted
+
+  results = []
+  with FakeDriveServer(zips) as server:
+    for jobs in range(1, max_jobs + 1):
+      results.append(("%d jobs" % jobs,) + run(server, jobs))
+    server.drop_after = {drive_id: len(data) // 2
+                         for drive_id, data in zips.items()}
+    results.append(("resumed, 1 job",) + run(server, 1))
+
+  print("%16s %10s %10s %8s %10s" % ("", "seconds", "MiB/s", "zips", "replays"))
+  for name, elapsed, downloaded, extracted in results:
+    print("%16s %10.2f %10.1f %8d %10d" % (
+        name, elapsed, total_size / (1 << 20) / elapsed, downloaded, extracted))
+
+
+def benchmark_vault(fixture=VAULT_FIXTURE, season_name="Spring 2020"):
+  """Times getting a season's links from the replay vault page served by a
+  local stand-in: the first fetch, a fetch of the unchanged page, and a fetch
+  after the page changed. Raises AssertionError if the links found are wrong.
+
+  Args:
+      fixture (string): saved replay vault page to serve
+      season_name (string): tab to get the links of
+  """
+  import requests
+  from bs4 import BeautifulSoup
+  import replay_vault
+  from fake_drive_server import FakeDriveServer
+
+  with open(fixture, 'rb') as f:
+    page = f.read()
+  expected = replay_vault.parse_vault_page(page.decode('utf-8'))
+  assert expected and expected.get(season_name), "No %s links in %s" % (
+      season_name, fixture)
+  changed_link = "https://drive.google.com/open?id=1NeWlYaDdEd"
+  changed_links = [changed_link] + expected[season_name][1:]
+  changed_page = page.replace(expected[season_name][0].encode('utf-8'),
+                              changed_link.encode('utf-8'))
+
+  html = page.decode('utf-8')
+  start = time.perf_counter()
+  for _ in range(PARSE_REPEATS):
+    BeautifulSoup(html, 'html.parser').find_all('a')
+  full_parse = (time.perf_counter() - start) / PARSE_REPEATS
+  start = time.perf_counter()
+  for _ in range(PARSE_REPEATS):
+    replay_vault.parse_vault_page(html)
+  strained_parse = (time.perf_counter() - start) / PARSE_REPEATS
+
+  results = []
+  with tempfile.TemporaryDirectory() as directory, \
+      FakeDriveServer({}, {'/pages/replay-vault': (page, time.time() - 60)}) as server, \
+      requests.Session() as session:
+    url = server.page_url('/pages/replay-vault')
+    filename = os.path.join(directory, "replay_vault.json")
+
+    def fetch(name, expected_links):
+      before = sum(server.requests.values())
+      start = time.perf_counter()
+      # A new VaultPage each time, like each run of download_replays.py.
+      links = replay_vault.VaultPage(url, filename).season_links(
+          season_name, session)
+      elapsed = time.perf_counter() - start
+      assert links == expected_links, "%s: wrong links %s" % (name, links)
+      results.append((name, elapsed, sum(server.requests.values()) - before))
+
+    fetch("first fetch", expected[season_name])
+    fetch("unchanged", expected[season_name])
+    server.pages['/pages/replay-vault'] = (changed_page, time.time())
+    fetch("changed", changed_links)
+    fetch("unchanged again", changed_links)
+    statuses = dict(server.requests)
+
+  print("Page of %d bytes, parsed in %.2f ms in full and %.2f ms with the "
+        "strainer" % (len(page), full_parse * 1000, strained_parse * 1000))
+  print("%16s %10s %9s" % ("", "ms", "requests"))
+  for name, elapsed, requests_sent in results:
+    print("%16s %10.2f %9d" % (name, elapsed * 1000, requests_sent))
+  print("Responses: %s" % ", ".join(
+      "%d x %d" % (count, status)
+      for (path, status), count in sorted(statuses.items())))
+  assert statuses == {('/pages/replay-vault', 200): 2,
+                      ('/pages/replay-vault', 304): 2}, statuses
+
+
+def make_records(num_players, num_games):
+  """Makes replay records of random games between synthetic players.
+
+  Returns:
+      list of dict: records like the ones from replay_parser.decode_replay
+  """
+  rng = random.Random(0)
+  names = ["Player%d" % i for i in range(num_players)]
+  races = ["Protoss", "Zerg", "Terran"]
+  records = []
+  for i in range(num_games):
+    first, second = rng.sample(names, 2)
+    winner = rng.randrange(2)
+    records.append({
+        'duration': rng.randint(300, 1800),
+        'players': [{'name': name, 'selected_race': rng.choice(races),
+                     'result': 1 if j == winner else 2,
+                     'mmr': rng.randint(2000, 6500),
+                     'apm': rng.randint(50, 400)}
+                    for j, name in enumerate([first, second])]})
+  return records
+
+
+def benchmark_players(num_players, num_games):
+  """Times stats_compiler.StatsStage and make_csv on synthetic games.
+
+  Args:
+      num_players (int): number of players in the league
+      num_games (int): number of games played
+  """
+  import stats_compiler
+
+  records = make_records(num_players, num_games)
+  teams_dict = {"player%d" % i: "Team%d" % (i % 100) for i in range(num_players)}
+  nickname_dict = {"player%d" % i: "Player%d" % i for i in range(num_players)}
+  print("Aggregating %d games between %d players" % (num_games, num_players))
+
+  start = time.perf_counter()
+  stats = stats_compiler.StatsStage(nickname_dict)
+  for record in records:
+    stats.add(None, record)
+  aggregated = time.perf_counter()
+  with tempfile.TemporaryDirectory() as directory:
+    stats_compiler.make_csv(stats.player_dictionary,
+                            os.path.join(directory, "stats.csv"),
+                            teams_dict, nickname_dict)
+  written = time.perf_counter()
+  print("%16s %10s %10s" % ("", "seconds", "games/s"))
+  print("%16s %10.2f %10.0f" % (
+      "aggregate", aggregated - start, num_games / (aggregated - start)))
+  print("%16s %10.2f %10.0f" % (
+      "make_csv", written - aggregated, num_games / (written - aggregated)))
+
+
+def get_commit():
+  """Gets the short hash of the checked out commit, or "unknown"."""
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                          capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown"
+
+
+def benchmark_stages(replays):
+  """Times each step of processing replays: decoding (split into its steps),
+  reading them through a cold and a warm cache, organizing them, and
+  compiling the stats.
+
+  Args:
+      replays (list of string): paths of the replays to process
+
+  Returns:
+      tuple: (dict of seconds spent in each step, by step name, dict of
+        number of errors in each step)
+  """
+  import cea_team_name_parser
+  import replay_cache
+  import replay_organizer
+  import replay_store
+  import stats_compiler
+  from consts import TEAMS_FILE
+
+  timings = Counter()
+  errors = Counter()
+  replays = [os.path.abspath(replay) for replay in replays]
+  teams, aliases = cea_team_name_parser.init_dictionary(TEAMS_FILE)
+  teams_file = os.path.abspath(TEAMS_FILE)
+
+  # Decode steps, starting with no protocol module loaded.
+  protocols.clear()
+  for replay in replays:
+    try:
+      replay_parser.decode_replay(replay, timings)
+    except Exception:
+      errors['decode'] += 1
+
+  with tempfile.TemporaryDirectory() as directory:
+    cache_file = os.path.join(directory, "replay_cache.json")
+    start = time.perf_counter()
+    cache = replay_cache.ReplayCache(cache_file)
+    records = cache.get_many(replays)
+    cache.save()
+    timings['cache_cold'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache = replay_cache.ReplayCache(cache_file)
+    records = cache.get_many(replays)
+    timings['cache_warm'] = time.perf_counter() - start
+
+    # Organize a copy of the replays in an empty folder, quietly.
+    upload_directory = os.path.join(directory, "UploadHere")
+    os.makedirs(upload_directory)
+    names = []
+    for i, replay in enumerate(replays):
+      names.append("%d-%s" % (i, os.path.basename(replay)))
+      shutil.copyfile(replay, os.path.join(upload_directory, names[-1]))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        cache = replay_cache.ReplayCache(cache_file)
+        records = cache.get_many(
+            [os.path.join("UploadHere", name) for name in names])
+        organizer = replay_organizer.OrganizeStage(
+            "UploadHere", "UploadHere", teams, aliases, cache,
+            replay_store.ReplayStore())
+        start = time.perf_counter()
+        for name, (record, error) in zip(names, records):
+          if record is not None:
+            organizer.add(name, record)
+        organizer.placement.wait()
+        timings['organize_copy'] = time.perf_counter() - start
+        start = time.perf_counter()
+        organizer.finish()
+        timings['organize_rename'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats = stats_compiler.StatsStage(aliases)
+        for name, (record, error) in zip(names, records):
+          try:
+            stats.add(name, record)
+          except Exception:
+            errors['stats_aggregate'] += 1
+        timings['stats_aggregate'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+          stats_compiler.make_csv(stats.player_dictionary, "stats.csv",
+                                  *cea_team_name_parser.init_dictionary(teams_file))
+        except Exception:
+          errors['csv_write'] += 1
+        timings['csv_write'] = time.perf_counter() - start
+    finally:
+      os.chdir(cwd)
+  return dict(timings), dict(errors)
+
+
+def print_stages(results, previous=None):
+  """Prints the timings of benchmark_stages, next to older ones if given."""
+  for name, count in results['errors'].items():
+    print("Errors in %s: %d" % (name, count))
+  timings = results['timings']
+  if previous is None:
+    print("%20s %10s" % ("", "seconds"))
+    for name, seconds in timings.items():
+      print("%20s %10.3f" % (name, seconds))
+    return
+  print("%20s %10s %10s %8s" % ("", previous['commit'], results['commit'], "change"))
+  for name, seconds in timings.items():
+    before = previous['timings'].get(name)
+    if before:
+      print("%20s %10.3f %10.3f %+7.0f%%" % (
+          name, before, seconds, (seconds - before) / before * 100))
+    else:
+      print("%20s %10s %10.3f" % (name, "", seconds))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark the replay scripts')
+  parser.add_argument('benchmark',
+                      choices=['decode', 'read', 'download', 'vault', 'players',
+                               'stages'],
+                      help='Which benchmark to run')
+  parser.add_argument('--max-jobs', type=int, dest='max_jobs',
+                      default=os.cpu_count(),
+                      help='Largest number of processes or downloads to run at once')
+  parser.add_argument('--players', type=int, dest='players', default=10000,
+                      help='Number of synthetic players for the players benchmark')
+  parser.add_argument('--games', type=int, dest='games', default=200000,
+                      help='Number of synthetic games for the players benchmark')
+  parser.add_argument('--output', dest='output',
+                      help='JSON file for the stages timings')
+  parser.add_argument('--compare', dest='compare',
+                      help='JSON file of earlier stages timings to compare with')
+  args = parser.parse_args()
+  if args.benchmark == 'decode':
+    benchmark_decode(replay_parser.find_team_replays(), args.max_jobs)
+  elif args.benchmark == 'read':
+    benchmark_read(replay_parser.find_team_replays())
+  elif args.benchmark == 'download':
+    benchmark_download(replay_parser.find_team_replays(), args.max_jobs)
+  elif args.benchmark == 'vault':
+    benchmark_vault()
+  elif args.benchmark == 'players':
+    benchmark_players(args.players, args.games)
+  elif args.benchmark == 'stages':
+    replays = replay_parser.find_team_replays()
+    commit = get_commit()
+    print("Processing %d replays at commit %s" % (len(replays), commit))
+    timings, errors = benchmark_stages(replays)
+    results = {'commit': commit, 'replays': len(replays),
+               'python': platform.python_version(),
+               'timings': timings, 'errors': errors}
+    previous = None
+    if args.compare:
+      with open(args.compare, 'r') as f:
+        previous = json.load(f)
+    print_stages(results, previous)
+    output = args.output or os.path.join(BENCHMARK_DIRECTORY, commit + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+      json.dump(results, f, indent=2)
+    print("Saved timings to %s" % output)
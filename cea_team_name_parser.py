@@ -1,4 +1,10 @@
 import csv
+import re
+import unicodedata
+
+# Clan tag in front of a name, ex: [CEA]Feniks or <CEA> Feniks
+CLAN_TAG = re.compile(r'^\s*(\[[^\]]*\]|<[^>]*>|&lt;.*?&gt;)\s*')
+SEPARATORS = re.compile(r'[\s_]+')
 
 def init_dictionary(filename):
   """Initializes dictionary with key player name, value team name,
@@ -21,4 +27,145 @@ def init_dictionary(filename):
             # we convert to lowercase to make string comparison easier.
             teams[alias.lower()] = team_name
             players[alias.lower()] = aliases[0]
-  return (teams, players)
\ No newline at end of file
+  return (teams, players)
+
+
+def normalize_name(name):
+  """Folds the ways a player name can be written into one key: clan tag
+  removed, full-width and compatibility characters (common with CJK input)
+  folded by NFKC, case folded, spaces and underscores removed.
+
+  Args:
+      name (string): player name, ex: "[CEA] Ｆｅｎｉｋｓ"
+  Returns:
+      string: normalized name, ex: "feniks"
+  """
+  name = unicodedata.normalize('NFKC', name)
+  name = CLAN_TAG.sub('', name)
+  return SEPARATORS.sub('', name.casefold())
+
+
+def edit_distance(first, second):
+  """Levenshtein distance between two strings."""
+  if len(first) < len(second):
+    first, second = second, first
+  previous = list(range(len(second) + 1))
+  for i, first_char in enumerate(first, 1):
+    current = [i]
+    for j, second_char in enumerate(second, 1):
+      current.append(min(previous[j] + 1, current[j - 1] + 1,
+                         previous[j - 1] + (first_char != second_char)))
+    previous = current
+  return previous[-1]
+
+
+class BKTree:
+
+  """Burkhard-Keller tree of strings, to find the strings within an edit
+  distance of a query without comparing it to all of them."""
+
+  def __init__(self):
+    self.root = None
+
+  def add(self, word):
+    if self.root is None:
+      self.root = (word, {})
+      return
+    node_word, children = self.root
+    while True:
+      distance = edit_distance(word, node_word)
+      if distance == 0:
+        return
+      if distance not in children:
+        children[distance] = (word, {})
+        return
+      node_word, children = children[distance]
+
+  def search(self, word, max_distance):
+    """Gets the strings within max_distance of word.
+
+    Returns:
+        list of tuple: (distance, string)
+    """
+    found = []
+    nodes = [self.root] if self.root else []
+    while nodes:
+      node_word, children = nodes.pop()
+      distance = edit_distance(word, node_word)
+      if distance <= max_distance:
+        found.append((distance, node_word))
+      for child_distance, child in children.items():
+        if distance - max_distance <= child_distance <= distance + max_distance:
+          nodes.append(child)
+    return found
+
+
+class AliasIndex:
+
+  """Looks up players by name, allowing for clan tags, case, full-width
+  characters and small spelling mistakes. Lookups are cached.
+
+  Attributes:
+      aliases (dict): player alias => main player name, from init_dictionary
+      fuzzy_matches (dict): name => main player name, for the names that were
+        only matched approximately.
+  """
+
+  def __init__(self, aliases):
+    self.aliases = aliases
+    # normalized alias => main player names
+    self.normalized = {}
+    self.tree = BKTree()
+    for alias, main_name in aliases.items():
+      key = normalize_name(alias)
+      if key:
+        self.normalized.setdefault(key, set()).add(main_name)
+        self.tree.add(key)
+    self.fuzzy_matches = {}
+    self._cache = {}
+
+  @staticmethod
+  def max_distance(key):
+    """Number of spelling mistakes allowed for a name, none for short names
+    since they're too easily confused."""
+    if len(key) < 5:
+      return 0
+    return 1 if len(key) < 9 else 2
+
+  def candidates(self, name, max_distance=2):
+    """Ranks the players whose name is close to the given name.
+
+    Args:
+        name (string): player name
+        max_distance (int): largest edit distance between normalized names
+    Returns:
+        list of tuple: (edit distance, main player name), closest first.
+    """
+    key = normalize_name(name)
+    best = {}
+    for distance, match in self.tree.search(key, max_distance):
+      for main_name in self.normalized[match]:
+        best[main_name] = min(distance, best.get(main_name, distance))
+    return sorted((distance, main_name) for main_name, distance in best.items())
+
+  def resolve(self, name):
+    """Gets the main name of a player.
+
+    Args:
+        name (string): name played under
+    Returns:
+        string: main player name, or None if no player is close enough or
+          several are equally close.
+    """
+    if name in self._cache:
+      return self._cache[name]
+    main_name = self.aliases.get(name.lower())
+    if main_name is None:
+      matches = self.candidates(name, self.max_distance(normalize_name(name)))
+      if matches and (len(matches) == 1 or matches[0][0] < matches[1][0]):
+        main_name = matches[0][1]
+        if matches[0][0] > 0:
+          self.fuzzy_matches[name] = main_name
+          print("Matched player {0} to {1} from the teams file".format(name, main_name))
+    self._cache[name] = main_name
+    return main_name
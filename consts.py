@@ -8,10 +8,15 @@ Attributes:
     REPLAY_DIRECTORY (str): Directory where replays are to be stored.
     TEAMS_FILE (str): Teams file for the current season. Create the csv in the
     				  season folder.
-    CURRENT_SEASON_NAME (str): Current season name. Must match replay vault.
+    CURRENT_SEASON_NAME (str): Current season name. Must match the title of
+    						   its tab in the replay vault.
     ID_DICT_JSON (str): Dictionary containing info on which replays have
-    					already been downloaded.
+    					already been downloaded. Only read to migrate to LEDGER_JSONL.
+    LEDGER_JSONL (str): Ledger of the downloads, see download_ledger.py.
     URL (str): URL of the replay vault.
+    SEASONS (dict): Every season, see seasons.py. Spring2020 was set up
+                    before seasons had their own folders, and keeps the top
+                    level folders and data files.
 """
 
 # Current season; At the start of a new CEA season, rename this to something
@@ -29,4 +34,18 @@ STARTING_DATE = "20200221"
 CURRENT_SEASON_NAME = "Spring 2020"
 
 ID_DICT_JSON = "data/" + CURRENT_SEASON + "_id_dict.json"
+LEDGER_JSONL = "data/" + CURRENT_SEASON + "_ledger.jsonl"
 URL = 'https://cea.gg/pages/replay-vault'
+
+# Season => vault name, starting date (YYYYMMDD, None if not recorded), folder
+# holding its uploads, team folders, teams file and stats CSV, and folder of
+# its caches and indexes. At the start of a new season add it here, with
+# "seasons/<season>/" and "data/<season>/" as its folders.
+SEASONS = {
+    "Fall2019": {
+        "vault_name": "Fall 2019", "starting_date": None,
+        "directory": "seasons/Fall2019/", "data_directory": "data/Fall2019/"},
+    "Spring2020": {
+        "vault_name": "Spring 2020", "starting_date": "20200221",
+        "directory": "", "data_directory": "data/"},
+}
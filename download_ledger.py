@@ -0,0 +1,137 @@
+"""Ledger of the files download_replays.py downloaded from the replay vault.
+
+The ledger is an append-only file with one JSON record per line, written as
+each download finishes, so a crash only loses the downloads in flight. The
+latest record of a Drive ID wins. Records are:
+    id (str): Google Drive ID of the file.
+    status (str): 'downloaded' or 'failed'.
+    bytes (int): Number of bytes downloaded.
+    replays (list of str): SHA-256 of each replay in the file.
+    error (str): Why the download failed, if it did.
+    time (str): When the record was written, ISO 8601 UTC.
+
+Attributes:
+    FSYNC_EVERY (int): Records written between two fsyncs.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+FSYNC_EVERY = 8
+
+
+class DownloadLedger:
+
+  """Per Drive ID download records, backed by an append-only file.
+
+  Attributes:
+      filename (str): File backing the ledger.
+      records (dict): Drive ID => latest record
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.records = {}
+    self._file = None
+    self._unsynced = 0
+    self._lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    """Reads the ledger. A record cut short by a crash is ignored."""
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        for line in f:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue
+          self.records[record['id']] = record
+    except OSError:
+      pass
+
+  def migrate(self, id_dict_json):
+    """Imports the Drive IDs of an old id_dict JSON file, which only says
+    which IDs were downloaded, if the ledger is empty.
+
+    Args:
+        id_dict_json (str): JSON file with Drive ID as key, 1 as value
+    """
+    if self.records:
+      return
+    try:
+      with open(id_dict_json, 'r') as f:
+        id_dict = json.load(f)
+    except (OSError, ValueError):
+      return
+    for drive_id in id_dict:
+      self.records[drive_id] = self._make_record(drive_id, 'downloaded')
+    print("Imported %d downloads from %s" % (len(id_dict), id_dict_json))
+    self.compact()
+
+  def is_downloaded(self, drive_id):
+    record = self.records.get(drive_id)
+    return record is not None and record['status'] == 'downloaded'
+
+  def _make_record(self, drive_id, status, size=0, replays=(), error=None):
+    record = {
+        'id': drive_id, 'status': status, 'bytes': size,
+        'replays': list(replays),
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+    if error:
+      record['error'] = error
+    return record
+
+  def record(self, drive_id, status, size=0, replays=(), error=None):
+    """Appends a record for a Drive ID. Safe to call from several threads.
+
+    Args:
+        drive_id (str): Google Drive ID of the file.
+        status (str): 'downloaded' or 'failed'.
+        size (int): Number of bytes downloaded.
+        replays (list of str): SHA-256 of each replay in the file.
+        error (str): Why the download failed.
+    """
+    record = self._make_record(drive_id, status, size, replays, error)
+    with self._lock:
+      self.records[drive_id] = record
+      if self._file is None:
+        directory = os.path.dirname(self.filename)
+        if directory:
+          os.makedirs(directory, exist_ok=True)
+        self._file = open(self.filename, 'a', encoding='utf-8')
+      self._file.write(json.dumps(record) + '\n')
+      self._file.flush()
+      self._unsynced += 1
+      if self._unsynced >= FSYNC_EVERY:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+  def compact(self):
+    """Rewrites the ledger with only the latest record of each Drive ID. The
+    new ledger replaces the old one atomically."""
+    with self._lock:
+      self._close()
+      directory = os.path.dirname(self.filename)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      temp_filename = self.filename + '.tmp'
+      with open(temp_filename, 'w', encoding='utf-8') as f:
+        for record in self.records.values():
+          f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(temp_filename, self.filename)
+
+  def close(self):
+    with self._lock:
+      self._close()
+
+  def _close(self):
+    if self._file is not None:
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self._file.close()
+      self._file = None
+      self._unsynced = 0
@@ -1,89 +1,141 @@
 """Download replays from the CEA Replay Repository.
-Saves records of which links have been downloaded in data/ folder.
+Saves records of which links have been downloaded in the data/ folder ledger
+(see download_ledger.py), as each download finishes.
 Usage: python download_replays.py
 If you want to redownload all replays,
   python download_replays.py --r True
 
 And pip install whatever packages you need.
 
-TODO: combine this into one script with replay_organizer.py.
-Also TODO: Write a setup file so that people don't have to pip install everything.
+To download, organize and compile stats in one go, use pipeline.py:
+  python pipeline.py --stages download,organize,matchups,stats
+
+TODO: Write a setup file so that people don't have to pip install everything.
 """
 import argparse
 import requests
-import shutil
-import json
-from consts import CURRENT_SEASON_NAME, ID_DICT_JSON, URL, CURRENT_SEASON
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from consts import CURRENT_SEASON_NAME, ID_DICT_JSON, LEDGER_JSONL, URL
+from download_ledger import DownloadLedger
 from drive_downloader import GoogleDriveDownloader as gdd
-from bs4 import BeautifulSoup, Tag
+import metrics
+import replay_store
+import replay_vault
 
-# TODO: Automatically find this using the relevant tab.
-current_season_number = 1
 # Directory where uploaded replays are stored.
 replay_directory = "UploadHere/"# + CURRENT_SEASON + "/"
+# Number of times a failed download is retried.
+DOWNLOAD_RETRIES = 3
 
-def update_json(id_dict):
-  """Updates the json file which checks which files have been downloaded.
+def get_url_list(season_name=CURRENT_SEASON_NAME, session=None):
+  """Gets the replay links of a season's tab in the replay vault. The vault
+  page is only downloaded again when it changed, see replay_vault.py.
 
   Args:
-      id_dict (DICT): Dictionary with url ID as key, 1 as value
+      season_name (str): Title of the season's tab, ex: Spring 2020.
+      session (requests.Session): Session to send the request with.
+
+  Returns:
+      list of str: Link hrefs, empty if they could not be found.
   """
-  j = json.dumps(id_dict)
-  f = open(ID_DICT_JSON, 'w')
-  print(j, file=f)
-  f.close()
+  try:
+    return replay_vault.VaultPage(URL).season_links(season_name, session)
+  except (requests.RequestException, ValueError) as e:
+    print("Error: %s" % e)
+    return []
 
-def get_url_list():
-  response = requests.get(URL)
-  response.encoding = 'utf-8'
-  soup = BeautifulSoup(response.text, 'html.parser')
-  games_list = soup.find_all("div", {"class": "shogun-accordion"})
-  starcraft_html = ""
-  for game in games_list:
-    game_title = game.find_all("h4", {"class": "shogun-accordion-title"})
-    if game_title[0].text.strip() == "Starcraft 2":
-      starcraft_html = game
-  if not starcraft_html:
-    return "Error: Starcraft 2 replays could not be found."
+def download_drive_files(drive_files, directory, jobs=1, download_url=None,
+                         store=None, ledger=None):
+  """Downloads and unzips replays from Google Drive, `jobs` at a time,
+  sharing a pool of connections.
 
-  # The first tab body would apply to the entire Starcraft 2 tab.
-  season_tabs = starcraft_html.find_all("div", {"class": "shogun-tabs-body"})
-  print(season_tabs)
+  Args:
+      drive_files (list of (int, str)): (count, Drive ID) of each file. The
+        count prefixes the extracted file names so that they're unique.
+      directory (str): Directory to extract the replays into.
+      jobs (int): Number of simultaneous downloads.
+      download_url (str): URL to download from instead of Google Drive's.
+      store (ReplayStore): Replays already in the store are not extracted
+        again. Uses the default store if not given.
+      ledger (DownloadLedger): If given, each download is recorded in it as
+        soon as it finishes or fails.
 
-  # Get HTML associated with current season number.
-  current_season_html = season_tabs[current_season_number]
-  current_season_links = current_season_html.find_all('a')
-  return current_season_links
+  Returns:
+      list of str: Drive IDs that were downloaded successfully.
+  """
+  if store is None:
+    store = replay_store.ReplayStore()
+  session = requests.Session()
+  adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(jobs, 10))
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
 
-def download_replays(redownload):
+  def download(count, drive_id):
+    replays = []
+    start = time.perf_counter()
+    size = gdd.download_file_from_google_drive(
+        file_id=drive_id, dest_path=directory
+        + "temp_" + drive_id + '.zip', new_file_name=str(count) + " ",
+        unzip=True, session=session, retries=DOWNLOAD_RETRIES,
+        download_url=download_url, replay_store=store, extracted=replays)
+    if ledger is not None:
+      ledger.record(drive_id, 'downloaded', size, replays)
+    return size, time.perf_counter() - start
+
+  downloaded_ids = []
+  total_bytes = 0
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = {executor.submit(download, count, drive_id): drive_id
+               for count, drive_id in drive_files}
+    for future in as_completed(futures):
+      try:
+        size, seconds = future.result()
+        total_bytes += size
+        downloaded_ids.append(futures[future])
+        metrics.observe('download', seconds)
+        metrics.count('bytes.downloaded', size)
+      except Exception as e:
+        metrics.record_failure('download', e)
+        print("Error downloading %s" % futures[future])
+        traceback.print_exc()
+        if ledger is not None:
+          ledger.record(futures[future], 'failed', error=repr(e))
+  elapsed = time.perf_counter() - start
+  if downloaded_ids:
+    print("Downloaded %d files, %s in %.1f seconds (%s/s)" % (
+        len(downloaded_ids), gdd.sizeof_fmt(total_bytes), elapsed,
+        gdd.sizeof_fmt(total_bytes / elapsed)))
+  return downloaded_ids
+
+def download_replays(redownload, jobs=1):
   links = get_url_list()
-  try:
-    with open(ID_DICT_JSON, 'r') as f:
-      id_dict = json.load(f)
-  except:
-    print("Could not open %s" % ID_DICT_JSON)
-    id_dict = {}
-  # Use an empty dict if redownloading all replays
-  if redownload:
-    id_dict = {}
+  ledger = DownloadLedger(LEDGER_JSONL)
+  ledger.migrate(ID_DICT_JSON)
 
+  drive_files = []
   count = 0
   for link in links:
     count += 1
-    drive_id = link.get('href').split("=")[-1]
+    drive_id = link.split("=")[-1]
     print(drive_id)
-    if drive_id not in id_dict:
-      id_dict[drive_id] = 1
-      gdd.download_file_from_google_drive(
-          file_id=drive_id, dest_path=replay_directory
-          + "temp_dir" + '.zip', new_file_name=str(count) + " ",
-          unzip=True)      
-  update_json(id_dict)
+    # Redownload everything if redownloading all replays
+    if redownload or not ledger.is_downloaded(drive_id):
+      drive_files.append((count, drive_id))
+  try:
+    download_drive_files(drive_files, replay_directory, jobs, ledger=ledger)
+  finally:
+    ledger.compact()
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(
       description='Download Replays from CEA Replay Repository')
   parser.add_argument('--r', type=bool, dest='redownload', default=False,
                       help='True/False: Whether to redownload all replays')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of simultaneous downloads')
+  metrics.add_arguments(parser)
   args = parser.parse_args()
-  download_replays(args.redownload)
+  metrics.run(args, download_replays, args.redownload, args.jobs)
@@ -6,7 +6,10 @@ USAGE: Called in download_replays.py, which downloads replays from the replay
 vault in an instant.
 """
 from __future__ import print_function
+import hashlib
 import requests
+import tempfile
+import time
 import zipfile
 import warnings
 from sys import stdout
@@ -25,11 +28,17 @@ class GoogleDriveDownloader:
 
   CHUNK_SIZE = 32768
   DOWNLOAD_URL = 'https://docs.google.com/uc?export=download'
+  # Seconds to wait before the first retry, doubled for each retry after.
+  RETRY_BACKOFF = 1.0
+  # Archives to unzip are kept in memory up to this size, then on disk.
+  SPOOL_SIZE = 64 * 1024 * 1024
 
   @staticmethod
   def download_file_from_google_drive(file_id, dest_path, new_file_name,
                                       overwrite=False, unzip=False,
-                                      showsize=False):
+                                      showsize=False, session=None,
+                                      retries=0, download_url=None,
+                                      replay_store=None, extracted=None):
     """
     Downloads a shared file from google drive into a given folder.
     Optionally unzips it.
@@ -47,62 +56,125 @@ class GoogleDriveDownloader:
     overwrite: bool
         optional, if True forces re-download and overwrite.
     unzip: bool
-        optional, if True unzips a file.
-        If the file is not a zip file, ignores it.
+        optional, if True unzips a file instead of saving it.
+        Only .SC2Replay files are extracted, leaving out macOS metadata
+        (__MACOSX/ and ._ files). If the file is not a zip file, ignores it.
     showsize: bool
         optional, if True print the current download size.
+    session: requests.Session
+        optional, session to download with, so that connections are reused
+        across downloads. A new session is used if not given.
+    retries: int
+        optional, number of times to retry a failed download, waiting
+        longer each time. Retries resume where the failed attempt stopped
+        if the server supports it. Without unzip, so does a later call
+        after a crash.
+    download_url: str
+        optional, URL to download from instead of DOWNLOAD_URL.
+    replay_store: ReplayStore
+        optional, when unzipping, replays already in this store, or being
+        extracted by another download, are skipped without being written.
+        Extracted replays are added to it.
+    extracted: list
+        optional, when unzipping, the SHA-256 of every replay in the zip is
+        appended to it, whether it was written or skipped.
     Returns
     -------
-    None
+    int: number of bytes downloaded
     """
 
     destination_directory = dirname(dest_path)
     if not exists(destination_directory):
       makedirs(destination_directory)
 
+    downloaded = [0]
     if not exists(dest_path) or overwrite:
 
-      session = requests.Session()
+      if session is None:
+        session = requests.Session()
+      download_url = download_url or GoogleDriveDownloader.DOWNLOAD_URL
 
       print('Downloading {} into {}... '.format(
           file_id, dest_path), end='')
       stdout.flush()
 
-      response = session.get(GoogleDriveDownloader.DOWNLOAD_URL, params={
-                             'id': file_id}, stream=True)
-
-      token = GoogleDriveDownloader._get_confirm_token(response)
-      if token:
-        params = {'id': file_id, 'confirm': token}
-        response = session.get(
-            GoogleDriveDownloader.DOWNLOAD_URL, params=params, stream=True)
-
       if showsize:
         print()  # Skip to the next line
 
-      current_download_size = [0]
-      GoogleDriveDownloader._save_response_content(
-          response, dest_path, showsize, current_download_size)
-      print('Done.')
-
       if unzip:
-        try:
-          print('Unzipping...', end='')
-          stdout.flush()
-          with zipfile.ZipFile(dest_path, 'r') as z:
-            for zip_info in z.infolist():
-              # Ignore directory.
-              if zip_info.filename[-1] == '/':
-                continue
-              zip_info.filename = new_file_name + \
-                  os.path.basename(zip_info.filename)
-              z.extract(zip_info, destination_directory)
-          print('Done.')
-        except zipfile.BadZipfile:
-          warnings.warn(
-              'Ignoring `unzip` since "{}" does not look like a valid zip file'.format(dest_path))
-
-        os.remove(dest_path)  # delete the zip file.
+        # Keep the archive in memory, or on disk once it gets big, since only
+        # the replays in it are kept.
+        f = tempfile.SpooledTemporaryFile(
+            max_size=GoogleDriveDownloader.SPOOL_SIZE)
+      else:
+        # Download into a separate file, so that an interrupted download can
+        # be resumed instead of being mistaken for a complete one.
+        part_path = dest_path + '.part'
+        f = open(part_path, 'ab')
+
+      with f:
+        for attempt in range(retries + 1):
+          try:
+            GoogleDriveDownloader._download(
+                session, download_url, file_id, f, showsize, downloaded)
+            break
+          except requests.RequestException:
+            if attempt == retries:
+              raise
+            time.sleep(GoogleDriveDownloader.RETRY_BACKOFF * 2 ** attempt)
+        print('Done.')
+
+        if unzip:
+          try:
+            print('Unzipping...', end='')
+            stdout.flush()
+            written, skipped = GoogleDriveDownloader._extract_replays(
+                f, destination_directory, new_file_name, replay_store,
+                extracted)
+            print('Done. {} replays, {} already downloaded.'.format(
+                written, skipped))
+          except zipfile.BadZipfile:
+            warnings.warn(
+                'Ignoring `unzip` since "{}" does not look like a valid zip file'.format(file_id))
+
+      if not unzip:
+        os.replace(part_path, dest_path)
+    return downloaded[0]
+
+  @staticmethod
+  def _download(session, download_url, file_id, f, showsize, downloaded):
+    """Downloads a file into the file object f, resuming from what's already
+    in it. Adds the number of bytes received to downloaded[0], even if it
+    fails.
+    """
+    headers = {}
+    f.seek(0, os.SEEK_END)
+    offset = f.tell()
+    if offset:
+      headers['Range'] = 'bytes={}-'.format(offset)
+
+    response = session.get(download_url, params={'id': file_id},
+                           headers=headers, stream=True)
+    token = GoogleDriveDownloader._get_confirm_token(response)
+    if token:
+      # Read the warning page, so its connection goes back to the pool.
+      response.content
+      params = {'id': file_id, 'confirm': token}
+      response = session.get(download_url, params=params, headers=headers,
+                             stream=True)
+    response.raise_for_status()
+
+    # The server ignored the range if it didn't answer with Partial Content.
+    if response.status_code != 206:
+      offset = 0
+      f.seek(0)
+      f.truncate()
+    current_download_size = [offset]
+    try:
+      GoogleDriveDownloader._save_response_content(
+          response, f, showsize, current_download_size)
+    finally:
+      downloaded[0] += current_download_size[0] - offset
 
   @staticmethod
   def _get_confirm_token(response):
@@ -112,16 +184,49 @@ class GoogleDriveDownloader:
     return None
 
   @staticmethod
-  def _save_response_content(response, destination, showsize, current_size):
-    with open(destination, 'wb') as f:
-      for chunk in response.iter_content(GoogleDriveDownloader.CHUNK_SIZE):
-        if chunk:  # filter out keep-alive new chunks
-          f.write(chunk)
-          if showsize:
-            print(
-                '\r' + GoogleDriveDownloader.sizeof_fmt(current_size[0]), end=' ')
-            stdout.flush()
-            current_size[0] += GoogleDriveDownloader.CHUNK_SIZE
+  def _save_response_content(response, f, showsize, current_size):
+    for chunk in response.iter_content(GoogleDriveDownloader.CHUNK_SIZE):
+      if chunk:  # filter out keep-alive new chunks
+        f.write(chunk)
+        current_size[0] += len(chunk)
+        if showsize:
+          print(
+              '\r' + GoogleDriveDownloader.sizeof_fmt(current_size[0]), end=' ')
+          stdout.flush()
+
+  @staticmethod
+  def _extract_replays(f, destination_directory, new_file_name, replay_store,
+                       extracted):
+    """Extracts the replays of a zip file, hashing each one first so that
+    replays already in replay_store aren't written again. Hashes are
+    appended to extracted, if it's given.
+
+    Returns
+    -------
+    (int, int): number of replays written, and skipped
+    """
+    written = skipped = 0
+    with zipfile.ZipFile(f, 'r') as z:
+      for zip_info in z.infolist():
+        name = os.path.basename(zip_info.filename)
+        # Ignore directories, other files and macOS metadata.
+        if (zip_info.is_dir() or not name.lower().endswith('.sc2replay')
+            or name.startswith('._') or zip_info.filename.startswith('__MACOSX/')):
+          continue
+        data = z.read(zip_info)
+        sha = hashlib.sha256(data).hexdigest()
+        if extracted is not None:
+          extracted.append(sha)
+        if replay_store is not None and not replay_store.claim(sha):
+          skipped += 1
+          continue
+        path = os.path.join(destination_directory, new_file_name + name)
+        with open(path, 'wb') as replay_file:
+          replay_file.write(data)
+        if replay_store is not None:
+          replay_store.add(path, sha)
+        written += 1
+    return written, skipped
 
   # From https://stackoverflow.com/questions/1094841/reusable-library-to-get-human-readable-version-of-file-size
   @staticmethod
@@ -0,0 +1,153 @@
+"""Local stand-in for Google Drive downloads, used by benchmark.py to measure
+download throughput and resuming without a network connection.
+
+Like Google Drive, it answers the first request for a file with a warning
+page and a download_warning cookie, and only sends the file once the token
+from the cookie is passed back as the confirm parameter. Range requests are
+supported, and files can be set to drop the connection partway through.
+
+It can also serve pages, like the replay vault page, with an ETag and a
+Last-Modified date, answering 304 Not Modified to requests that send them
+back with If-None-Match or If-Modified-Since.
+"""
+import hashlib
+import threading
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CONFIRM_TOKEN = "t0k3n"
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+
+  """Serves the files of the FakeDriveServer it belongs to."""
+
+  protocol_version = "HTTP/1.1"
+  # Headers and body are written separately, which stalls kept-alive
+  # connections on delayed ACKs unless Nagle's algorithm is off.
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    if url.path in self.server.pages:
+      self.send_page(url.path)
+      return
+    query = parse_qs(url.query)
+    file_id = query.get('id', [None])[0]
+    if file_id not in self.server.files:
+      self.send_error(404)
+      return
+
+    if query.get('confirm', [None])[0] != CONFIRM_TOKEN:
+      body = b"<html>Google Drive can't scan this file for viruses.</html>"
+      self.send_response(200)
+      self.send_header('Set-Cookie', 'download_warning_%s=%s' % (
+          file_id, CONFIRM_TOKEN))
+      self.send_header('Content-Type', 'text/html')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+      return
+
+    data = self.server.files[file_id]
+    start = 0
+    range_header = self.headers.get('Range')
+    if range_header and range_header.startswith('bytes='):
+      start = int(range_header[len('bytes='):].split('-')[0])
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+          start, len(data) - 1, len(data)))
+    else:
+      self.send_response(200)
+    self.send_header('Content-Type', 'application/zip')
+    self.send_header('Content-Length', str(len(data) - start))
+    self.end_headers()
+
+    end = len(data)
+    with self.server.lock:
+      drop_after = self.server.drop_after.pop(file_id, None)
+    if drop_after is not None:
+      end = min(end, start + drop_after)
+      self.close_connection = True
+    self.wfile.write(data[start:end])
+
+  def send_page(self, path):
+    body, modified = self.server.pages[path]
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    last_modified = formatdate(modified, usegmt=True)
+    if_none_match = self.headers.get('If-None-Match')
+    if_modified_since = self.headers.get('If-Modified-Since')
+    if if_none_match is not None:
+      not_modified = etag in [tag.strip() for tag in if_none_match.split(',')]
+    elif if_modified_since is not None:
+      try:
+        not_modified = (parsedate_to_datetime(if_modified_since).timestamp()
+                        >= int(modified))
+      except (TypeError, ValueError):
+        not_modified = False
+    else:
+      not_modified = False
+    with self.server.lock:
+      self.server.requests[(path, 304 if not_modified else 200)] += 1
+    self.send_response(304 if not_modified else 200)
+    self.send_header('ETag', etag)
+    self.send_header('Last-Modified', last_modified)
+    if not_modified:
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    self.send_header('Content-Type', 'text/html; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+
+  """HTTP server on localhost serving files by Drive ID, in a background
+  thread.
+
+  Attributes:
+      files (dict): Drive ID => file contents
+      drop_after (dict): Drive ID => number of bytes after which the next
+        download of that file is cut off.
+      download_url (str): URL to pass as download_url to the downloader.
+      pages (dict): path => (page contents, modification time in seconds
+        since the epoch). Set a page again to change it.
+      requests (Counter): (path, status) => number of page requests answered.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, files, pages=None):
+    super().__init__(('127.0.0.1', 0), FakeDriveHandler)
+    self.files = files
+    self.drop_after = {}
+    self.pages = pages or {}
+    self.requests = Counter()
+    self.lock = threading.Lock()
+    self.download_url = 'http://127.0.0.1:%d/uc?export=download' % (
+        self.server_address[1])
+    self._thread = None
+
+  def page_url(self, path):
+    """Gets the URL of one of the pages."""
+    return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+  def __enter__(self):
+    self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+    self.server_close()
+
+  def handle_error(self, request, client_address):
+    # Clients closing their connections isn't an error worth a traceback.
+    pass
@@ -0,0 +1,434 @@
+"""SQLite index of every game, so questions like who each team fielded each
+week or on each map are answered with indexed queries instead of walking the
+team folders.
+Usage: python game_index.py team "Google BetaStar"
+  Players a team fielded each week and on each map.
+Usage: python game_index.py roster "Google BetaStar"
+  Games, wins, losses, races and weeks of each player of a team.
+Usage: python game_index.py h2h Feniks DarthNoob
+  Games between two players, or two teams.
+Usage: python game_index.py maps
+  Games on each map, with the winrate of each race matchup.
+Usage: python game_index.py build
+  Indexes the replays in UploadHere and the team folders. The organizer
+  indexes the replays it processes, this is only needed once for replays
+  organized before the index existed.
+
+Teams are matched like stats_for_team.sh matched team folders: every filter
+must be found in the team name, ignoring case, with _ matching spaces.
+
+Each game has one row in the players table per player, with the week, map
+and duration repeated, so every report reads a single indexed table.
+
+Game layout, as passed to GameIndex.add_game: a journal entry (see
+replay_journal.py), with teams, players and races alphabetized by team, and
+    path (str): Path of the replay in the upload folder.
+    results (list of bool): Whether each player won.
+    mmrs, apms (list of int): MMR and APM of each player.
+    duration (int): Length of the game in seconds.
+    time_utc (int): When the game was played, see replay_parser.py.
+
+Attributes:
+    GAME_INDEX_FILE (str): Default location of the index.
+    INDEX_VERSION (int): Bump this whenever the schema changes, the index is
+      then rebuilt from scratch.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import traceback
+
+import metrics
+
+GAME_INDEX_FILE = "data/game_index.sqlite3"
+INDEX_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+  sha256 TEXT PRIMARY KEY,
+  week TEXT, map TEXT, time_utc INTEGER, duration INTEGER, path TEXT);
+CREATE TABLE IF NOT EXISTS teams (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS players (
+  sha256 TEXT NOT NULL REFERENCES games (sha256) ON DELETE CASCADE,
+  week TEXT, map TEXT, duration INTEGER,
+  team TEXT, player TEXT, race TEXT,
+  opponent_team TEXT, opponent TEXT, opponent_race TEXT,
+  win INTEGER, mmr INTEGER, apm INTEGER, path TEXT,
+  PRIMARY KEY (sha256, player));
+CREATE INDEX IF NOT EXISTS players_team_week ON players (team, week);
+CREATE INDEX IF NOT EXISTS players_team_map ON players (team, map);
+CREATE INDEX IF NOT EXISTS players_player ON players (player COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS players_teams ON players (team, opponent_team);
+CREATE INDEX IF NOT EXISTS players_matchups
+  ON players (map, race, opponent_race, win);
+CREATE INDEX IF NOT EXISTS games_map ON games (map, duration);
+"""
+WEEK = re.compile(r'^(Preseason|Week|GapWeek|Round)(\d*)$')
+
+
+def week_sort_key(week):
+  """Sorts weeks in the order they're played: Preseason, Week1 to Week8,
+  Round1, GapWeek, then the other rounds."""
+  match = WEEK.match(week or '')
+  if not match:
+    return (3, 0, week or '')
+  kind, number = match.groups()
+  if kind == 'Preseason':
+    return (0, 0, '')
+  if kind == 'Week':
+    return (1, int(number), '')
+  if kind == 'GapWeek':
+    return (2, 1.5, '')
+  return (2, int(number), '')
+
+
+class GameIndex:
+
+  """Index of games, backed by an SQLite database.
+
+  Attributes:
+      filename (str): SQLite file backing the index. None keeps it in memory.
+  """
+
+  def __init__(self, filename=GAME_INDEX_FILE):
+    self.filename = filename
+    if filename:
+      directory = os.path.dirname(filename)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+    self.db = sqlite3.connect(filename or ':memory:')
+    self.db.execute('PRAGMA foreign_keys = ON')
+    if self.db.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+      self.db.executescript(
+          'DROP TABLE IF EXISTS players; DROP TABLE IF EXISTS games; '
+          'DROP TABLE IF EXISTS teams;')
+      self.db.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+    self.db.executescript(SCHEMA)
+
+  def add_game(self, game):
+    """Adds or replaces a game, see the module docstring for its layout."""
+    destinations = game.get('destinations') or [None, None]
+    self.db.executemany('INSERT OR IGNORE INTO teams VALUES (?)',
+                        [(team,) for team in game['teams']])
+    self.db.execute('DELETE FROM games WHERE sha256 = ?', (game['sha256'],))
+    self.db.execute(
+        'INSERT INTO games VALUES (?, ?, ?, ?, ?, ?)',
+        (game['sha256'], game['week'], game['map'], game['time_utc'],
+         game['duration'], game['path']))
+    self.db.executemany(
+        'INSERT OR REPLACE INTO players VALUES '
+        '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(game['sha256'], game['week'], game['map'], game['duration'],
+          game['teams'][i], game['players'][i], game['races'][i],
+          game['teams'][1 - i], game['players'][1 - i], game['races'][1 - i],
+          int(game['results'][i]), game['mmrs'][i], game['apms'][i],
+          destinations[i])
+         for i in (0, 1)])
+
+  def commit(self):
+    self.db.commit()
+
+  def close(self):
+    self.db.commit()
+    self.db.close()
+
+  def __len__(self):
+    return self.db.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+  def find_teams(self, filters):
+    """Gets the teams whose name contains every filter.
+
+    Args:
+        filters (list of string): ex: ["google", "beta"]
+
+    Returns:
+        list of string: matching team names
+    """
+    filters = [f.replace('_', ' ').lower() for f in filters]
+    teams = [row[0] for row in
+             self.db.execute('SELECT name FROM teams ORDER BY name')]
+    return [team for team in teams
+            if all(f in team.replace('_', ' ').lower() for f in filters)]
+
+  def players_by_week(self, team):
+    """Gets the players a team fielded each week.
+
+    Returns:
+        list of tuple: (week, list of player names), in week order.
+    """
+    weeks = {}
+    for week, player, race in self.db.execute(
+        'SELECT week, player, race FROM players WHERE team = ? '
+        'ORDER BY player COLLATE NOCASE', (team,)):
+      weeks.setdefault(week, []).append("%s (%s)" % (player, race))
+    return sorted(weeks.items(), key=lambda item: week_sort_key(item[0]))
+
+  def players_by_map(self, team):
+    """Gets the players a team fielded on each map.
+
+    Returns:
+        list of tuple: (map, list of (week, player name)), by map name.
+    """
+    maps = {}
+    for map_name, week, player, race in self.db.execute(
+        'SELECT map, week, player, race FROM players WHERE team = ? '
+        'ORDER BY map', (team,)):
+      maps.setdefault(map_name, []).append((week, "%s (%s)" % (player, race)))
+    return [(map_name, sorted(games, key=lambda game: (week_sort_key(game[0]),
+                                                       game[1].lower())))
+            for map_name, games in maps.items()]
+
+  def roster(self, team):
+    """Gets how much each player of a team played.
+
+    Returns:
+        list of dict: with keys player, games, wins, races and weeks, most
+          games first.
+    """
+    players = {}
+    for player, race, week, win in self.db.execute(
+        'SELECT player, race, week, win FROM players WHERE team = ?', (team,)):
+      stats = players.setdefault(player, {
+          'player': player, 'games': 0, 'wins': 0, 'races': set(),
+          'weeks': set()})
+      stats['games'] += 1
+      stats['wins'] += win
+      stats['races'].add(race)
+      stats['weeks'].add(week)
+    for stats in players.values():
+      stats['races'] = sorted(stats['races'])
+      stats['weeks'] = sorted(stats['weeks'], key=week_sort_key)
+    return sorted(players.values(),
+                  key=lambda stats: (-stats['games'], stats['player'].lower()))
+
+  def head_to_head(self, first, second):
+    """Gets the games between two players, or else two teams.
+
+    Args:
+        first, second (string): player names, or team filters
+
+    Returns:
+        list of sqlite3.Row: games from the point of view of first, with the
+          columns of the players table, in week order. None if first or
+          second matches neither a player nor a single team.
+    """
+    self.db.row_factory = sqlite3.Row
+    try:
+      games = self.db.execute(
+          'SELECT * FROM players WHERE player = ? COLLATE NOCASE '
+          'AND opponent = ? COLLATE NOCASE', (first, second)).fetchall()
+      if not games:
+        teams = [self.find_teams(name.split()) for name in (first, second)]
+        if any(len(matches) != 1 for matches in teams):
+          return None
+        games = self.db.execute(
+            'SELECT * FROM players WHERE team = ? AND opponent_team = ?',
+            (teams[0][0], teams[1][0])).fetchall()
+    finally:
+      self.db.row_factory = None
+    return sorted(games, key=lambda game: (week_sort_key(game['week']),
+                                           game['player'].lower()))
+
+  def player_weeks(self):
+    """Gets how each player did each week.
+
+    Returns:
+        list of tuple: (player, week, games, wins, highest MMR), MMR 0 if
+          it's unknown.
+    """
+    return self.db.execute(
+        'SELECT MIN(player), week, COUNT(*), SUM(win), MAX(mmr) FROM players '
+        'GROUP BY player COLLATE NOCASE, week').fetchall()
+
+  def map_pool(self):
+    """Gets the games played on each map.
+
+    Returns:
+        list of dict: with keys map, games, average duration in seconds, and
+          matchups (dict of matchup, ex: PvZ => [wins of the first race,
+          games], wins None in mirror matchups), most played first.
+    """
+    maps = {}
+    for map_name, games, duration in self.db.execute(
+        'SELECT map, COUNT(*), AVG(duration) FROM games GROUP BY map'):
+      maps[map_name] = {'map': map_name, 'games': games, 'duration': duration,
+                        'matchups': {}}
+    # Each game is counted once, from the point of view of the race that
+    # comes first alphabetically (or of both players in mirror matchups).
+    for map_name, race, opponent_race, wins, games in self.db.execute(
+        'SELECT map, race, opponent_race, SUM(win), COUNT(*) FROM players '
+        'WHERE race <= opponent_race GROUP BY map, race, opponent_race'):
+      if race == opponent_race:
+        # Always as many wins as losses, only the games say anything.
+        games //= 2
+        wins = None
+      maps[map_name]['matchups'][race + 'v' + opponent_race] = [wins, games]
+    return sorted(maps.values(), key=lambda m: (-m['games'], m['map']))
+
+
+def build_index(index, directory, cache=None, jobs=1):
+  """Indexes the replays in the upload folder and the team folders.
+
+  Args:
+      index (GameIndex): index to add the games to
+      directory (string): upload folder
+      cache (ReplayCache): cache of decoded replays. Uses the default
+        on-disk cache if not given.
+      jobs (int): number of processes used to decode replays
+
+  Returns:
+      int: number of games indexed
+  """
+  # replay_organizer imports this module.
+  import cea_team_name_parser
+  import replay_cache
+  import replay_organizer
+  import replay_parser
+  from consts import TEAMS_FILE
+
+  if cache is None:
+    cache = replay_cache.ReplayCache()
+  teams, aliases = cea_team_name_parser.init_dictionary(TEAMS_FILE)
+  alias_index = cea_team_name_parser.AliasIndex(aliases)
+  week_time = replay_organizer.define_cea_date_ranges()
+
+  paths = [os.path.join(directory, replay)
+           for replay in replay_parser.list_replays(directory)]
+  paths += [os.path.normpath(path) for path in replay_parser.find_team_replays()]
+  print("Found %d replays to index" % len(paths))
+  records = cache.get_many(paths, jobs)
+
+  # The same game is in the upload folder and in both teams' folders, and
+  # may have been uploaded by both players.
+  copies = {}
+  for path, (record, error) in zip(paths, records):
+    if record is not None:
+      copies.setdefault(record['fingerprint'], []).append((path, record))
+  cache.save()
+
+  for game_copies in copies.values():
+    path, record = game_copies[0]
+    sha = cache.sha256(path)
+    try:
+      names, races, teams_played, week, order = replay_organizer.describe_game(
+          record, teams, alias_index, week_time)
+      map_name = replay_organizer.normalize_map(record['map_title'])
+      # The organizer doesn't file these either.
+      if map_name is None or replay_organizer.UNKNOWN_TEAM in teams_played:
+        continue
+      destinations = [
+          next((copy for copy, _ in game_copies
+                if copy.startswith(team.replace(" ", "_") + os.sep)), None)
+          for team in teams_played]
+      index.add_game(dict(
+          sha256=sha, week=week, teams=teams_played, players=names,
+          races=races, map=map_name, path=path, destinations=destinations,
+          **replay_organizer.game_results(record, order)))
+    except:
+      metrics.record_failure('index', sys.exc_info()[1])
+      print("Error indexing replay: %s" % path)
+      traceback.print_exc()
+  index.commit()
+  return len(copies)
+
+
+def print_team(index, team):
+  """Prints the players a team fielded each week and on each map, like
+  stats_for_team.sh did."""
+  print(">>Players fielded each week:")
+  for week, players in index.players_by_week(team):
+    print("")
+    print(week)
+    for player in players:
+      print("    %s" % player)
+  print("")
+  print(">>Players fielded on each map:")
+  for map_name, games in index.players_by_map(team):
+    print("")
+    print(map_name)
+    for week, player in games:
+      print("\t%s\t%s" % (week, player))
+
+
+def print_roster(index, team):
+  for stats in index.roster(team):
+    print("%-20s %3d games %3d-%-3d %-5s %s" % (
+        stats['player'], stats['games'], stats['wins'],
+        stats['games'] - stats['wins'], ','.join(stats['races']),
+        ' '.join(stats['weeks'])))
+
+
+def print_head_to_head(games):
+  wins = sum(game['win'] for game in games)
+  print("%d-%d in %d games" % (wins, len(games) - wins, len(games)))
+  for game in games:
+    print("\t%s\t%s\t%s (%s) %s %s (%s)" % (
+        game['week'], game['map'], game['player'], game['race'],
+        "beat" if game['win'] else "lost to", game['opponent'],
+        game['opponent_race']))
+
+
+def print_map_pool(index):
+  for stats in index.map_pool():
+    matchups = ', '.join(
+        "%s %d games" % (matchup, games) if wins is None
+        else "%s %d-%d" % (matchup, wins, games - wins)
+        for matchup, (wins, games) in sorted(stats['matchups'].items()))
+    print("%-24s %4d games, %2d:%02d average  %s" % (
+        stats['map'], stats['games'], stats['duration'] // 60,
+        stats['duration'] % 60, matchups))
+
+
+def query(args):
+  index = GameIndex()
+  if args.command == 'build':
+    print("Indexed %d games" % build_index(index, "UploadHere/", jobs=args.jobs))
+  elif args.command == 'maps':
+    with metrics.timer('index.query'):
+      print_map_pool(index)
+  elif args.command == 'h2h':
+    if len(args.names) != 2:
+      print("Provide two players or teams. For example,")
+      print('    python game_index.py h2h Feniks DarthNoob')
+      return
+    with metrics.timer('index.query'):
+      games = index.head_to_head(*args.names)
+      if games is None:
+        print("Those names match neither two players nor two teams.")
+      else:
+        print_head_to_head(games)
+  else:
+    if not args.names:
+      print("Provide a team name. For example,")
+      print('    python game_index.py %s "Google BetaStar"' % args.command)
+      return
+    with metrics.timer('index.query'):
+      matches = index.find_teams(args.names)
+      if not matches:
+        print("No teams were matched by those filters.")
+      elif len(matches) > 1:
+        print("Multiple teams matched:")
+        print('\n'.join(matches))
+      elif args.command == 'team':
+        print_team(index, matches[0])
+      else:
+        print_roster(index, matches[0])
+  index.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Query the index of games')
+  parser.add_argument('command', choices=['team', 'roster', 'h2h', 'maps', 'build'],
+                      help='team: players fielded each week and on each map, '
+                           'roster: games of each player of a team, '
+                           'h2h: games between two players or teams, '
+                           'maps: games and matchups on each map, '
+                           'build: index the replays already organized')
+  parser.add_argument('names', nargs='*',
+                      help='Team filters, or the two players or teams for h2h')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays for build')
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+  metrics.run(args, query, args)
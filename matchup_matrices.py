@@ -0,0 +1,361 @@
+"""Head-to-head records of the season as NumPy win/loss matrices: player vs
+player, team vs team, race vs race and map vs race.
+Usage: python matchup_matrices.py
+To only count one week or one map,
+  python matchup_matrices.py --week Week3 --map "Ephemeron LE"
+To see the record of a team or player against each opponent,
+  python matchup_matrices.py --team "Alexa 12 Pool" --player Feniks
+
+Games are collected as rows of label indices, and each matrix is counted from
+every game at once the first time it's asked for. Matrices are kept for the
+run, so every report reuses them instead of looping over the records again.
+
+There are few races and maps, so their matrices are dense and counted with
+np.bincount: wins('race')[i, j] is the number of games the i-th race won
+against the j-th, so the games between them are wins[i, j] + wins[j, i].
+Most players and teams never meet, so their matrices are sparse: pairs(kind)
+only has the (winner, loser) pairs that were played, counted with np.unique.
+
+Attributes:
+    KINDS (list of str): Kinds of labels with a head-to-head matrix.
+    DENSE_KINDS (list of str): Kinds whose matrix is dense, see wins().
+    RACES (list of str): Races, in matrix order.
+    RACE_MATCHUPS (list of str): Matchups between different races, the first
+      race's wins are counted.
+"""
+import argparse
+import os
+import sys
+import traceback
+
+import numpy as np
+
+import cea_team_name_parser
+import metrics
+import replay_cache
+import replay_fingerprints
+import replay_parser
+import replay_quarantine
+from consts import STARTING_DATE, TEAMS_FILE
+from replay_organizer import (REPLAY_DIRECTORY, define_cea_date_ranges,
+                              describe_game, normalize_map)
+
+KINDS = ['player', 'team', 'race']
+DENSE_KINDS = ['race']
+RACES = ['P', 'T', 'Z']
+RACE_MATCHUPS = ['PvZ', 'PvT', 'ZvT']
+
+# Columns of a game row: its week and map, then both players' player, team
+# and race, and the index of the winner.
+WEEK, MAP, PLAYER, TEAM, RACE, WINNER = 0, 1, 2, 4, 6, 8
+COLUMNS = {'player': PLAYER, 'team': TEAM, 'race': RACE}
+
+
+class MatchupMatrices:
+
+  """Win/loss matrices of a set of games.
+
+  Attributes:
+      labels (dict): kind => list of labels, in matrix order. Kinds are
+        KINDS plus 'week' and 'map'.
+  """
+
+  def __init__(self):
+    self.labels = {kind: [] for kind in KINDS + ['week', 'map']}
+    self.labels['race'] = list(RACES)
+    self._indices = {kind: {label: i for i, label in enumerate(labels)}
+                     for kind, labels in self.labels.items()}
+    self._rows = []
+    self._games = None
+    self._matrices = {}
+
+  def _index(self, kind, label):
+    indices = self._indices[kind]
+    if label not in indices:
+      indices[label] = len(indices)
+      self.labels[kind].append(label)
+    return indices[label]
+
+  def add_game(self, week, map_name, players, teams, races, winner):
+    """Adds a game with one winner.
+
+    Args:
+        week (string): week the game was played, ex: Week4
+        map_name (string): map the game was played on
+        players, teams, races (list of string): of both players
+        winner (int): index of the player who won
+    """
+    row = [self._index('week', week), self._index('map', map_name)]
+    for kind, labels in (('player', players), ('team', teams), ('race', races)):
+      row += [self._index(kind, label) for label in labels]
+    row.append(winner)
+    self._rows.append(row)
+    self._games = None
+    self._matrices = {}
+
+  @property
+  def games(self):
+    """np.ndarray: one row of label indices per game."""
+    if self._games is None:
+      self._games = np.array(self._rows, dtype=np.intp).reshape(-1, WINNER + 1)
+    return self._games
+
+  def _select(self, week=None, map_name=None):
+    """Gets the games played in a week and on a map, both if None."""
+    games = self.games
+    mask = np.ones(len(games), dtype=bool)
+    for kind, column, label in (('week', WEEK, week), ('map', MAP, map_name)):
+      if label is not None:
+        mask &= games[:, column] == self._indices[kind].get(label, -1)
+    return games[mask]
+
+  def _winners_losers(self, kind, week=None, map_name=None):
+    """Gets the label indices of the winner and loser of each game."""
+    games = self._select(week, map_name)
+    column = COLUMNS[kind]
+    won = games[:, WINNER] == 0
+    winners = np.where(won, games[:, column], games[:, column + 1])
+    losers = np.where(won, games[:, column + 1], games[:, column])
+    return winners, losers
+
+  def wins(self, kind, week=None, map_name=None):
+    """Gets a dense head-to-head matrix.
+
+    Args:
+        kind (string): one of DENSE_KINDS
+        week (string): only count the games of this week, if given
+        map_name (string): only count the games on this map, if given
+
+    Returns:
+        np.ndarray: wins[i, j] is the number of games labels[kind][i] won
+          against labels[kind][j].
+    """
+    if kind not in DENSE_KINDS:
+      raise ValueError("The %s matrix is sparse, see pairs()" % kind)
+    key = (kind, week, map_name)
+    if key not in self._matrices:
+      winners, losers = self._winners_losers(kind, week, map_name)
+      size = len(self.labels[kind])
+      self._matrices[key] = np.bincount(
+          winners * size + losers, minlength=size * size).reshape(size, size)
+    return self._matrices[key]
+
+  def pairs(self, kind, week=None, map_name=None):
+    """Gets a sparse head-to-head matrix, in coordinate form.
+
+    Args:
+        kind (string): one of KINDS
+        week (string): only count the games of this week, if given
+        map_name (string): only count the games on this map, if given
+
+    Returns:
+        tuple: (winners, losers, wins) np.ndarray of the same length, one
+          entry per pair of labels that played: labels[kind][winners[k]] won
+          wins[k] games against labels[kind][losers[k]]. Sorted by winner,
+          then loser.
+    """
+    key = ('pairs', kind, week, map_name)
+    if key not in self._matrices:
+      winners, losers = self._winners_losers(kind, week, map_name)
+      size = len(self.labels[kind])
+      played, wins = np.unique(winners * size + losers, return_counts=True)
+      self._matrices[key] = (played // size, played % size, wins)
+    return self._matrices[key]
+
+  def map_race_wins(self, week=None):
+    """Gets the wins and losses of each race on each map, without mirror
+    matchups.
+
+    Args:
+        week (string): only count the games of this week, if given
+
+    Returns:
+        tuple: (wins, losses), np.ndarray with one row per map and one
+          column per race.
+    """
+    key = ('map race', week, None)
+    if key not in self._matrices:
+      games = self._select(week)
+      games = games[games[:, RACE] != games[:, RACE + 1]]
+      won = games[:, WINNER] == 0
+      winners = np.where(won, games[:, RACE], games[:, RACE + 1])
+      losers = np.where(won, games[:, RACE + 1], games[:, RACE])
+      size = len(self.labels['map']) * len(RACES)
+      shape = (len(self.labels['map']), len(RACES))
+      maps = games[:, MAP] * len(RACES)
+      self._matrices[key] = (
+          np.bincount(maps + winners, minlength=size).reshape(shape),
+          np.bincount(maps + losers, minlength=size).reshape(shape))
+    return self._matrices[key]
+
+  def record(self, kind, label, week=None, map_name=None):
+    """Gets the record of a player, team or race against each opponent.
+
+    Returns:
+        list of tuple: (opponent, wins, losses) of every opponent faced, most
+          games first.
+    """
+    if label not in self._indices[kind]:
+      return []
+    i = self._indices[kind][label]
+    winners, losers, wins = self.pairs(kind, week, map_name)
+    # opponent index => [wins, losses]
+    records = {}
+    won, lost = winners == i, losers == i
+    for j, count in zip(losers[won].tolist(), wins[won].tolist()):
+      records.setdefault(j, [0, 0])[0] += count
+    for j, count in zip(winners[lost].tolist(), wins[lost].tolist()):
+      records.setdefault(j, [0, 0])[1] += count
+    opponents = sorted(records, key=lambda j: (-sum(records[j]),
+                                               self.labels[kind][j]))
+    return [(self.labels[kind][j], records[j][0], records[j][1])
+            for j in opponents]
+
+
+def race_matchups(matrices, week=None, map_name=None):
+  """Gets the record of each matchup between different races.
+
+  Returns:
+      dict: matchup, ex: PvZ => [wins of the first race, games]
+  """
+  wins = matrices.wins('race', week, map_name)
+  matchups = {}
+  for matchup in RACE_MATCHUPS:
+    first, second = RACES.index(matchup[0]), RACES.index(matchup[2])
+    matchups[matchup] = [int(wins[first, second]),
+                         int(wins[first, second] + wins[second, first])]
+  return matchups
+
+
+def winrate(wins, games):
+  return "%.1f%%" % (100 * wins / games) if games else "-"
+
+
+def print_race_matchups(matrices, week=None, map_name=None):
+  for matchup, (wins, games) in race_matchups(matrices, week, map_name).items():
+    print("%s: %d-%d (%s)" % (matchup, wins, games - wins, winrate(wins, games)))
+
+
+def print_map_races(matrices, week=None):
+  wins, losses = matrices.map_race_wins(week)
+  width = max([len(name) for name in matrices.labels['map']] + [3])
+  print(("%-*s  %s" % (width, "Map", "  ".join("%-12s" % race for race in RACES))).rstrip())
+  for i, map_name in enumerate(matrices.labels['map']):
+    cells = ["%-12s" % ("%d-%d %s" % (wins[i, j], losses[i, j],
+                                      winrate(wins[i, j], wins[i, j] + losses[i, j])))
+             for j in range(len(RACES))]
+    print(("%-*s  %s" % (width, map_name, "  ".join(cells))).rstrip())
+
+
+def print_record(matrices, kind, label, week=None, map_name=None):
+  record = matrices.record(kind, label, week, map_name)
+  if not record:
+    print("No games found for %s" % label)
+    return
+  print("%s:" % label)
+  for opponent, wins, losses in record:
+    print("\tvs %s: %d-%d" % (opponent, wins, losses))
+
+
+class MatrixStage:
+
+  """Builds the matchup matrices from replay records.
+
+  Attributes:
+      matrices (MatchupMatrices): games added so far
+  """
+
+  def __init__(self, teams, aliases, alias_index=None,
+               starting_date=STARTING_DATE):
+    self.teams = teams
+    self.alias_index = alias_index or cea_team_name_parser.AliasIndex(aliases)
+    self.week_time = define_cea_date_ranges(starting_date)
+    self.matrices = MatchupMatrices()
+
+  def add(self, replay, record):
+    player_names, player_races, player_teams, week_played, player_order = (
+        describe_game(record, self.teams, self.alias_index, self.week_time))
+    results = [record['players'][i]['result'] == 1 for i in player_order]
+    # Games without exactly one winner don't count.
+    if results.count(True) != 1:
+      return
+    map_name = normalize_map(record['map_title']) or record['map_title']
+    self.matrices.add_game(week_played, map_name, player_names, player_teams,
+                           player_races, results.index(True))
+
+  def finish(self):
+    with metrics.timer('matrices.build'):
+      for kind in KINDS:
+        self.matrices.pairs(kind)
+      for kind in DENSE_KINDS:
+        self.matrices.wins(kind)
+      self.matrices.map_race_wins()
+    print("Race matchups:")
+    print_race_matchups(self.matrices)
+    print_map_races(self.matrices)
+
+
+def build_matrices(directory, teams_file=TEAMS_FILE, cache=None, jobs=1):
+  """Builds the matchup matrices of every replay in a directory.
+
+  Returns:
+      MatchupMatrices: games of the replays that could be decoded
+  """
+  if cache is None:
+    cache = replay_cache.ReplayCache(
+        quarantine=replay_quarantine.Quarantine())
+  teams, aliases = cea_team_name_parser.init_dictionary(teams_file)
+  stage = MatrixStage(teams, aliases)
+
+  replays = replay_parser.list_replays(directory)
+  print("Found %d replays to scan" % len(replays))
+  paths = [os.path.join(directory, replay) for replay in replays]
+  records = cache.get_many(paths, jobs)
+  # Each game only counts once, however many replays of it were uploaded.
+  fingerprints = replay_fingerprints.FingerprintIndex()
+  replays, paths, records = fingerprints.drop_duplicates(replays, paths,
+                                                         records)
+  for replay, (record, error) in zip(replays, records):
+    if error:
+      print("Error processing replay: %s" % replay)
+      print(error, end='')
+      continue
+    with metrics.timer('matrices.add'):
+      try:
+        stage.add(replay, record)
+      except:
+        metrics.record_failure('matrices', sys.exc_info()[1])
+        print("Error processing replay: %s" % replay)
+        traceback.print_exc()
+  cache.save()
+  return stage.matrices
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Print head-to-head records of races, teams and players')
+  parser.add_argument('--week', dest='week',
+                      help='Only count the games of this week, ex: Week3')
+  parser.add_argument('--map', dest='map_name',
+                      help='Only count the games on this map')
+  parser.add_argument('--team', dest='teams', action='append', default=[],
+                      help='Print the record of this team against each team')
+  parser.add_argument('--player', dest='players', action='append', default=[],
+                      help='Print the record of this player against each player')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+
+  def main():
+    matrices = build_matrices(REPLAY_DIRECTORY, jobs=args.jobs)
+    print("Race matchups:")
+    print_race_matchups(matrices, args.week, args.map_name)
+    if args.map_name is None:
+      print_map_races(matrices, args.week)
+    for team in args.teams:
+      print_record(matrices, 'team', team, args.week, args.map_name)
+    for player in args.players:
+      print_record(matrices, 'player', player, args.week, args.map_name)
+
+  metrics.run(args, main)
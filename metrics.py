@@ -0,0 +1,221 @@
+"""Collects timings and counts while the replay scripts run, to find out which
+stages, replays or builds take the time.
+
+The scripts record into one registry per process through the functions of
+this module, and their --metrics-json flag writes it out when they're done.
+Recording is cheap enough to always be on. --profile also runs the script
+under cProfile.
+
+Metrics:
+    timers: Per timer name, the number of calls, total, min and max seconds,
+            and a histogram of the durations in power of 2 milliseconds.
+    counters: Named counts, ex: cache.hits, bytes.decoded, the size of the
+              replays decoded, and bytes.read, the part of them read.
+    builds: Per base build, the number of replays decoded and seconds spent.
+    slowest: The SLOWEST_N replays that took the longest to decode.
+    failures: Number of failures by stage and exception type.
+
+Attributes:
+    SLOWEST_N (int): Number of slowest replays kept.
+"""
+import contextlib
+import heapq
+import json
+import math
+import os
+import time
+from collections import Counter, defaultdict
+
+SLOWEST_N = 10
+
+
+class Timer:
+
+  """Durations recorded under one name."""
+
+  __slots__ = ('count', 'total', 'min', 'max', 'histogram')
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.min = math.inf
+    self.max = 0.0
+    # upper bound in milliseconds => number of durations
+    self.histogram = Counter()
+
+  def add(self, seconds):
+    self.count += 1
+    self.total += seconds
+    self.min = min(self.min, seconds)
+    self.max = max(self.max, seconds)
+    bucket = 1
+    while bucket < seconds * 1000:
+      bucket <<= 1
+    self.histogram[bucket] += 1
+
+  def to_dict(self):
+    return {'count': self.count, 'total': self.total,
+            'mean': self.total / self.count if self.count else 0,
+            'min': self.min if self.count else 0, 'max': self.max,
+            'histogram_ms': {'<=%d' % bucket: count for bucket, count
+                             in sorted(self.histogram.items())}}
+
+
+class Metrics:
+
+  """Registry of metrics, see the module docstring."""
+
+  def __init__(self):
+    self.timers = defaultdict(Timer)
+    self.counters = Counter()
+    self.builds = defaultdict(Timer)
+    self.slowest = []
+    self.failures = Counter()
+
+  def to_dict(self):
+    hits, misses = self.counters['cache.hits'], self.counters['cache.misses']
+    return {
+        'timers': {name: timer.to_dict()
+                   for name, timer in sorted(self.timers.items())},
+        'counters': dict(sorted(self.counters.items())),
+        'cache_hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'builds': {str(build): timer.to_dict() for build, timer
+                   in sorted(self.builds.items(), key=lambda item: str(item[0]))},
+        'slowest': [{'path': path, 'seconds': seconds, 'base_build': build}
+                    for seconds, path, build in sorted(self.slowest, reverse=True)],
+        'failures': [{'stage': stage, 'exception': exception, 'count': count}
+                     for (stage, exception), count in self.failures.most_common()],
+    }
+
+
+_registry = Metrics()
+
+
+def count(name, n=1):
+  _registry.counters[name] += n
+
+
+def observe(name, seconds):
+  """Records a duration under a timer name."""
+  _registry.timers[name].add(seconds)
+
+
+@contextlib.contextmanager
+def timer(name):
+  """Records how long the block takes under a timer name."""
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    _registry.timers[name].add(time.perf_counter() - start)
+
+
+def record_replay(path, seconds, size, base_build=None, bytes_read=0):
+  """Records how long a replay took to decode.
+
+  Args:
+      path (string): path of the replay file
+      seconds (float): time spent decoding it
+      size (int): size of the file in bytes
+      base_build (int): build of the replay, None if it couldn't be read
+      bytes_read (int): bytes of the file read to decode it
+  """
+  _registry.timers['decode'].add(seconds)
+  _registry.counters['bytes.decoded'] += size
+  _registry.counters['bytes.read'] += bytes_read
+  _registry.builds[base_build].add(seconds)
+  item = (seconds, path, base_build)
+  if len(_registry.slowest) < SLOWEST_N:
+    heapq.heappush(_registry.slowest, item)
+  elif item > _registry.slowest[0]:
+    heapq.heapreplace(_registry.slowest, item)
+
+
+def record_failure(stage, exception):
+  """Counts a failure in a stage.
+
+  Args:
+      stage (string): where it failed, ex: decode, organize
+      exception (Exception or string): the exception or its type name
+  """
+  if isinstance(exception, BaseException):
+    exception = type(exception).__name__
+  _registry.failures[(stage, exception)] += 1
+
+
+def print_summary(n=5):
+  """Prints the slowest timers and replays, the cache hit ratio and the
+  failures."""
+  metrics = _registry.to_dict()
+  print("Metrics:")
+  timers = sorted(metrics['timers'].items(), key=lambda item: -item[1]['total'])
+  for name, timer_dict in timers[:n]:
+    print("\t%-24s %8.3f s over %d calls (max %.3f s)" % (
+        name, timer_dict['total'], timer_dict['count'], timer_dict['max']))
+  if metrics['cache_hit_ratio'] is not None:
+    print("\tcache hit ratio: %.1f%%" % (metrics['cache_hit_ratio'] * 100))
+  counters = metrics['counters']
+  if counters.get('bytes.decoded'):
+    print("\tbytes read: %d of %d decoded (%.1f%%)" % (
+        counters.get('bytes.read', 0), counters['bytes.decoded'],
+        counters.get('bytes.read', 0) / counters['bytes.decoded'] * 100))
+  for replay in metrics['slowest'][:n]:
+    print("\tslow replay: %.3f s %s (build %s)" % (
+        replay['seconds'], replay['path'], replay['base_build']))
+  for failure in metrics['failures']:
+    print("\tfailures: %d %s in %s" % (
+        failure['count'], failure['exception'], failure['stage']))
+
+
+def add_arguments(parser):
+  """Adds the --profile and --metrics-json flags to a script's parser."""
+  parser.add_argument('--metrics-json', dest='metrics_json',
+                      help='Write timings, counts and failures to this JSON file')
+  parser.add_argument('--profile', dest='profile',
+                      help='Run under cProfile and write the stats to this file')
+
+
+def run(args, function, *function_args, **function_kwargs):
+  """Runs a script's main function, under cProfile if --profile was given,
+  and writes the metrics if --metrics-json was given.
+
+  Args:
+      args (Namespace): parsed arguments, see add_arguments
+      function (callable): main function of the script
+
+  Returns:
+      What the function returned.
+  """
+  profiler = None
+  if args.profile:
+    # Only import the profiler when it's used, it slows down startup.
+    import cProfile
+    profiler = cProfile.Profile()
+  start = time.perf_counter()
+  try:
+    if profiler:
+      result = profiler.runcall(function, *function_args, **function_kwargs)
+    else:
+      result = function(*function_args, **function_kwargs)
+  except BaseException as e:
+    record_failure('main', e)
+    raise
+  finally:
+    observe('total', time.perf_counter() - start)
+    if profiler:
+      import io
+      import pstats
+      profiler.dump_stats(args.profile)
+      stream = io.StringIO()
+      pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+      print(stream.getvalue())
+      print("Saved profile to %s" % args.profile)
+    if args.metrics_json:
+      directory = os.path.dirname(args.metrics_json)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      with open(args.metrics_json, 'w') as f:
+        json.dump(_registry.to_dict(), f, indent=2)
+      print_summary()
+      print("Saved metrics to %s" % args.metrics_json)
+  return result
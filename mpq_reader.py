@@ -0,0 +1,323 @@
+"""Reads the MPQ archives replays are stored in, through a memory mapping.
+
+A replay is a user data header, holding the replay header, followed by an
+MPQ archive whose hash table and block table (both encrypted) give where each
+file is stored. MPQReader maps the replay and only parses those when it's
+opened, a few hundred bytes, then reads and decompresses a file straight from
+the mapping when it's asked for. Decoding a replay's record only needs the
+header, replay.details and replay.gamemetadata.json, a small part of the
+file; the game events, the bulk of it, are never touched.
+
+check_archive does the same parsing to tell whether a file is a replay
+without decoding anything, so a file that isn't a replay, is truncated or is
+missing replay.details is rejected long before s2protocol would fail on it.
+
+Attributes:
+    USER_DATA_MAGIC (bytes): First bytes of a replay.
+    ARCHIVE_MAGIC (bytes): First bytes of the MPQ header.
+    REQUIRED_FILES (list of str): Files decoding a replay can't do without.
+"""
+import bz2
+import mmap
+import os
+import struct
+import zlib
+
+USER_DATA_MAGIC = b'MPQ\x1b'
+ARCHIVE_MAGIC = b'MPQ\x1a'
+REQUIRED_FILES = ['replay.details']
+
+USER_DATA_HEADER = struct.Struct('<4s3I')
+ARCHIVE_HEADER = struct.Struct('<4s2I2H4I')
+TABLE_ENTRY_SIZE = 16
+# Seeds of mpq_hash, by hash type.
+TABLE_OFFSET, HASH_A, HASH_B, TABLE = 0, 1, 2, 3
+HASH_ENTRY_EMPTY = 0xFFFFFFFF
+# Block flags.
+FILE_COMPRESS = 0x00000200
+FILE_ENCRYPTED = 0x00010000
+FILE_SINGLE_UNIT = 0x01000000
+FILE_SECTOR_CRC = 0x04000000
+FILE_EXISTS = 0x80000000
+# First byte of a compressed sector.
+COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_BZIP2 = 0x00, 0x02, 0x10
+
+
+class InvalidReplay(ValueError):
+  """A file that can't be decoded as a replay."""
+
+
+def _crypt_table():
+  seed = 0x00100001
+  table = [0] * 0x500
+  for i in range(0x100):
+    for j in range(5):
+      seed = (seed * 125 + 3) % 0x2AAAAB
+      high = (seed & 0xFFFF) << 16
+      seed = (seed * 125 + 3) % 0x2AAAAB
+      table[i + j * 0x100] = high | (seed & 0xFFFF)
+  return table
+
+
+CRYPT_TABLE = _crypt_table()
+
+
+def mpq_hash(name, hash_type):
+  """Hashes a file name or table name with MPQ's hash function.
+
+  Args:
+      name (string): name to hash, case insensitive
+      hash_type (int): TABLE_OFFSET, HASH_A, HASH_B or TABLE
+
+  Returns:
+      int: 32 bit hash
+  """
+  seed1, seed2 = 0x7FED7FED, 0xEEEEEEEE
+  for ch in name.upper().encode('utf-8'):
+    seed1 = CRYPT_TABLE[(hash_type << 8) + ch] ^ ((seed1 + seed2) & 0xFFFFFFFF)
+    seed2 = (ch + seed1 + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+  return seed1
+
+
+def decrypt(words, key):
+  """Decrypts a hash table or block table.
+
+  Args:
+      words (sequence of int): encrypted table, as 32 bit words
+      key (int): mpq_hash of the table's name
+
+  Returns:
+      list of int: decrypted 32 bit words
+  """
+  seed2 = 0xEEEEEEEE
+  result = []
+  for word in words:
+    seed2 = (seed2 + CRYPT_TABLE[0x400 + (key & 0xFF)]) & 0xFFFFFFFF
+    value = word ^ ((key + seed2) & 0xFFFFFFFF)
+    result.append(value)
+    key = ((((~key) << 21) + 0x11111111) | (key >> 11)) & 0xFFFFFFFF
+    seed2 = (value + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+  return result
+
+
+def find_block(hash_table, name):
+  """Looks up a file in the hash table.
+
+  Args:
+      hash_table (list of tuple): (hash_a, hash_b, locale and platform,
+        block index) of each hash table entry
+      name (string): name of the file in the archive
+
+  Returns:
+      int: index of the file in the block table, None if it isn't there.
+  """
+  hash_a, hash_b = mpq_hash(name, HASH_A), mpq_hash(name, HASH_B)
+  start = mpq_hash(name, TABLE_OFFSET) % len(hash_table)
+  for i in range(len(hash_table)):
+    entry_a, entry_b, locale_platform, block_index = hash_table[
+        (start + i) % len(hash_table)]
+    if block_index == HASH_ENTRY_EMPTY:
+      return None
+    if entry_a == hash_a and entry_b == hash_b:
+      return block_index
+  return None
+
+
+def _decompress(data):
+  compression = data[0]
+  try:
+    if compression == COMPRESSION_ZLIB:
+      return zlib.decompress(data[1:])
+    if compression == COMPRESSION_BZIP2:
+      return bz2.decompress(data[1:])
+  except (zlib.error, OSError, ValueError) as e:
+    raise InvalidReplay("Corrupted compressed data: %s" % e)
+  if compression == COMPRESSION_NONE:
+    return bytes(data[1:])
+  raise InvalidReplay("Unsupported compression type %d" % compression)
+
+
+class MPQReader:
+
+  """Replay mapped in memory, whose files are read as they're asked for.
+  Use it as a context manager, or close() it, to unmap the file.
+
+  Attributes:
+      path (str): path of the replay file.
+      size (int): size of the file in bytes.
+      user_data (bytes): content of the user data header, the replay header.
+      offset (int): where the MPQ archive starts in the file.
+      archive_size (int): size of the MPQ archive in bytes.
+      hash_table (list of tuple): (hash_a, hash_b, locale and platform,
+        block index) of each hash table entry.
+      block_table (list of tuple): (offset, archived size, size, flags) of
+        each block table entry.
+      bytes_read (int): bytes of the file parsed so far.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.bytes_read = 0
+    self._map = None
+    self._view = None
+    self._file = open(path, 'rb')
+    try:
+      self.size = os.fstat(self._file.fileno()).st_size
+      if self.size < USER_DATA_HEADER.size + ARCHIVE_HEADER.size:
+        raise InvalidReplay("Too small to be a replay: %d bytes" % self.size)
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+      self._view = memoryview(self._map)
+      self._read_header()
+      self.hash_table = self._read_table('hash')
+      self.block_table = self._read_table('block')
+    except:
+      self.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    if self._view is not None:
+      self._view.release()
+      self._view = None
+    if self._map is not None:
+      self._map.close()
+      self._map = None
+    self._file.close()
+
+  def _read_header(self):
+    magic, user_data_size, offset, user_data_header_size = (
+        USER_DATA_HEADER.unpack_from(self._map, 0))
+    if magic != USER_DATA_MAGIC:
+      raise InvalidReplay("Not a replay, starts with %r" % magic)
+    if (user_data_header_size > user_data_size
+        or USER_DATA_HEADER.size + user_data_header_size > offset
+        or offset + ARCHIVE_HEADER.size > self.size):
+      raise InvalidReplay("Invalid user data header: size %d of %d, MPQ "
+                          "header at byte %d of %d" % (
+                              user_data_header_size, user_data_size, offset,
+                              self.size))
+    self.user_data = self._map[USER_DATA_HEADER.size:
+                               USER_DATA_HEADER.size + user_data_header_size]
+
+    (magic, header_size, archive_size, format_version, sector_size_shift,
+     hash_table_offset, block_table_offset, hash_table_entries,
+     block_table_entries) = ARCHIVE_HEADER.unpack_from(self._map, offset)
+    self.bytes_read += (USER_DATA_HEADER.size + user_data_header_size
+                        + ARCHIVE_HEADER.size)
+    if magic != ARCHIVE_MAGIC:
+      raise InvalidReplay("No MPQ header at byte %d" % offset)
+    if header_size < ARCHIVE_HEADER.size or not hash_table_entries:
+      raise InvalidReplay("Invalid MPQ header: %d bytes, %d hash table "
+                          "entries" % (header_size, hash_table_entries))
+    if offset + archive_size > self.size:
+      raise InvalidReplay("Truncated: archive of %d bytes, %d in the file" % (
+          archive_size, self.size - offset))
+    self.offset = offset
+    self.archive_size = archive_size
+    self.sector_size = 512 << sector_size_shift
+    self._tables = {'hash': (hash_table_offset, hash_table_entries),
+                    'block': (block_table_offset, block_table_entries)}
+
+  def _read_table(self, name):
+    table_offset, entries = self._tables[name]
+    if table_offset + entries * TABLE_ENTRY_SIZE > self.archive_size:
+      raise InvalidReplay("%s table of %d entries at byte %d is past the end "
+                          "of the archive" % (name.capitalize(), entries,
+                                              table_offset))
+    words = struct.unpack_from('<%dI' % (entries * 4), self._map,
+                               self.offset + table_offset)
+    self.bytes_read += entries * TABLE_ENTRY_SIZE
+    words = decrypt(words, mpq_hash('(%s table)' % name, TABLE))
+    return [tuple(words[i:i + 4]) for i in range(0, len(words), 4)]
+
+  def _block(self, name):
+    """Gets the block table entry of a file, None if it isn't there."""
+    block_index = find_block(self.hash_table, name)
+    if block_index is None or block_index >= len(self.block_table):
+      return None
+    block = self.block_table[block_index]
+    if not block[3] & FILE_EXISTS:
+      return None
+    return block
+
+  def check(self, required_files=REQUIRED_FILES):
+    """Checks that files are in the archive, and not cut off.
+
+    Raises:
+        InvalidReplay: if one isn't, with the reason.
+    """
+    for name in required_files:
+      block = self._block(name)
+      if block is None:
+        raise InvalidReplay("Missing %s" % name)
+      offset, archived_size, size, flags = block
+      if offset + archived_size > self.archive_size:
+        raise InvalidReplay("Truncated: %s ends at byte %d of %d" % (
+            name, offset + archived_size, self.archive_size))
+
+  def read_file(self, name):
+    """Reads and decompresses a file of the archive.
+
+    Args:
+        name (string): name of the file in the archive, ex: replay.details
+
+    Returns:
+        bytes: contents of the file, None if it isn't in the archive.
+    """
+    block = self._block(name)
+    if block is None or not block[1]:
+      return None
+    offset, archived_size, size, flags = block
+    if flags & FILE_ENCRYPTED:
+      raise InvalidReplay("%s is encrypted" % name)
+    start = self.offset + offset
+    if start + archived_size > self.size:
+      raise InvalidReplay("Truncated: %s ends at byte %d of %d" % (
+          name, start + archived_size, self.size))
+    self.bytes_read += archived_size
+    data = self._view[start:start + archived_size]
+    try:
+      if flags & FILE_SINGLE_UNIT:
+        # Only compressed when that saves at least one byte.
+        if flags & FILE_COMPRESS and size > archived_size:
+          return _decompress(data)
+        return bytes(data)
+
+      # Sectors are compressed separately, after a table of their offsets.
+      sectors = (size + self.sector_size - 1) // self.sector_size
+      positions = struct.unpack_from(
+          '<%dI' % (sectors + 1 + bool(flags & FILE_SECTOR_CRC)), data)
+      parts = []
+      left = size
+      for i in range(sectors):
+        with data[positions[i]:positions[i + 1]] as sector:
+          # A sector is only compressed when that saves at least one byte.
+          if (flags & FILE_COMPRESS
+              and len(sector) < min(left, self.sector_size)):
+            parts.append(_decompress(sector))
+          else:
+            parts.append(bytes(sector))
+        left -= len(parts[-1])
+      return b''.join(parts)
+    finally:
+      data.release()
+
+
+def check_archive(path, required_files=REQUIRED_FILES):
+  """Checks that a file is a replay that isn't truncated and has the files
+  needed to decode it, from its headers and file tables.
+
+  Args:
+      path (string): path of the replay file
+      required_files (list of string): files the replay must have
+
+  Raises:
+      InvalidReplay: if it isn't, with the reason.
+  """
+  with MPQReader(path) as archive:
+    archive.check(required_files)
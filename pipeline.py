@@ -0,0 +1,237 @@
+"""Runs the replay scripts as one pipeline: each replay is decoded once, and
+its record is fed to every stage in turn.
+Usage: python pipeline.py
+To only run some of the stages,
+  python pipeline.py --stages organize,matchups
+To run on another season than the current one (see seasons.py),
+  python pipeline.py --season Fall2019
+
+Stages:
+    download: Downloads new replays from the replay vault first.
+    organize: Copies replays into the team folders and renames them
+              (replay_organizer.py).
+    matchups: Suggests teams for players missing from the teams file.
+    stats: Writes the season stats CSV (stats_compiler.py).
+    matrices: Prints the race matchups and the race winrates on each map
+              (matchup_matrices.py).
+
+Attributes:
+    STAGES (list of str): Every stage, in the order they're run.
+    DEFAULT_STAGES (list of str): Stages run when --stages isn't given.
+    FULL_RECORD_STAGES (set of str): Stages that need the full record of
+      every replay, including the ones the organizer already processed.
+"""
+import argparse
+import os
+import sys
+import traceback
+
+import cea_team_name_parser
+import game_index
+import metrics
+import ratings
+import replay_analytics
+import replay_cache
+import replay_fingerprints
+import replay_journal
+import replay_organizer
+import replay_parser
+import replay_placement
+import replay_quarantine
+import replay_store
+import seasons
+import stats_compiler
+import team_inference
+from consts import SEASONS
+
+REPLAY_DIRECTORY = "UploadHere/"
+STAGES = ['download', 'organize', 'matchups', 'stats', 'matrices']
+DEFAULT_STAGES = ['organize', 'matchups', 'stats']
+FULL_RECORD_STAGES = {'stats', 'matrices'}
+
+
+def make_stages(stage_names, directory, cache, journal, season=None):
+  """Creates the stage objects fed by the pipeline.
+
+  Args:
+      stage_names (list of string): stages to create
+      directory (string): replay directory
+      cache (ReplayCache): cache of decoded replays
+      journal (ReplayJournal): journal of replays the organizer processed
+      season (Season): season whose teams file, team folders, indexes and
+        stats CSV the stages use. The current season if None.
+
+  Returns:
+      list: (name, stage) tuples, in pipeline order.
+  """
+  if season is None:
+    season = seasons.current()
+  teams, aliases = cea_team_name_parser.init_dictionary(season.teams_file)
+  alias_index = cea_team_name_parser.AliasIndex(aliases)
+  stages = []
+  if 'organize' in stage_names:
+    stages.append(('organize', replay_organizer.OrganizeStage(
+        directory, directory, teams, aliases, cache,
+        replay_store.ReplayStore(), journal, alias_index,
+        game_index.GameIndex(season.data_file(game_index.GAME_INDEX_FILE)),
+        season.directory, season.starting_date,
+        season.data_file(replay_placement.RENAME_LOG))))
+  if 'matchups' in stage_names:
+    stages.append(('matchups', replay_organizer.MatchupStage(
+        teams, aliases, season.data_file(team_inference.INFERENCE_FILE),
+        alias_index, season.starting_date)))
+  if 'stats' in stage_names:
+    stages.append(('stats', stats_compiler.StatsStage(
+        aliases, alias_index, season.stats_file, season.teams_file,
+        ratings.RatingEngine(season.data_file(ratings.RATINGS_FILE)))))
+  if 'matrices' in stage_names:
+    import matchup_matrices
+    stages.append(('matrices', matchup_matrices.MatrixStage(
+        teams, aliases, alias_index, season.starting_date)))
+  return stages
+
+
+def feed_stages(stages, directory, replays, cache, journal, jobs=1,
+                analytics=None, fingerprints=None):
+  """Decodes replays and adds them to every stage.
+
+  Args:
+      stages (list): (name, stage) tuples from make_stages
+      directory (string): replay directory
+      replays (list of string): names of the replay files to add
+      cache (ReplayCache): cache of decoded replays
+      journal (ReplayJournal): journal of replays the organizer processed
+      jobs (int): number of processes used to decode replays
+      analytics (ReplayCache): cache from replay_analytics.make_analytics_cache.
+        Each record gets its analysis if given, see stats_compiler.StatsStage.
+      fingerprints (FingerprintIndex): games already fed to the stages.
+        Replays of those games are skipped. A new index is used if None.
+  """
+  if fingerprints is None:
+    fingerprints = replay_fingerprints.FingerprintIndex()
+  # Replays the organizer already processed don't need to be opened, unless
+  # a stage needs their full record.
+  if not FULL_RECORD_STAGES & {name for name, stage in stages}:
+    journaled, replays = replay_organizer.split_journaled(
+        directory, replays, journal)
+    for replay, entry in journaled:
+      fingerprints.add_journaled(os.path.join(directory, replay), entry)
+      for name, stage in stages:
+        stage.add_journaled(replay, entry)
+
+  # Sorted, so which replay of a game is kept doesn't depend on the order of
+  # the files in the folder, even when its replays are in different batches.
+  replays = sorted(replays)
+  # The organizer's copies of a batch are made while the next is decoded.
+  for start in range(0, len(replays), replay_organizer.DECODE_BATCH):
+    batch = replays[start:start + replay_organizer.DECODE_BATCH]
+    paths = [os.path.join(directory, replay) for replay in batch]
+    records = cache.get_many(paths, jobs)
+    # Replays of the same game are only fed once, and not analyzed.
+    batch, paths, records = fingerprints.drop_duplicates(batch, paths, records)
+    if analytics is not None:
+      # Analyzed before any stage is finished, while the replays are still
+      # where they were uploaded.
+      records = stats_compiler.add_tracker(records,
+                                           analytics.get_many(paths, jobs))
+    add_to_stages(stages, batch, records)
+  if analytics is not None:
+    analytics.save()
+
+
+def add_to_stages(stages, replays, records):
+  """Adds decoded replays to every stage, reporting the replays that failed.
+
+  Args:
+      stages (list): (name, stage) tuples from make_stages
+      replays (list of string): names of the replay files
+      records (list of tuple): (record, error) tuple for each replay
+  """
+  for replay, (record, error) in zip(replays, records):
+    if error:
+      print("Error processing replay: %s" % replay)
+      print(error, end='')
+      continue
+    for name, stage in stages:
+      with metrics.timer(name + '.add'):
+        try:
+          stage.add(replay, record)
+        except:
+          metrics.record_failure(name, sys.exc_info()[1])
+          print("Error processing replay in %s stage: %s" % (name, replay))
+          traceback.print_exc()
+
+
+def run_pipeline(directory, stage_names, cache=None, jobs=1, analytics=None,
+                 season=None):
+  """Decodes every replay in a directory once and feeds it to the stages.
+
+  Args:
+      directory (string): replay directory
+      stage_names (list of string): stages to run, see STAGES
+      cache (ReplayCache): cache of decoded replays. Uses the season's
+        on-disk cache if not given.
+      jobs (int): number of processes used to decode replays
+      analytics (ReplayCache): cache from replay_analytics.make_analytics_cache,
+        to add economy and army statistics to the stats.
+      season (Season): season the replays are from, the current season if
+        None. See make_stages.
+  """
+  if season is None:
+    season = seasons.current()
+  if 'download' in stage_names:
+    # Only import the downloader's dependencies when they're needed.
+    import download_replays
+    download_replays.download_replays(False, jobs)
+
+  if cache is None:
+    cache = replay_cache.ReplayCache(
+        season.data_file(replay_cache.CACHE_FILE),
+        quarantine=replay_quarantine.Quarantine(
+            season.data_file(replay_quarantine.QUARANTINE_FILE)))
+  journal = replay_journal.ReplayJournal(
+      season.data_file(replay_journal.JOURNAL_FILE))
+  stages = make_stages(stage_names, directory, cache, journal, season)
+  if not stages:
+    return
+
+  replays = replay_parser.list_replays(directory)
+  print("Found %d replays to scan" % len(replays))
+  feed_stages(stages, directory, replays, cache, journal, jobs, analytics)
+
+  for name, stage in stages:
+    with metrics.timer(name + '.finish'):
+      stage.finish()
+  cache.save()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Download, organize and compile stats on replays')
+  parser.add_argument('--stages', dest='stages', default=','.join(DEFAULT_STAGES),
+                      help='Comma separated stages to run, out of: ' + ','.join(STAGES))
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  parser.add_argument('--season', dest='season', default=seasons.current().key,
+                      choices=list(SEASONS),
+                      help='Season to run on, the current season by default')
+  stats_compiler.add_tracker_arguments(parser)
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+  stage_names = [name.strip() for name in args.stages.split(',') if name.strip()]
+  unknown_stages = set(stage_names) - set(STAGES)
+  if unknown_stages:
+    parser.error('Unknown stages: ' + ', '.join(sorted(unknown_stages)))
+  season = seasons.get(args.season)
+  if season.key != seasons.current().key and 'download' in stage_names:
+    parser.error('Only the current season can be downloaded')
+  problem = seasons.check_season(season)
+  if problem:
+    parser.error("Can't run on %s: %s" % (season.key, problem))
+  analytics = None
+  if args.tracker and 'stats' in stage_names:
+    analytics = replay_analytics.make_analytics_cache(
+        args.tracker_cutoff,
+        season.data_file(replay_analytics.ANALYTICS_CACHE_FILE))
+  metrics.run(args, run_pipeline, season.replay_directory, stage_names,
+              jobs=args.jobs, analytics=analytics, season=season)
@@ -0,0 +1,117 @@
+"""Registry of the s2protocol protocol modules used to decode replays.
+
+s2protocol has one large module per game build. They're only imported the
+first time a replay of that build is decoded, and kept for the rest of the
+process. Builds s2protocol doesn't have are decoded with the protocol of
+another build: the one in BUILD_FALLBACKS if there is one, else the closest
+earlier build, since protocols rarely change between patches.
+
+Attributes:
+    BUILD_FALLBACKS (dict): base build => build whose protocol decodes it.
+      Add an entry when replays of a new build fail to decode with the
+      closest earlier build.
+"""
+import importlib
+import importlib.util
+import os
+import re
+import sys
+
+BUILD_FALLBACKS = {
+    # Build 76114 was never added to s2protocol.
+    76811: 76114,
+}
+PROTOCOL_FILE = re.compile(r'^protocol(\d+)\.py$')
+PACKAGE = 's2protocol.versions'
+
+# Protocol modules already looked up by this process, by base build.
+_modules = {}
+_builds = None
+
+
+def available_builds():
+  """Lists the builds s2protocol has a protocol for, without importing them.
+
+  Returns:
+      list of int: builds, in increasing order
+  """
+  global _builds
+  if _builds is None:
+    spec = importlib.util.find_spec(PACKAGE)
+    directory = list(spec.submodule_search_locations)[0]
+    _builds = sorted(int(match.group(1)) for match in
+                     map(PROTOCOL_FILE.match, os.listdir(directory)) if match)
+  return _builds
+
+
+def resolve_build(base_build):
+  """Gets the build whose protocol decodes replays of base_build.
+
+  Args:
+      base_build (int): base build of the replay
+
+  Returns:
+      int: base_build itself if s2protocol has it, else its fallback
+  """
+  if base_build in BUILD_FALLBACKS:
+    return BUILD_FALLBACKS[base_build]
+  builds = available_builds()
+  if base_build in builds:
+    return base_build
+  earlier = [build for build in builds if build < base_build]
+  return earlier[-1] if earlier else builds[0]
+
+
+def _import(build):
+  return importlib.import_module('%s.protocol%05d' % (PACKAGE, build))
+
+
+def latest():
+  """Gets the protocol of the latest build, used to decode replay headers."""
+  if 'latest' not in _modules:
+    _modules['latest'] = _import(available_builds()[-1])
+  return _modules['latest']
+
+
+def get(base_build):
+  """Gets the protocol module for a build.
+
+  Args:
+      base_build (int): base build of the replay
+
+  Returns:
+      module: s2protocol protocol module
+  """
+  if base_build not in _modules:
+    build = resolve_build(base_build)
+    if build != base_build and base_build not in BUILD_FALLBACKS:
+      print("No protocol for build %d, decoding it as build %d" % (
+          base_build, build))
+    _modules[base_build] = _import(build)
+  return _modules[base_build]
+
+
+def warm(builds=()):
+  """Imports the latest protocol and those of the given builds ahead of time.
+  Used as the initializer of worker processes, so the first replays they
+  decode don't pay for the imports.
+
+  Args:
+      builds (iterable of int): base builds to import
+  """
+  latest()
+  for build in builds:
+    get(build)
+
+
+def loaded_builds():
+  """Gets the base builds whose protocol this process has looked up."""
+  return [build for build in _modules if build != 'latest']
+
+
+def clear():
+  """Forgets and unloads every protocol module, for cold start timings."""
+  _modules.clear()
+  for name in list(sys.modules):
+    if name.startswith(PACKAGE + '.protocol'):
+      del sys.modules[name]
@@ -0,0 +1,283 @@
+"""League ratings of players and teams, with Glicko-2, from the results of the
+season's games rather than ladder MMR.
+
+Games are rated one at a time in the order they were played (m_timeUTC), each
+game being its own rating period, and both sides are updated from their
+ratings before the game. Player ratings and team ratings are kept separately:
+a team's rating moves with the results of every game its players play
+against another team.
+
+The ratings and the games already rated are saved in RATINGS_FILE, so a run
+only rates the games it hasn't seen, in O(new games). A new game played
+before the last rated one, like a replay uploaded late, can't be rated on top
+of the later games though: the ratings are then recomputed from every game
+in order. So are they when the players or teams of a game already rated
+changed, like after a player's team or alias was fixed in the teams file, or
+when a game already rated is gone, like after its replay was removed or found
+to be another upload of a game: every run passes all of the season's games,
+and the saved games are updated from them.
+
+Game layout, as passed to RatingEngine.add_games:
+    time_utc (int): When the game was played, see replay_parser.py.
+    fingerprint (str): Identifies the game, see replay_parser.game_fingerprint.
+    players (list of str): Main names of the two players.
+    teams (list of str): Teams of the two players, None if unknown.
+    winner (int): Index of the player who won.
+
+Attributes:
+    RATINGS_FILE (str): Default location of the rating state.
+    RATINGS_VERSION (int): Bump this whenever the rating state layout or the
+      rating system changes, the ratings are then recomputed.
+    INITIAL_RATING, INITIAL_DEVIATION, INITIAL_VOLATILITY (float): Glicko-2
+      rating of a new player or team, on the Glicko scale.
+    TAU (float): Glicko-2 system constant, how much volatility can change.
+"""
+import json
+import math
+import os
+
+RATINGS_FILE = "data/ratings.json"
+RATINGS_VERSION = 2
+INITIAL_RATING = 1500.0
+INITIAL_DEVIATION = 350.0
+INITIAL_VOLATILITY = 0.06
+TAU = 0.5
+# Converts between the Glicko scale and the Glicko-2 scale.
+SCALE = 173.7178
+CONVERGENCE = 1e-6
+
+
+class Rating:
+
+  """Glicko-2 rating of a player or team.
+
+  Attributes:
+      rating (float): Rating, on the Glicko scale.
+      deviation (float): Rating deviation, how uncertain the rating is.
+      volatility (float): How erratic the results are.
+      games (int): Number of games rated.
+      delta (float): Change of the rating over the last update that rated
+                     one of its games.
+  """
+
+  __slots__ = ('rating', 'deviation', 'volatility', 'games', 'delta')
+
+  def __init__(self, rating=INITIAL_RATING, deviation=INITIAL_DEVIATION,
+               volatility=INITIAL_VOLATILITY, games=0, delta=0.0):
+    self.rating = rating
+    self.deviation = deviation
+    self.volatility = volatility
+    self.games = games
+    self.delta = delta
+
+  def to_list(self):
+    return [self.rating, self.deviation, self.volatility, self.games, self.delta]
+
+
+def _volatility(phi, sigma, v, delta):
+  """Solves for the new volatility, with the Illinois algorithm as in step 5
+  of Glickman's description of Glicko-2."""
+  a = math.log(sigma ** 2)
+
+  def f(x):
+    exp_x = math.exp(x)
+    return (exp_x * (delta ** 2 - phi ** 2 - v - exp_x)
+            / (2 * (phi ** 2 + v + exp_x) ** 2)) - (x - a) / TAU ** 2
+
+  A = a
+  if delta ** 2 > phi ** 2 + v:
+    B = math.log(delta ** 2 - phi ** 2 - v)
+  else:
+    k = 1
+    while f(a - k * TAU) < 0:
+      k += 1
+    B = a - k * TAU
+  f_A, f_B = f(A), f(B)
+  while abs(B - A) > CONVERGENCE:
+    C = A + (A - B) * f_A / (f_B - f_A)
+    f_C = f(C)
+    if f_C * f_B <= 0:
+      A, f_A = B, f_B
+    else:
+      f_A /= 2
+    B, f_B = C, f_C
+  return math.exp(A / 2)
+
+
+def glicko2_update(player, opponent, score):
+  """Rates one game.
+
+  Args:
+      player, opponent (Rating): ratings before the game
+      score (float): 1 if the player won, 0 if they lost
+
+  Returns:
+      tuple: (rating, deviation, volatility) of the player after the game
+  """
+  mu = (player.rating - INITIAL_RATING) / SCALE
+  phi = player.deviation / SCALE
+  mu_j = (opponent.rating - INITIAL_RATING) / SCALE
+  phi_j = opponent.deviation / SCALE
+
+  g = 1 / math.sqrt(1 + 3 * phi_j ** 2 / math.pi ** 2)
+  expected = 1 / (1 + math.exp(-g * (mu - mu_j)))
+  v = 1 / (g ** 2 * expected * (1 - expected))
+  delta = v * g * (score - expected)
+
+  sigma = _volatility(phi, player.volatility, v, delta)
+  phi_star = math.sqrt(phi ** 2 + sigma ** 2)
+  new_phi = 1 / math.sqrt(1 / phi_star ** 2 + 1 / v)
+  new_mu = mu + new_phi ** 2 * g * (score - expected)
+  return new_mu * SCALE + INITIAL_RATING, new_phi * SCALE, sigma
+
+
+class RatingEngine:
+
+  """Player and team ratings, kept up to date as games are added.
+
+  Attributes:
+      filename (str): JSON file the rating state is saved to. None keeps it
+        in memory.
+      players (dict): main player name => Rating
+      teams (dict): team name => Rating
+      games (list of list): [time_utc, fingerprint, players, teams, winner]
+        of every rated game, in the order they were rated.
+  """
+
+  def __init__(self, filename=RATINGS_FILE):
+    self.filename = filename
+    self.players = {}
+    self.teams = {}
+    self.games = []
+    self.load()
+
+  def load(self):
+    if not self.filename:
+      return
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    except (OSError, ValueError):
+      return
+    if state.get('version') != RATINGS_VERSION:
+      return
+    self.players = {name: Rating(*values)
+                    for name, values in state['players'].items()}
+    self.teams = {name: Rating(*values)
+                  for name, values in state['teams'].items()}
+    self.games = state['games']
+
+  def save(self):
+    """Writes the rating state, replacing the file in one step."""
+    if not self.filename:
+      return
+    directory = os.path.dirname(self.filename)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    state = {'version': RATINGS_VERSION,
+             'players': {name: rating.to_list()
+                         for name, rating in self.players.items()},
+             'teams': {name: rating.to_list()
+                       for name, rating in self.teams.items()},
+             'games': self.games}
+    temp_file = self.filename + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+      json.dump(state, f)
+    os.replace(temp_file, self.filename)
+
+  def add_games(self, games):
+    """Rates the games that weren't rated yet, updates the players and teams
+    of the games already rated, and drops the rated games that aren't given
+    anymore.
+
+    Args:
+        games (list of dict): every game of the season, see the module
+          docstring
+
+    Returns:
+        tuple: (number of games rated, number of rated games whose players
+          or teams changed, number of rated games dropped)
+    """
+    rated_games = {game[1]: game for game in self.games}
+    fingerprints = set()
+    new_games = []
+    changed_games = []
+    # (kind, name) of the players and teams whose games are rated, changed
+    # or dropped.
+    updated = set()
+    for game in games:
+      if game['fingerprint'] in fingerprints:
+        continue
+      fingerprints.add(game['fingerprint'])
+      players, teams = list(game['players']), list(game['teams'])
+      rated_game = rated_games.get(game['fingerprint'])
+      if rated_game is not None:
+        if rated_game[2] != players or rated_game[3] != teams:
+          updated.update(('player', name) for name in rated_game[2] + players)
+          updated.update(('team', name) for name in rated_game[3] + teams)
+          rated_game[2], rated_game[3] = players, teams
+          changed_games.append(rated_game)
+        continue
+      new_games.append([game['time_utc'], game['fingerprint'], players, teams,
+                        game['winner']])
+      updated.update(('player', name) for name in players)
+      updated.update(('team', name) for name in teams)
+    # Games whose replay was removed, or found to be another upload of a game.
+    removed_games = [game for game in self.games if game[1] not in fingerprints]
+    for game in removed_games:
+      updated.update(('player', name) for name in game[2])
+      updated.update(('team', name) for name in game[3])
+    if not new_games and not changed_games and not removed_games:
+      return 0, 0, 0
+    new_games.sort(key=lambda game: (game[0], game[1]))
+
+    ratings = {'player': self.players, 'team': self.teams}
+    # Ratings of the updated players and teams, before the update.
+    before = {(kind, name): ratings[kind][name].rating
+              for kind, name in updated if name in ratings[kind]}
+    if changed_games or removed_games or (
+        self.games and new_games and new_games[0][0] < self.games[-1][0]):
+      # Rate everything again in order, the other ratings keep their change.
+      deltas = {(kind, name): rating.delta
+                for kind in ratings for name, rating in ratings[kind].items()}
+      self.games = sorted(
+          [game for game in self.games if game[1] in fingerprints] + new_games,
+          key=lambda game: (game[0], game[1]))
+      self.players = {}
+      self.teams = {}
+      for game in self.games:
+        self._rate(game)
+      ratings = {'player': self.players, 'team': self.teams}
+      for kind in ratings:
+        for name, rating in ratings[kind].items():
+          rating.delta = deltas.get((kind, name), 0.0)
+    else:
+      for game in new_games:
+        self._rate(game)
+        self.games.append(game)
+
+    for kind, name in updated:
+      if name in ratings[kind]:
+        ratings[kind][name].delta = ratings[kind][name].rating - before.get(
+            (kind, name), INITIAL_RATING)
+    return len(new_games), len(changed_games), len(removed_games)
+
+  def _rate(self, game):
+    time_utc, fingerprint, players, teams, winner = game
+    if players[0] == players[1]:
+      return
+    self._rate_pair(self.players, players, winner)
+    # Games within a team, or against players of unknown teams, don't say
+    # anything about how strong a team is.
+    if None not in teams and teams[0] != teams[1]:
+      self._rate_pair(self.teams, teams, winner)
+
+  @staticmethod
+  def _rate_pair(ratings, names, winner):
+    first = ratings.setdefault(names[0], Rating())
+    second = ratings.setdefault(names[1], Rating())
+    first_after = glicko2_update(first, second, 1.0 if winner == 0 else 0.0)
+    second_after = glicko2_update(second, first, 1.0 if winner == 1 else 0.0)
+    for rating, after in ((first, first_after), (second, second_after)):
+      rating.rating, rating.deviation, rating.volatility = after
+      rating.games += 1
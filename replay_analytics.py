@@ -0,0 +1,161 @@
+"""Economy and army statistics of each player over a game, from the stats
+events in replay.tracker.events.
+
+Tracker events are decoded one at a time as they're read, so the whole event
+list is never held in memory, and decoding stops at the cutoff if there is
+one. Replays are analyzed in worker processes like replay_parser.py, and the
+results are cached by content hash in ANALYTICS_CACHE_FILE.
+
+Analysis layout:
+    cutoff (float): Cutoff in seconds, None for the whole game.
+    players (list of dict): One entry per player, in replay.details order,
+                            with keys
+        workers_6min (int): Workers at 6:00, None if the game or the cutoff
+                            is shorter.
+        income_6min (int): Minerals and vespene per minute at 6:00.
+        peak_supply (float): Highest supply used.
+        peak_army_value (int): Highest minerals and vespene in the army.
+        resources_lost (int): Minerals and vespene lost by the cutoff.
+        timeline (list of list): Every 10 seconds,
+            [seconds, supply used, workers, income, army value].
+
+Attributes:
+    ANALYTICS_CACHE_FILE (str): Default location of the analysis cache.
+    SUMMARY_KEYS (list of str): Summary statistics of each player.
+    ANALYTICS_VERSION (int): Bump this whenever the analysis layout changes.
+    GAME_LOOPS_PER_SECOND (float): Game loops per real second at Faster
+      speed, which is what the in-game clock shows.
+"""
+import traceback
+
+import metrics
+import mpq_reader
+import protocols
+import replay_cache
+
+ANALYTICS_CACHE_FILE = "data/analytics_cache.json"
+ANALYTICS_VERSION = 1
+GAME_LOOPS_PER_SECOND = 22.4
+PLAYER_STATS_EVENT = 'NNet.Replay.Tracker.SPlayerStatsEvent'
+LOST_STATS = [
+    'm_scoreValueMineralsLostArmy', 'm_scoreValueMineralsLostEconomy',
+    'm_scoreValueMineralsLostTechnology', 'm_scoreValueVespeneLostArmy',
+    'm_scoreValueVespeneLostEconomy', 'm_scoreValueVespeneLostTechnology']
+SIX_MINUTES = 6 * 60
+SUMMARY_KEYS = ['workers_6min', 'income_6min', 'peak_supply',
+                'peak_army_value', 'resources_lost']
+
+
+def iter_player_stats(contents, protocol, cutoff=None):
+  """Yields the stats events of a replay, stopping at the cutoff.
+
+  Args:
+      contents (bytes): replay.tracker.events
+      protocol (module): s2protocol protocol module of the replay
+      cutoff (float): time in seconds to stop at, None for the whole game
+
+  Yields:
+      tuple: (seconds, player id starting at 1, m_stats dict)
+  """
+  cutoff_loop = None if cutoff is None else cutoff * GAME_LOOPS_PER_SECOND
+  for event in protocol.decode_replay_tracker_events(contents):
+    if cutoff_loop is not None and event['_gameloop'] > cutoff_loop:
+      return
+    if event['_event'] == PLAYER_STATS_EVENT:
+      yield (event['_gameloop'] / GAME_LOOPS_PER_SECOND, event['m_playerId'],
+             event['m_stats'])
+
+
+def analyze_replay(path, cutoff=None):
+  """Computes the timeline and summary statistics of each player.
+
+  Args:
+      path (string): path of the replay file
+      cutoff (float): time in seconds to stop at, None for the whole game
+
+  Returns:
+      dict: analysis, see the module docstring.
+  """
+  with mpq_reader.MPQReader(path) as archive:
+    header = protocols.latest().decode_replay_header(archive.user_data)
+    protocol = protocols.get(header['m_version']['m_baseBuild'])
+    details = protocol.decode_replay_details(archive.read_file('replay.details'))
+    tracker_events = archive.read_file('replay.tracker.events')
+
+  players = [{'workers_6min': None, 'income_6min': None, 'peak_supply': 0,
+              'peak_army_value': 0, 'resources_lost': 0, 'timeline': []}
+             for player in details['m_playerList']]
+  if tracker_events:
+    for seconds, player_id, stats in iter_player_stats(
+        tracker_events, protocol, cutoff):
+      if not 1 <= player_id <= len(players):
+        continue
+      player = players[player_id - 1]
+      supply = stats['m_scoreValueFoodUsed'] / 4096
+      workers = stats['m_scoreValueWorkersActiveCount']
+      income = (stats['m_scoreValueMineralsCollectionRate']
+                + stats['m_scoreValueVespeneCollectionRate'])
+      army_value = (stats['m_scoreValueMineralsUsedCurrentArmy']
+                    + stats['m_scoreValueVespeneUsedCurrentArmy'])
+      player['timeline'].append([round(seconds), supply, workers, income,
+                                 army_value])
+      if seconds <= SIX_MINUTES:
+        player['workers_6min'] = workers
+        player['income_6min'] = income
+      player['peak_supply'] = max(player['peak_supply'], supply)
+      player['peak_army_value'] = max(player['peak_army_value'], army_value)
+      player['resources_lost'] = sum(stats[name] for name in LOST_STATS)
+
+  # Games or cutoffs shorter than 6:00 don't say what a player had at 6:00.
+  for player in players:
+    timeline = player['timeline']
+    if not timeline or timeline[-1][0] < SIX_MINUTES:
+      player['workers_6min'] = player['income_6min'] = None
+  return {'cutoff': cutoff, 'players': players}
+
+
+def _analyze_timed(path, cutoff):
+  """Analyzes a replay, returning (analysis, traceback, exception type name)."""
+  try:
+    return analyze_replay(path, cutoff), None, None
+  except Exception as e:
+    return None, traceback.format_exc(), type(e).__name__
+
+
+def analyze_replays(paths, jobs=1, cutoff=None):
+  """Analyzes several replays, in `jobs` worker processes if jobs > 1.
+
+  Args:
+      paths (list of string): paths of the replay files
+      jobs (int): number of worker processes
+      cutoff (float): time in seconds to stop at, None for the whole game
+
+  Returns:
+      list: (analysis, error) tuple for each path, in the same order. error is
+        the formatted traceback if the replay could not be analyzed.
+  """
+  with metrics.timer('analytics.decode'):
+    if jobs <= 1 or len(paths) < 2:
+      results = [_analyze_timed(path, cutoff) for path in paths]
+    else:
+      from concurrent.futures import ProcessPoolExecutor
+      chunksize = max(1, len(paths) // (jobs * 4))
+      with ProcessPoolExecutor(max_workers=jobs,
+                               initializer=protocols.warm) as executor:
+        results = list(executor.map(_analyze_timed, paths,
+                                    [cutoff] * len(paths), chunksize=chunksize))
+  for analysis, error, exception in results:
+    if exception:
+      metrics.record_failure('analytics', exception)
+  return [(analysis, error) for analysis, error, exception in results]
+
+
+def make_analytics_cache(cutoff=None, filename=ANALYTICS_CACHE_FILE):
+  """Creates a cache of analyses, computed with the given cutoff.
+
+  Returns:
+      ReplayCache: whose records are analyses, see the module docstring.
+  """
+  return replay_cache.ReplayCache(
+      filename, decode=lambda paths, jobs=1: analyze_replays(paths, jobs, cutoff),
+      version="%d-%s" % (ANALYTICS_VERSION, cutoff))
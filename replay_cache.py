@@ -0,0 +1,240 @@
+"""On-disk cache of decoded replay records, shared by replay_organizer.py and
+stats_compiler.py.
+
+A replay never changes once it's uploaded, so each one only has to be decoded
+once. Files are looked up by path, size and mtime, which only costs a stat().
+If that misses (e.g. the organizer renamed the file), the content hash is
+checked before falling back to a full decode.
+
+Replays that are broken (see replay_parser.invalid_replay) are quarantined if
+the cache has a quarantine (see replay_quarantine.py), and the hash of a new
+upload is checked against it before decoding. Other decode errors are only
+reported, and the replay is tried again on the next run.
+
+Attributes:
+    CACHE_FILE (str): Default location of the cache.
+    CACHE_VERSION (int): Bump this whenever the record format in
+                         replay_parser.py changes, to invalidate old caches.
+"""
+import hashlib
+import json
+import os
+import traceback
+
+import metrics
+import replay_parser
+
+CACHE_FILE = "data/replay_cache.json"
+CACHE_VERSION = 3
+
+
+def hash_file(path):
+  """Computes the SHA-256 of a file.
+
+  Args:
+      path (string): file to hash
+
+  Returns:
+      string: hex digest of the file contents
+  """
+  sha = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      sha.update(chunk)
+      metrics.count('bytes.hashed', len(chunk))
+  return sha.hexdigest()
+
+
+class ReplayCache:
+
+  """Cache of replay records, keyed by content hash.
+
+  Attributes:
+      entries (dict): content hash => replay record
+      files (dict): path => {'size', 'mtime_ns', 'sha256'} of the file
+      filename (str): JSON file backing the cache. None keeps it in memory.
+      hits (int): Number of lookups answered without decoding.
+      misses (int): Number of lookups that needed a full decode.
+      decode (callable): Decodes replays into records, like
+        replay_parser.decode_replays, which is the default.
+      version: Version of the records, the cache file is ignored if it was
+        written for another version. CACHE_VERSION by default.
+      quarantine (Quarantine): where broken replays are moved, and
+        known-bad replays are looked up. None decodes every
+        replay that isn't cached, and leaves the bad ones where they are.
+  """
+
+  def __init__(self, filename=CACHE_FILE, decode=None, version=CACHE_VERSION,
+               quarantine=None):
+    self.filename = filename
+    self.decode = decode or replay_parser.decode_replays
+    self.version = version
+    self.quarantine = quarantine
+    self.entries = {}
+    self.files = {}
+    self.hits = 0
+    self.misses = 0
+    self._dirty = False
+    if filename:
+      self.load()
+
+  def load(self):
+    """Loads the cache file, ignoring it if it's missing, unreadable or from
+    another version."""
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return
+    if data.get('version') != self.version:
+      print("Replay cache %s is outdated, rebuilding it" % self.filename)
+      self._dirty = True
+      return
+    self.entries = data['entries']
+    self.files = data['files']
+
+  def save(self):
+    """Evicts stale entries and writes the cache file atomically."""
+    if self.quarantine is not None:
+      self.quarantine.save()
+    self.prune()
+    if not self.filename or not self._dirty:
+      return
+    directory = os.path.dirname(self.filename)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    temp_filename = self.filename + '.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+      json.dump({'version': self.version, 'entries': self.entries,
+                 'files': self.files}, f)
+    os.replace(temp_filename, self.filename)
+    self._dirty = False
+
+  def prune(self):
+    """Evicts files that have disappeared, and records no file refers to."""
+    for path in [path for path in self.files if not os.path.isfile(path)]:
+      del self.files[path]
+      self._dirty = True
+    referenced = {info['sha256'] for info in self.files.values()}
+    for sha in [sha for sha in self.entries if sha not in referenced]:
+      del self.entries[sha]
+      self._dirty = True
+
+  def lookup(self, path):
+    """Gets the cached record of a replay without decoding it.
+
+    Args:
+        path (string): path of the replay file
+
+    Returns:
+        dict: replay record, or None if the replay isn't cached.
+    """
+    path = os.path.normpath(path)
+    stat = os.stat(path)
+    info = self.files.get(path)
+    if (info and info['size'] == stat.st_size
+        and info['mtime_ns'] == stat.st_mtime_ns
+        and info['sha256'] in self.entries):
+      self.hits += 1
+      metrics.count('cache.hits')
+      return self.entries[info['sha256']]
+
+    sha = hash_file(path)
+    self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                        'sha256': sha}
+    self._dirty = True
+    if sha in self.entries:
+      self.hits += 1
+      metrics.count('cache.hits')
+      return self.entries[sha]
+    return None
+
+  def sha256(self, path):
+    """Gets the content hash of a replay previously passed to lookup()."""
+    return self.files[os.path.normpath(path)]['sha256']
+
+  def add(self, path, record):
+    """Stores the record of a replay previously passed to lookup()."""
+    self.entries[self.sha256(path)] = record
+    self._dirty = True
+
+  def get(self, path):
+    """Gets the record of a replay, decoding it if it isn't cached.
+
+    Args:
+        path (string): path of the replay file
+
+    Returns:
+        dict: replay record, see replay_parser.py
+    """
+    record = self.lookup(path)
+    if record is None:
+      self.misses += 1
+      metrics.count('cache.misses')
+      record, error = self.decode([path])[0]
+      if error:
+        raise ValueError("Could not decode %s:\n%s" % (path, error))
+      self.add(path, record)
+    return record
+
+  def get_many(self, paths, jobs=1):
+    """Gets the records of several replays, decoding the ones that aren't
+    cached in `jobs` worker processes.
+
+    Args:
+        paths (list of string): paths of the replay files
+        jobs (int): number of worker processes
+
+    Returns:
+        list: (record, error) tuple for each path, in the same order. error is
+          the formatted traceback if the replay could not be read, else None.
+    """
+    results = [None] * len(paths)
+    to_decode = []
+    for i, path in enumerate(paths):
+      try:
+        record = self.lookup(path)
+      except OSError as e:
+        metrics.record_failure('read', e)
+        results[i] = (None, traceback.format_exc())
+        continue
+      if record is not None:
+        results[i] = (record, None)
+      elif self._quarantined(paths[i]):
+        results[i] = (None, "Quarantined: %s\n" % self.quarantine.reason(
+            self.sha256(paths[i])))
+      else:
+        to_decode.append(i)
+
+    self.misses += len(to_decode)
+    metrics.count('cache.misses', len(to_decode))
+    decoded = self.decode([paths[i] for i in to_decode], jobs)
+    for i, (record, error) in zip(to_decode, decoded):
+      if record is not None:
+        self.add(paths[i], record)
+      elif (self.quarantine is not None
+            and replay_parser.invalid_replay(error)):
+        self.quarantine.add(paths[i], self.sha256(paths[i]),
+                            error.strip().splitlines()[-1])
+      results[i] = (record, error)
+    return results
+
+  def _quarantined(self, path):
+    """Moves a replay to the quarantine if the same file already is, without
+    decoding it."""
+    if self.quarantine is None:
+      return False
+    sha = self.sha256(path)
+    reason = self.quarantine.reason(sha)
+    if reason is None:
+      return False
+    metrics.count('cache.quarantined')
+    self.quarantine.add(path, sha, reason)
+    return True
+
+  def rename(self, src, dst):
+    """Keeps the cache in sync with a replay moved from src to dst."""
+    info = self.files.pop(os.path.normpath(src), None)
+    if info:
+      self.files[os.path.normpath(dst)] = info
+      self._dirty = True
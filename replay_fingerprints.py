@@ -0,0 +1,112 @@
+"""Finds replays of games that were already seen, so each game is organized,
+analyzed and counted in the stats once.
+
+The same game is often uploaded by both teams, and again with a suffix like
+(6) or a ._ prefix. Byte-identical uploads share a cache entry, and replays
+saved by different players have the same fingerprint (see
+replay_parser.game_fingerprint), which comes from the header and
+replay.details that every decode reads anyway. Duplicates are dropped right
+after that, before the stages or any tracker event analysis see them.
+"""
+import os
+
+import metrics
+
+
+class FingerprintIndex:
+
+  """Index of the games seen so far, by fingerprint.
+
+  Attributes:
+      paths (dict): fingerprint => path of the replay kept for the game
+      duplicates (list of tuple): (path of a duplicate, path of the replay
+        kept for its game), in the order they were found.
+  """
+
+  def __init__(self):
+    self.paths = {}
+    self.duplicates = []
+    self._reported = 0
+
+  def add(self, path, fingerprint):
+    """Adds a replay of a game.
+
+    Args:
+        path (string): path of the replay file
+        fingerprint (string): fingerprint of the game, or None if unknown
+
+    Returns:
+        string: path of the replay kept for the game if this one is a
+          duplicate, else None.
+    """
+    if not fingerprint:
+      return None
+    kept = self.paths.setdefault(fingerprint, path)
+    if kept == path:
+      return None
+    self.duplicates.append((path, kept))
+    metrics.count('replays.duplicate')
+    return kept
+
+  def add_journaled(self, path, entry):
+    """Adds a replay the organizer already processed, from its journal entry.
+
+    Args:
+        path (string): path of the replay file
+        entry (dict): journal entry, see replay_journal.py
+    """
+    if entry.get('fingerprint'):
+      # Entries written when fingerprints ended with the map title.
+      fingerprint = ':'.join(entry['fingerprint'].split(':')[:2])
+      self.paths.setdefault(fingerprint, path)
+
+  def unique(self, paths, records):
+    """Adds replays, keeping the first path in alphabetical order for games
+    that weren't seen before, so the result doesn't depend on the order of
+    the files in the folder.
+
+    Args:
+        paths (list of string): paths of the replay files
+        records (list of tuple): (record, error) tuple for each path, from
+          ReplayCache.get_many
+
+    Returns:
+        list of int: indices of the replays that aren't duplicates, and of
+          those that couldn't be decoded, in their original order.
+    """
+    order = sorted(range(len(paths)), key=lambda i: paths[i])
+    duplicate = set()
+    for i in order:
+      record = records[i][0]
+      if record is not None and self.add(paths[i], record.get('fingerprint')):
+        duplicate.add(i)
+    return [i for i in range(len(paths)) if i not in duplicate]
+
+  def drop_duplicates(self, replays, paths, records):
+    """Adds replays like unique(), reports the duplicates and leaves them
+    out.
+
+    Args:
+        replays (list of string): names of the replay files
+        paths (list of string): paths of the replay files
+        records (list of tuple): (record, error) tuple for each path, from
+          ReplayCache.get_many
+
+    Returns:
+        tuple: (replays, paths, records) of the replays that aren't
+          duplicates, and of those that couldn't be decoded.
+    """
+    unique = self.unique(paths, records)
+    self.report()
+    return ([replays[i] for i in unique], [paths[i] for i in unique],
+            [records[i] for i in unique])
+
+  def report(self):
+    """Prints the duplicates found since the last report."""
+    duplicates = self.duplicates[self._reported:]
+    self._reported = len(self.duplicates)
+    if not duplicates:
+      return
+    print("Skipped %d duplicate replays of games already seen:" % len(duplicates))
+    for path, kept in duplicates:
+      print("\t%s (same game as %s)" % (path, os.path.basename(kept)))
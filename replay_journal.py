@@ -0,0 +1,105 @@
+"""Append-only journal of the replays replay_organizer.py has processed.
+
+Once a replay is organized it's renamed to the standardized
+Week-TeamA-TeamB-PlayerA-PlayerB-RA-RB-Map.SC2Replay format. The journal maps
+that name (and the content hash) to what the organizer found out about the
+game, so that later runs can skip the replay without opening it.
+
+Each line of the journal is a JSON object with keys:
+    sha256 (str): Hash of the replay.
+    name (str): Standardized file name.
+    size (int): Size of the replay in bytes.
+    week (str): Week the game was played, ex: Week4.
+    teams, players, races (list of str): Alphabetized by team.
+    map (str): Map name.
+    fingerprint (str): Fingerprint of the game, see replay_fingerprints.py.
+                       Missing from entries written before it was added.
+    destinations (list of str): Copies made in the team folders.
+
+Attributes:
+    JOURNAL_FILE (str): Default location of the journal.
+    STANDARDIZED_NAME (re): Matches file names in the standardized format.
+"""
+import json
+import os
+import re
+
+JOURNAL_FILE = "data/organizer_journal.jsonl"
+STANDARDIZED_NAME = re.compile(
+    r'^(Preseason|Week\d+|GapWeek|Round\d+)-.+-[PTZ]-[PTZ]-[^-]+\.SC2Replay$')
+
+
+class ReplayJournal:
+
+  """Journal of processed replays, indexed by file name and content hash.
+
+  Attributes:
+      by_name (dict): standardized file name => latest entry
+      by_sha (dict): content hash => latest entry
+      filename (str): File backing the journal. None keeps it in memory.
+  """
+
+  def __init__(self, filename=JOURNAL_FILE):
+    self.filename = filename
+    self.by_name = {}
+    self.by_sha = {}
+    self._file = None
+    if filename:
+      self.load()
+
+  def load(self):
+    """Reads the journal. A line cut short by a crash is ignored."""
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            continue
+          self._index(entry)
+    except OSError:
+      pass
+
+  def _index(self, entry):
+    self.by_name[entry['name']] = entry
+    self.by_sha[entry['sha256']] = entry
+
+  def lookup(self, path):
+    """Gets the entry of an already processed replay, without opening it.
+
+    Only replays with a standardized name are looked up, and the file size
+    must match what was journaled.
+
+    Args:
+        path (string): path of the replay file
+
+    Returns:
+        dict: journal entry, or None if the replay must be processed.
+    """
+    name = os.path.basename(path)
+    if not STANDARDIZED_NAME.match(name):
+      return None
+    entry = self.by_name.get(name)
+    if entry is None or entry['size'] != os.path.getsize(path):
+      return None
+    return entry
+
+  def append(self, entry):
+    """Adds an entry to the journal."""
+    if entry['sha256'] in self.by_sha and self.by_sha[entry['sha256']] == entry:
+      return
+    self._index(entry)
+    if not self.filename:
+      return
+    if self._file is None:
+      directory = os.path.dirname(self.filename)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      self._file = open(self.filename, 'a', encoding='utf-8')
+    self._file.write(json.dumps(entry) + '\n')
+    self._file.flush()
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
@@ -1,33 +1,69 @@
-import mpyq
+import argparse
 import os
-import re
 import string
-import shutil
+import sys
 import traceback
-from s2protocol import versions
 from datetime import datetime
 from datetime import timedelta
 from collections import Counter
 from consts import STARTING_DATE
 
 import cea_team_name_parser
+import game_index
+import metrics
+import replay_cache
+import replay_fingerprints
+import replay_journal
+import replay_parser
+import replay_quarantine
+import replay_placement
+import replay_store
+import team_inference
 
 REPLAY_DIRECTORY = "UploadHere/"
 TEAMS_FILE = "cea_names.csv"
 UNKNOWN_TEAM = "TEAM_NOT_KNOWN"
+# Replays decoded at a time. The copies of a batch are made on I/O threads
+# (see replay_placement.py) while the next one is decoded.
+DECODE_BATCH = 256
 
-counts = Counter()
+RACE_DICTIONARY = {
+  "Protoss" : "P" , "Zerg" : "Z", "Terran" : "T",
+  "异虫" : "Z", "星灵" : "P", "人类" : "T"}
+MAP_DICTIONARY = {
+  "Automaton LE" : "Automaton LE",
+  "机械城  天梯版" : "Automaton LE",
+  "Kings Cove LE" : "Kings Cove LE",
+  "国王藏宝地天梯版" : "Kings Cove LE",
+  "Year Zero LE" : "Year Zero LE",
+  "New Repugnancy LE" : "New Repugnancy LE",
+  "Cyber Forest LE" : "Cyber Forest LE",
+  "赛博森林天梯版" : "Cyber Forest LE",
+  "Port Aleksander LE" : "Port Aleksander LE",
+  "Kairos Junction LE" : "Kairos Junction LE",
+  "Acropolis LE" : "Acropolis LE",
+  "Thunderbird LE" : "Thunderbird LE",
+  "Turbo Cruise 84 LE" : "Turbo Cruise 84 LE",
+  "Triton LE" : "Triton LE",
+  "Disco Bloodbath LE" : "Disco Bloodbath LE",
+  "Winters Gate LE" :  "Winters Gate LE",
+  "Ephemeron LE" : "Ephemeron LE",
+  "World of Sleepers LE" : "World of Sleepers LE",
+}
 
-def define_cea_date_ranges():
+def define_cea_date_ranges(starting_date=STARTING_DATE):
   """Starts with preseason, March 16 2019 12:00.
 
+  Args:
+      starting_date (str): starting date of the season, YYYYMMDD format
+
   Returns:
       Array: Array containing the dates of each CEA week
   """
   num_weeks = 14
   weeks = []
 
-  weeks.append(datetime.strptime(STARTING_DATE+"12",'%Y%m%d%H'))
+  weeks.append(datetime.strptime(starting_date+"12",'%Y%m%d%H'))
   d = timedelta(days=7)
   for i in range(1,num_weeks):
     weeks.append(weeks[0] + d * i)
@@ -53,20 +89,6 @@ def get_date_played(weeks, date_of_game):
   else:
     return rounds[min_index - 9]
 
-def erase_punctuation(player_name):
-  """Player names can come in the form of
-    b'&lt;AMZN&gt;<sp/>Feniks'
-    so we remove all punctuation and everything
-    to the left of it, to remove b' and the tag   
-  Args:
-      player_name (String): full name of player
-
-  Returns:
-      string: name of player, without tag or punctuation
-  """
-  player_name = player_name.decode('UTF-8')
-  return player_name.split('>', 1)[-1]
-
 def get_time(utc_timestamp):
   """Gets date given UTC timestamp of game
   
@@ -93,214 +115,385 @@ def find_team(teams, name):
   else:
     return UNKNOWN_TEAM
 
-def identify_unknown_players(matchup_dictionary, team_dictionary):
-  """ Identifies unknown players in the teams file. If a player whose team is
-  known matches up against a player whose team is unknown, then we can obtain
-  the unknown player's team by checking the team matchups.
-  Prints out potential errors (instances in which a team faced multiple
-  opponents)
-  and suggests the proper team for players whose team is unknown.
-  
-  Args:
-      matchup_dictionary (dict): dict with key = Week played, value =
-        dict<string,list> of key = team, and value = opponents played that week
-      team_dictionary (dict): dict with key = player, value = team
-  """
-  for week in matchup_dictionary.keys():
-    for team, opponents in matchup_dictionary[week].items():
-      if team == UNKNOWN_TEAM:
-        continue
-      opponent_teams = [find_team(teams,opponent) for opponent in set(opponents)]
-      team_counter = Counter(opponent_teams)
-
-      # If the team faced more than 2 opponents, that's not supposed to happen.
-      if len(team_counter) >= 2 + int(UNKNOWN_TEAM in team_counter):
-        print("Potential error in teams file: In {0}, {1} faced multiple teams:".format(week,team))
-        print('Players: ', *["{0} {1}".format(find_team(teams, i), i) for i in set(opponents)], sep='\n\t')
-      # If the team faced 2 opponents, and one was UNKNOWN_TEAM, then we know what team they faced.
-      elif UNKNOWN_TEAM in team_counter and len(team_counter) == 2:
-        # Get the team that is not UNKNOWN_TEAM: everyone belongs to that team.
-        opponent_team = next(team for team in opponent_teams if team != UNKNOWN_TEAM )
-        for opponent in set(opponents):
-          if find_team(teams, opponent) == UNKNOWN_TEAM:
-            print("Suggested team for {0}: {1};\n \t {2} faced {3} in {4}".format(opponent, opponent_team, opponent_team, team, week))
-      
-
-def copy_into_path(original, copyname, path):
-  """copies into a new location, making the folders if necessary and stops if the file's already there
-  
+def copy_path(copyname, path):
+  """Gets where to put a copy of a replay in the team folders.
+
   Args:
-      original (string): the file to copy
       copyname (string): the filename to use for the new location
       path (list of string): parts of the path at which to put the copy
+
+  Returns:
+      string: path of the copy
   """
   path = os.path.join(*path).replace(" ", "_")
-  os.makedirs(path, exist_ok=True) # makes the directories if necessary
-  path = os.path.join(path, copyname.replace(" ", "_") + ".SC2Replay")
-  if not os.path.isfile(path):
-    counts['replay copies organized'] += 1
-    shutil.copyfile(original, path)
-  else:
-    counts['replay copies already existed'] += 1
-    
-def organize_replays(directory, output_directory, teams, aliases):
+  return os.path.join(path, copyname.replace(" ", "_") + ".SC2Replay")
+
+
+def describe_game(record, teams, alias_index, week_time):
+  """Gets who played a game and when, with players alphabetized by team.
+
+  Args:
+      record (dict): replay record, see replay_parser.py
+      teams (dict): dict with key = player, value = team
+      alias_index (AliasIndex): index of player aliases, see
+        cea_team_name_parser.py
+      week_time (Array[datetime]): dates of CEA weeks
+
+  Returns:
+      tuple: (player_names, player_races, player_teams, week_played,
+        player_order), where player_order is the index in record['players']
+        of each player.
+  """
+  player_list = record['players']
+
+  # string array with 2 player names, i.e [Feniks, DarthNoob]
+  player_names = [player_list[0]['name'], player_list[1]['name']]
+
+  # resolve aliases for players who play under several accounts
+  for i in range(len(player_names)):
+    main_name = alias_index.resolve(player_names[i])
+    if main_name is not None:
+        player_names[i] = main_name
+
+  # ex: [P, Z]
+  player_races = [player_list[0]['race'], player_list[1]['race']]
+  player_races = [RACE_DICTIONARY[race] for race in player_races]
+
+  # ex: [Alexa 12 Pool, Google Noobernetes]
+  player_teams = [find_team(teams, player_names[0]), find_team(teams, player_names[1])]
+
+  # Keep naming consistent by always putting players alphabetized by team
+  player_order = [0, 1]
+  if player_teams[1] < player_teams[0]:
+    player_races = [player_races[1], player_races[0]]
+    player_names = [player_names[1], player_names[0]]
+    player_teams = [player_teams[1], player_teams[0]]
+    player_order = [1, 0]
+
+  # ex: Week4
+  replay_time = record['time_utc']
+  week_played = get_date_played(week_time, get_time(replay_time))
+  return player_names, player_races, player_teams, week_played, player_order
+
+
+def normalize_map(map_title):
+  """Gets the English name of a map, ex: Kings Cove LE.
+
+  Args:
+      map_title (string): map name in the replay, in any language
+
+  Returns:
+      string: map name, or None if it isn't in MAP_DICTIONARY and isn't in
+        English.
+  """
+  map_name = map_title.translate(str.maketrans('', '', string.punctuation))
+  if map_name in MAP_DICTIONARY:
+    return MAP_DICTIONARY[map_name]
+  if not map_name.replace(" ","").isalnum():
+    return None
+  return map_name
+
+
+def game_results(record, player_order):
+  """Gets the results of each player for the game index (see game_index.py).
+
+  Args:
+      record (dict): replay record, see replay_parser.py
+      player_order (list of int): order of the players, from describe_game
+
+  Returns:
+      dict: with keys results, mmrs, apms, duration and time_utc
+  """
+  players = [record['players'][i] for i in player_order]
+  return {'results': [player['result'] == 1 for player in players],
+          'mmrs': [player['mmr'] for player in players],
+          'apms': [player['apm'] for player in players],
+          'duration': record['duration'], 'time_utc': record['time_utc']}
+
+
+class MatchupStage:
+
+  """Records who played who every week, to find the team of players missing
+  from the teams file (see team_inference.py).
+
+  Attributes:
+      inference (TeamInference): games played so far
+      output_file (str): JSON file the inferred teams are written to. None
+        only prints them.
+  """
+
+  def __init__(self, teams, aliases, output_file=team_inference.INFERENCE_FILE,
+               alias_index=None, starting_date=STARTING_DATE):
+    self.teams = teams
+    self.aliases = aliases
+    self.alias_index = alias_index or cea_team_name_parser.AliasIndex(aliases)
+    self.week_time = define_cea_date_ranges(starting_date)
+    self.inference = team_inference.TeamInference(teams, aliases)
+    self.output_file = output_file
+
+  def add(self, replay, record):
+    player_names, player_races, player_teams, week_played, _ = describe_game(
+        record, self.teams, self.alias_index, self.week_time)
+    self.add_matchup(player_names, player_teams, week_played)
+
+  def add_journaled(self, replay, entry):
+    """Adds a replay the organizer already processed, from its journal entry."""
+    self.add_matchup(entry['players'], entry['teams'], entry['week'])
+
+  def add_matchup(self, player_names, player_teams, week_played):
+    self.inference.add_game(week_played, player_names)
+
+  def finish(self):
+    # Identify players who are not recognized
+    inference = self.inference.infer()
+    team_inference.print_inference(inference)
+    if self.output_file:
+      team_inference.save_inference(inference, self.output_file)
+
+
+class OrganizeStage:
+
+  """Copies replays into the team/player/matchup folders, and renames the
+  originals to a standardized format once every replay has been seen.
+
+  Attributes:
+      placement (Placement): copies being made on the I/O threads, and
+        renames, see replay_placement.py.
+      counts (Counter): number of replays processed and of copies made.
+      renamed_files (dict): original path => new path. Windows has to close
+        the file before moving them, so renames are done in finish().
+      processed (list of tuple): (original path, journal entry, game index
+        row) of the replays added since the last finish(). They're only
+        written once the copies and renames are made.
+      index (GameIndex): index the organized games are added to, if given.
+      team_directory (str): folder the team folders are in.
+  """
+
+  def __init__(self, directory, output_directory, teams, aliases, cache,
+               store=None, journal=None, alias_index=None, index=None,
+               team_directory="", starting_date=STARTING_DATE,
+               rename_log=replay_placement.RENAME_LOG):
+    self.directory = directory
+    self.output_directory = output_directory
+    self.teams = teams
+    self.aliases = aliases
+    self.alias_index = alias_index or cea_team_name_parser.AliasIndex(aliases)
+    self.cache = cache
+    self.store = store
+    self.journal = journal
+    self.index = index
+    self.team_directory = team_directory
+    self.week_time = define_cea_date_ranges(starting_date)
+    self.counts = Counter()
+    self.placement = replay_placement.Placement(store, counts=self.counts,
+                                                log_file=rename_log)
+    self.renamed_files = {}
+    self.processed = []
+
+  def add(self, replay, record):
+    player_names, player_races, player_teams, week_played, player_order = describe_game(
+        record, self.teams, self.alias_index, self.week_time)
+
+    # ex: Kings Cove LE
+    map_name = normalize_map(record['map_title'])
+
+    # In case map name is not in English.
+    if map_name is None:
+      map_name = record['map_title'].translate(
+                 str.maketrans('', '', string.punctuation))
+      print("Map name %s not recognized" % map_name)
+      print("\t%s, %s" % (week_played, map_name))
+      print("\t%s: %s (%s)" % (player_teams[0], player_names[0], player_races[0]))
+      print("\t%s: %s (%s)" % (player_teams[1], player_names[1], player_races[1]))
+      return
+
+    src = os.path.join(self.directory, replay)
+
+    # don't continue for unknown players so they can be fixed
+    if UNKNOWN_TEAM in player_teams:
+      print("Couldn't find the team for one of the players. Here's what we know:")
+      print("\t%s, %s" % (week_played, map_name))
+      print("\t%s: %s (%s)" % (player_teams[0], player_names[0], player_races[0]))
+      print("\t%s: %s (%s)" % (player_teams[1], player_names[1], player_races[1]))
+      return
+
+    # copy into team/player/matchup folders
+    sha = self.cache.sha256(src)
+    destinations = [
+        copy_path("-".join([player_teams[1], player_names[1], map_name, week_played]),
+            [player_teams[0], "%s (%s)" % (player_names[0], player_races[0]), "vs " + player_races[1]]),
+        copy_path("-".join([player_teams[0], player_names[0], map_name, week_played]),
+            [player_teams[1], "%s (%s)" % (player_names[1], player_races[1]), "vs " + player_races[0]])]
+    destinations = [os.path.join(self.team_directory, destination)
+                    for destination in destinations]
+    self.placement.copy(src, destinations, sha)
+
+    # rename the original to avoid name conflicts and make it clear what's been processed
+    to_rename = "-".join([
+      week_played,
+      player_teams[0], player_teams[1],
+      player_names[0], player_names[1],
+      player_races[0], player_races[1],
+      map_name]).replace(" ","_") + ".SC2Replay"
+    dst = os.path.join(self.output_directory, to_rename)
+    if src.lower() != dst.lower():
+      self.counts['replays processed'] += 1
+      os.makedirs(self.output_directory, exist_ok=True)
+      self.renamed_files[src] = dst
+    else:
+      self.counts['replays were already processed'] += 1
+
+    entry = {
+        'sha256': sha, 'name': to_rename, 'size': os.path.getsize(src),
+        'week': week_played, 'teams': player_teams,
+        'players': player_names, 'races': player_races, 'map': map_name,
+        'fingerprint': record.get('fingerprint'), 'destinations': destinations}
+    self.processed.append((src, entry, dict(
+        entry, path=dst, **game_results(record, player_order))))
+
+  def add_journaled(self, replay, entry):
+    """Skips a replay the organizer already processed."""
+    self.counts['replays were already processed'] += 1
+
+  def finish(self):
+    """Renames the replays added since the last call, and journals and
+    indexes them. Replays that couldn't be copied are left for the next run.
+
+    Returns:
+        dict: original path => new path
+    """
+    failed = self.placement.wait()
+    self.placement.close()
+    renamed_files, self.renamed_files = self.renamed_files, {}
+    for key, value in list(renamed_files.items()):
+      if key in failed:
+        del renamed_files[key]
+      else:
+        self.placement.rename(key, value)
+    processed, self.processed = self.processed, []
+    self.placement.commit()
+    for key, value in renamed_files.items():
+        self.cache.rename(key, value)
+    for src, entry, row in processed:
+      if src in failed:
+        continue
+      if self.journal is not None:
+        self.journal.append(entry)
+      if self.index is not None:
+        self.index.add_game(row)
+    if self.journal is not None:
+      self.journal.close()
+    if self.index is not None:
+      self.index.commit()
+
+    for count_name, count in sorted(self.counts.items()):
+      print(count, count_name)
+    return renamed_files
+
+
+def split_journaled(directory, replays, journal):
+  """Separates replays the journal says were already processed, which don't
+  need to be opened, from the ones that must be decoded.
+
+  Args:
+      directory (string): replay directory
+      replays (list of string): names of the replay files
+      journal (ReplayJournal): journal of processed replays
+
+  Returns:
+      tuple: (list of (replay, journal entry), list of replays to decode)
+  """
+  journaled = []
+  to_decode = []
+  for replay in replays:
+    entry = journal.lookup(os.path.join(directory, replay))
+    if entry is None:
+      to_decode.append(replay)
+    else:
+      journaled.append((replay, entry))
+  return journaled, to_decode
+
+
+def organize_replays(directory, output_directory, teams, aliases, cache=None,
+                     jobs=1, store=None, journal=None, index=None):
   """copies replays to another directory with standardized format
   
   Args:
       directory (string): replay directory
       output_directory (string): new replay directory
       teams (dict): dict with key = player, value = team
+      aliases (dict): dict with key = player alias, value = main player name
+      cache (ReplayCache): cache of decoded replays. Uses the default
+        on-disk cache if not given.
+      jobs (int): number of processes used to decode replays
+      store (ReplayStore): store the team folder copies link to. Uses the
+        default store if not given.
+      journal (ReplayJournal): journal of processed replays, which are
+        skipped without being opened. Uses the default journal if not given.
+      index (GameIndex): index of games the organized replays are added to.
+        Uses the default index if not given.
   """
-  # Using mypq, load the replay file
-  matcher = re.compile(r'\.SC2Replay$', re.IGNORECASE)
-  replays = [file for file in os.listdir(directory) if matcher.search(file)]
+  if cache is None:
+    cache = replay_cache.ReplayCache(
+        quarantine=replay_quarantine.Quarantine())
+  if store is None:
+    store = replay_store.ReplayStore()
+  if journal is None:
+    journal = replay_journal.ReplayJournal()
+  if index is None:
+    index = game_index.GameIndex()
+
+  replays = replay_parser.list_replays(directory)
   print("Found %d replays to scan" % len(replays))
 
-  #The dates corresponding to each week
-  week_time = define_cea_date_ranges()  
-  race_dictionary = {
-    "Protoss" : "P" , "Zerg" : "Z", "Terran" : "T",
-    "异虫" : "Z", "星灵" : "P", "人类" : "T"}
-  map_dictionary = {
-    "Automaton LE" : "Automaton LE",
-    "机械城  天梯版" : "Automaton LE",
-    "Kings Cove LE" : "Kings Cove LE",
-    "国王藏宝地天梯版" : "Kings Cove LE",
-    "Year Zero LE" : "Year Zero LE",
-    "New Repugnancy LE" : "New Repugnancy LE",
-    "Cyber Forest LE" : "Cyber Forest LE",
-    "赛博森林天梯版" : "Cyber Forest LE",
-    "Port Aleksander LE" : "Port Aleksander LE",
-    "Kairos Junction LE" : "Kairos Junction LE",
-    "Acropolis LE" : "Acropolis LE",
-    "Thunderbird LE" : "Thunderbird LE",
-    "Turbo Cruise 84 LE" : "Turbo Cruise 84 LE",
-    "Triton LE" : "Triton LE",
-    "Disco Bloodbath LE" : "Disco Bloodbath LE",
-    "Winters Gate LE" :  "Winters Gate LE",
-    "Ephemeron LE" : "Ephemeron LE",
-    "World of Sleepers LE" : "World of Sleepers LE",
-  }
-
-  # Windows has to close the file before moving them, so
-  # files must be stored in a dictionary.
-  renamed_files = {}
-
-  # 2 dimensional dictionary that stores matchups per week.
-  # KEY 1: Week, VALUE 1: Dictionary<string,list>
-  # ex: matchup_dictionary['Week1']['Microsoft Macrohard']
-  matchup_dictionary = {}
+  alias_index = cea_team_name_parser.AliasIndex(aliases)
+  organizer = OrganizeStage(directory, output_directory, teams, aliases, cache,
+                            store, journal, alias_index, index)
+  matchups = MatchupStage(teams, aliases, alias_index=alias_index)
 
-  for replay in replays:
-    try:
-      # necessary stuff from s2protocol
-      archive = mpyq.MPQArchive(os.path.join(directory,replay))
-      contents = archive.header['user_data_header']['content']
-      header = versions.latest().decode_replay_header(contents)
-      base_build = header['m_version']['m_baseBuild']
-      # Build 76114 was never added to s2protocol.
-      if base_build == 76811:
-        protocol = versions.build(76114)
-      else:
-        protocol = versions.build(base_build)
-      
-      # get the general info about the replay
-      contents = archive.read_file('replay.details')
-      result = protocol.decode_replay_details(contents)
-      player_list = result['m_playerList']
-      
-      # string array with 2 player names, i.e [Feniks, DarthNoob]
-      player_names = [erase_punctuation(player_list[0]['m_name']),
-                      erase_punctuation(player_list[1]['m_name'])]
-      
-      # resolve aliases for players who play under several accounts
-      for i in range(len(player_names)):
-        if player_names[i].lower() in aliases:
-            player_names[i] = aliases[player_names[i].lower()]
-      
-      # ex: [P, Z]
-      player_races = [player_list[0]['m_race'].decode('UTF-8'),
-                      player_list[1]['m_race'].decode('UTF-8')]
-      player_races = [race_dictionary[race] for race in player_races]
-      
-      # ex: [Alexa 12 Pool, Google Noobernetes]
-      player_teams = [find_team(teams, player_names[0]), find_team(teams, player_names[1])]
-      
-      # Keep naming consistent by always putting players alphabetized by team
-      if player_teams[1] < player_teams[0]:
-        player_races = [player_races[1], player_races[0]]
-        player_names = [player_names[1], player_names[0]]
-        player_teams = [player_teams[1], player_teams[0]]
-
-      # ex: Week4
-      replay_time = result['m_timeUTC']
-      week_played = get_date_played(week_time, get_time(replay_time))
-
-      # Updates the Matchup Dictionary
-      if week_played not in matchup_dictionary:
-        matchup_dictionary[week_played] = {}
-      matchup_dictionary[week_played].setdefault(player_teams[0], []).append(player_names[1])
-      matchup_dictionary[week_played].setdefault(player_teams[1], []).append(player_names[0])
-
-      # ex: Kings Cove LE
-      map_name = result['m_title'].decode('UTF-8').translate(
-                 str.maketrans('', '', string.punctuation))
+  fingerprints = replay_fingerprints.FingerprintIndex()
+  journaled, replays = split_journaled(directory, replays, journal)
+  for replay, entry in journaled:
+    fingerprints.add_journaled(os.path.join(directory, replay), entry)
+    matchups.add_journaled(replay, entry)
+    organizer.add_journaled(replay, entry)
 
-      # In case map name is not in English.
-      if not map_name.replace(" ","").isalnum() and map_name not in map_dictionary:
-        print("Map name %s not recognized" % map_name)
-        print("\t%s, %s" % (week_played, map_name))
-        print("\t%s: %s (%s)" % (player_teams[0], player_names[0], player_races[0]))
-        print("\t%s: %s (%s)" % (player_teams[1], player_names[1], player_races[1]))
-        continue
-      elif map_name in map_dictionary:
-        map_name = map_dictionary[map_name]
-      
-      src = os.path.join(directory, replay)
-      
-      # don't continue for unknown players so they can be fixed
-      if UNKNOWN_TEAM in player_teams:
-        print("Couldn't find the team for one of the players. Here's what we know:")
-        print("\t%s, %s" % (week_played, map_name))
-        print("\t%s: %s (%s)" % (player_teams[0], player_names[0], player_races[0]))
-        print("\t%s: %s (%s)" % (player_teams[1], player_names[1], player_races[1]))
+  # Sorted, so which replay of a game is kept doesn't depend on the order of
+  # the files in the folder, even when its replays are in different batches.
+  replays = sorted(replays)
+  for start in range(0, len(replays), DECODE_BATCH):
+    batch = replays[start:start + DECODE_BATCH]
+    paths = [os.path.join(directory, replay) for replay in batch]
+    records = cache.get_many(paths, jobs)
+    batch, paths, records = fingerprints.drop_duplicates(batch, paths, records)
+    for replay, (result, error) in zip(batch, records):
+      if error:
+        print("Error processing replay: %s" % replay)
+        print(error, end='')
         continue
-      
-      # copy into team/player/matchup folders
-      copy_into_path(src, 
-          "-".join([player_teams[1], player_names[1], map_name, week_played]),
-          [player_teams[0], "%s (%s)" % (player_names[0], player_races[0]), "vs " + player_races[1]])
-      copy_into_path(src,
-          "-".join([player_teams[0], player_names[0], map_name, week_played]),
-          [player_teams[1], "%s (%s)" % (player_names[1], player_races[1]), "vs " + player_races[0]])
-          
-      # rename the original to avoid name conflicts and make it clear what's been processed
-      to_rename = "-".join([
-        week_played,
-        player_teams[0], player_teams[1],
-        player_names[0], player_names[1],
-        player_races[0], player_races[1],
-        map_name]).replace(" ","_") + ".SC2Replay"
-      dst = os.path.join(output_directory, to_rename)
-      if src.lower() != dst.lower():
-        counts['replays processed'] += 1
-        os.makedirs(output_directory, exist_ok=True)
-        renamed_files[src] = dst
-      else:
-        counts['replays were already processed'] += 1
-    except:
-      print("Error processing replay: %s" % replay)
-      traceback.print_exc()
-  for key, value in renamed_files.items():
-      shutil.move(key, value)
-
-  for count_name, count in sorted(counts.items()):
-    print(count, count_name)
-
-  # Identify players who are not recognized
-  identify_unknown_players(matchup_dictionary, teams)
+      try:
+        with metrics.timer('matchups.add'):
+          matchups.add(replay, result)
+        with metrics.timer('organize.add'):
+          organizer.add(replay, result)
+      except:
+        metrics.record_failure('organize', sys.exc_info()[1])
+        print("Error processing replay: %s" % replay)
+        traceback.print_exc()
+  with metrics.timer('organize.finish'):
+    organizer.finish()
+  cache.save()
+  with metrics.timer('matchups.finish'):
+    matchups.finish()
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Organize replays into the team folders')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
   teams, aliases = cea_team_name_parser.init_dictionary(TEAMS_FILE)
-  organize_replays(REPLAY_DIRECTORY, REPLAY_DIRECTORY, teams, aliases)
+  metrics.run(args, organize_replays, REPLAY_DIRECTORY, REPLAY_DIRECTORY,
+              teams, aliases, jobs=args.jobs)
 
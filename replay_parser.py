@@ -0,0 +1,303 @@
+"""Decodes a .SC2Replay file into a plain record shared by the replay scripts.
+
+The record only keeps what replay_organizer.py and stats_compiler.py use, so
+that it can be cached on disk (see replay_cache.py) and passed around freely.
+
+Record layout:
+    base_build (int): Base build of the game client.
+    map_title (str): Map name as stored in replay.details.
+    time_utc (int): m_timeUTC of the game, in 100ns ticks since 1601.
+    duration (int): Game length in seconds, None if there is no metadata.
+    fingerprint (str): Identifies the game, so that replays of the same game
+                       saved by different players have the same fingerprint.
+                       See game_fingerprint.
+    players (list of dict): One entry per player with keys
+        name (str): Player name without clan tag.
+        race (str): Race from replay.details, localized.
+        selected_race (str): Race from replay.gamemetadata.json.
+        result (int): 1 if the player won, 2 if not.
+        mmr (int): MMR, 0 when player is unranked or it's missing.
+        apm (float): APM, 0 when it's missing.
+"""
+import contextlib
+import json
+import os
+import re
+import signal
+import threading
+import time
+import traceback
+import metrics
+import mpq_reader
+import protocols
+
+# Top level folders that aren't team folders.
+EXCLUDED_DIRECTORIES = {".git", "data", "UploadHere", "__pycache__", "seasons",
+                        "fixtures"}
+REPLAY_FILE = re.compile(r'\.SC2Replay$', re.IGNORECASE)
+# macOS metadata (AppleDouble) files, ex: "1 ._Zen LE.SC2Replay" once the
+# downloader prefixed it with its count.
+APPLEDOUBLE_FILE = re.compile(r'^(\d+ )?\._')
+# Seconds a replay may take to decode before it's given up on.
+DECODE_TIMEOUT = 60
+
+
+class DecodeTimeout(Exception):
+  """A replay took longer than DECODE_TIMEOUT to decode."""
+
+
+# Failures that decoding the same file again won't fix. Anything else (a
+# build s2protocol doesn't know yet, a crashed worker, a read error) may not
+# happen on a later run.
+INVALID_REPLAY_ERRORS = (mpq_reader.InvalidReplay, DecodeTimeout)
+
+
+def erase_punctuation(player_name):
+  """Player names can come in the form of
+    b'&lt;AMZN&gt;<sp/>Feniks'
+    so we remove all punctuation and everything
+    to the left of it, to remove b' and the tag
+  Args:
+      player_name (String): full name of player
+
+  Returns:
+      string: name of player, without tag or punctuation
+  """
+  player_name = player_name.decode('UTF-8')
+  return player_name.split('>', 1)[-1]
+
+
+def list_replays(directory):
+  """Lists the .SC2Replay files in a directory, leaving out macOS metadata
+  files.
+
+  Args:
+      directory (string): replay directory
+
+  Returns:
+      list of string: names of the replay files
+  """
+  return [file for file in os.listdir(directory)
+          if REPLAY_FILE.search(file) and not APPLEDOUBLE_FILE.match(file)]
+
+
+def game_fingerprint(details):
+  """Identifies a game from its replay.details: start time and the toon
+  handles of the players (which, unlike names, can't change). The map title
+  isn't part of it, it's in the language of the client that saved the
+  replay.
+
+  Args:
+      details (dict): decoded replay.details
+
+  Returns:
+      string: ex: 132317307396938932:1-1-2220136,1-1-3024469
+  """
+  toons = sorted("%d-%d-%d" % (player['m_toon']['m_region'],
+                               player['m_toon']['m_realm'],
+                               player['m_toon']['m_id'])
+                 for player in details['m_playerList'])
+  return "%d:%s" % (details['m_timeUTC'], ','.join(toons))
+
+
+def find_team_replays(root="."):
+  """Lists every replay in the team folders, in a deterministic order.
+
+  Args:
+      root (string): directory containing the team folders
+
+  Returns:
+      list of string: paths of the replays
+  """
+  matcher = re.compile(r'\.SC2Replay$', re.IGNORECASE)
+  replays = []
+  for team in sorted(os.listdir(root)):
+    if team in EXCLUDED_DIRECTORIES or not os.path.isdir(os.path.join(root, team)):
+      continue
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, team)):
+      dirnames.sort()
+      replays.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+                     if matcher.search(f))
+  return replays
+
+
+@contextlib.contextmanager
+def _timed(timings, name):
+  """Adds the time spent in the block to timings[name], if timings is given."""
+  if timings is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    timings[name] += time.perf_counter() - start
+
+
+def decode_replay(path, timings=None, archive=None):
+  """Decodes the header, replay.details and replay.gamemetadata.json of a
+  replay into a record. Only those are read from the file.
+
+  Args:
+      path (string): path of the replay file
+      timings (Counter): if given, seconds spent in each step are added to
+        it, under mpq_open, header_decode, protocol_lookup, details_decode
+        and metadata_parse.
+      archive (MPQReader): the replay, already open. It's opened and closed
+        here if None.
+
+  Returns:
+      dict: replay record, see the module docstring.
+  """
+  if archive is None:
+    with _timed(timings, 'mpq_open'):
+      archive = mpq_reader.MPQReader(path)
+    with archive:
+      return decode_replay(path, timings, archive)
+
+  with _timed(timings, 'header_decode'):
+    header = protocols.latest().decode_replay_header(archive.user_data)
+  base_build = header['m_version']['m_baseBuild']
+  with _timed(timings, 'protocol_lookup'):
+    protocol = protocols.get(base_build)
+
+  with _timed(timings, 'details_decode'):
+    details = protocol.decode_replay_details(archive.read_file('replay.details'))
+
+  # Metadata is missing in some old replays.
+  with _timed(timings, 'metadata_parse'):
+    metadata_contents = archive.read_file('replay.gamemetadata.json')
+    if metadata_contents:
+      metadata_json = json.loads(metadata_contents.decode('utf-8'))
+    else:
+      metadata_json = {'Players': []}
+  metadata_players = metadata_json['Players']
+
+  players = []
+  for i, player in enumerate(details['m_playerList']):
+    metadata = metadata_players[i] if i < len(metadata_players) else {}
+    players.append({
+        'name': erase_punctuation(player['m_name']),
+        'race': player['m_race'].decode('UTF-8'),
+        'selected_race': metadata.get('SelectedRace', 0),
+        'result': player['m_result'],
+        'mmr': metadata.get('MMR', 0),
+        'apm': metadata.get('APM', 0),
+    })
+
+  return {
+      'base_build': base_build,
+      'map_title': details['m_title'].decode('UTF-8'),
+      'time_utc': details['m_timeUTC'],
+      'duration': metadata_json.get('Duration'),
+      'fingerprint': game_fingerprint(details),
+      'players': players,
+  }
+
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+  """Raises DecodeTimeout in the block once it has run for `seconds`. The
+  block isn't limited where there's no SIGALRM (Windows), or outside the main
+  thread."""
+  if (not seconds or not hasattr(signal, 'setitimer')
+      or threading.current_thread() is not threading.main_thread()):
+    yield
+    return
+
+  def expired(signum, frame):
+    raise DecodeTimeout("Decoding took more than %g seconds" % seconds)
+
+  previous = signal.signal(signal.SIGALRM, expired)
+  signal.setitimer(signal.ITIMER_REAL, seconds)
+  try:
+    yield
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, previous)
+
+
+def _decode_timed(path):
+  """Checks and decodes a replay, returning (record, error, exception type
+  name, seconds taken, size of the file, bytes of it read). error is the
+  traceback, or only the reason if the replay isn't valid."""
+  start = time.perf_counter()
+  size = bytes_read = 0
+  try:
+    with mpq_reader.MPQReader(path) as archive:
+      size = archive.size
+      archive.check()
+      with _time_limit(DECODE_TIMEOUT):
+        record = decode_replay(path, archive=archive)
+      error = exception = None
+      bytes_read = archive.bytes_read
+  except INVALID_REPLAY_ERRORS as e:
+    exception = type(e).__name__
+    record, error = None, "%s: %s\n" % (exception, e)
+  except Exception as e:
+    record, error, exception = None, traceback.format_exc(), type(e).__name__
+  return (record, error, exception, time.perf_counter() - start, size,
+          bytes_read)
+
+
+def decode_replays(paths, jobs=1):
+  """Decodes several replays, in `jobs` worker processes if jobs > 1.
+
+  Replays are sent to the workers in chunks, and each worker keeps the
+  protocol modules it has loaded between chunks. Each replay is mapped with
+  mpq_reader.MPQReader and checked first, and given up on after
+  DECODE_TIMEOUT seconds. How long each replay took, how much of it was read
+  and why it failed is recorded in metrics.py.
+
+  Args:
+      paths (list of string): paths of the replay files
+      jobs (int): number of worker processes
+
+  Returns:
+      list: (record, error) tuple for each path, in the same order. error is
+        the formatted traceback if the replay could not be decoded, or the
+        reason if it isn't valid or timed out (see invalid_replay), else
+        None.
+  """
+  if jobs <= 1 or len(paths) < 2:
+    results = [_decode_timed(path) for path in paths]
+  else:
+    # Only import multiprocessing when it's needed, it slows down startup.
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    chunksize = max(1, len(paths) // (jobs * 4))
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=protocols.warm) as executor:
+      try:
+        for result in executor.map(_decode_timed, paths, chunksize=chunksize):
+          results.append(result)
+      except BrokenProcessPool:
+        # A worker died, the replays it hadn't returned are reported as
+        # failed and tried again on the next run.
+        error = traceback.format_exc()
+        results += [(None, error, 'BrokenProcessPool', 0, 0, 0)] * (
+            len(paths) - len(results))
+
+  for path, (record, error, exception, seconds, size, bytes_read) in zip(
+      paths, results):
+    metrics.record_replay(path, seconds, size,
+                          record['base_build'] if record else None, bytes_read)
+    if exception:
+      metrics.record_failure('decode', exception)
+  return [result[:2] for result in results]
+
+
+def invalid_replay(error):
+  """Whether a decode error from decode_replays means the replay itself is
+  broken (see INVALID_REPLAY_ERRORS), rather than it couldn't be decoded this
+  time.
+
+  Args:
+      error (string): error returned by decode_replays
+
+  Returns:
+      bool
+  """
+  return error.startswith(tuple(
+      exception.__name__ + ":" for exception in INVALID_REPLAY_ERRORS))
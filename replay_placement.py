@@ -0,0 +1,212 @@
+"""Puts replays in the team folders and renames the uploads, for
+replay_organizer.py.
+
+Copies are planned as replays are organized, and made on a pool of I/O
+threads while the next replays are decoded. Each directory is only created
+once, and a destination planned twice is only written once. Copies are
+links into the replay store when there is one (see replay_store.py), and
+otherwise made inside the kernel with copy_file_range or sendfile.
+
+Renames are made together once the copies are done. They're written to
+RENAME_LOG first, and undone if the run fails partway, right away or from the
+log on the next run if the process died, so the upload folder is never left
+half renamed.
+
+Attributes:
+    IO_JOBS (int): Default number of I/O threads.
+    RENAME_LOG (str): Default location of the rename log.
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import replay_store
+
+IO_JOBS = 4
+RENAME_LOG = "data/rename_log.json"
+
+
+def undo_renames(renames):
+  """Moves renamed files back, last renamed first.
+
+  Args:
+      renames (list of tuple): (original path, new path) of done renames
+
+  Returns:
+      int: number of files moved back
+  """
+  undone = 0
+  for src, dst in reversed(renames):
+    if os.path.exists(dst) and not os.path.exists(src):
+      shutil.move(dst, src)
+      undone += 1
+  return undone
+
+
+def recover(log_file=RENAME_LOG):
+  """Undoes the renames of a run that died partway, if the log says so."""
+  try:
+    with open(log_file, 'r', encoding='utf-8') as f:
+      renames = json.load(f)
+  except (OSError, ValueError):
+    return
+  undone = undo_renames(renames)
+  os.remove(log_file)
+  print("Undid %d renames of an interrupted run" % undone)
+
+
+class Placement:
+
+  """Copies and renames of replays, made in batches.
+
+  Attributes:
+      store (ReplayStore): store the copies link to. Copies are plain copies
+        if None.
+      counts (Counter): number of copies made, by method, and of copies that
+        already existed.
+      log_file (str): JSON file the renames are logged to while they're
+        made. None doesn't log them.
+  """
+
+  def __init__(self, store=None, jobs=IO_JOBS, counts=None, log_file=RENAME_LOG):
+    self.store = store
+    self.jobs = jobs
+    self.counts = Counter() if counts is None else counts
+    self.log_file = log_file
+    self._directories = set()
+    self._planned = set()
+    self._futures = []
+    self._renames = []
+    self._executor = None
+    self._lock = threading.Lock()
+    # SHA-256 => lock held while adding that replay to the store
+    self._sha_locks = {}
+    if log_file:
+      recover(log_file)
+
+  def copy(self, src, destinations, sha=None):
+    """Plans copies of a replay. Destinations that already exist are left
+    alone.
+
+    Args:
+        src (string): replay file
+        destinations (list of string): paths of the copies
+        sha (string): SHA-256 of the file, computed if not given.
+    """
+    to_copy = []
+    for dst in destinations:
+      if dst in self._planned:
+        self._count('replay copies already existed')
+        continue
+      self._planned.add(dst)
+      directory = os.path.dirname(dst)
+      if directory not in self._directories:
+        os.makedirs(directory, exist_ok=True)
+        self._directories.add(directory)
+      to_copy.append(dst)
+    if not to_copy:
+      return
+    if self._executor is None:
+      self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+    self._futures.append((src, self._executor.submit(
+        self._copy, src, to_copy, sha)))
+
+  def _count(self, name):
+    with self._lock:
+      self.counts[name] += 1
+
+  def _copy(self, src, destinations, sha):
+    with metrics.timer('organize.copy'):
+      to_copy = []
+      for dst in destinations:
+        if os.path.isfile(dst):
+          self._count('replay copies already existed')
+        else:
+          to_copy.append(dst)
+      if to_copy and self.store is not None:
+        with self._lock:
+          sha_lock = self._sha_locks.setdefault(sha, threading.Lock())
+        with sha_lock:
+          sha = self.store.add(src, sha)
+      for dst in to_copy:
+        # Another process, ex: the watcher, may have made it since.
+        try:
+          if self.store is None:
+            replay_store.copy_file(src, dst)
+            method = None
+          else:
+            method = self.store.materialize(sha, dst)
+        except FileExistsError:
+          self._count('replay copies already existed')
+          continue
+        self._count('replay copies organized')
+        if method:
+          self._count('replay copies made as ' + method)
+
+  def wait(self):
+    """Waits for the planned copies. Copies that failed are reported, and
+    the replay they were made from isn't renamed.
+
+    Returns:
+        set of string: replays that couldn't be copied
+    """
+    futures, self._futures = self._futures, []
+    failed = set()
+    for src, future in futures:
+      try:
+        future.result()
+      except:
+        metrics.record_failure('organize.copy', sys.exc_info()[1])
+        print("Error copying replay: %s" % src)
+        traceback.print_exc()
+        failed.add(src)
+    return failed
+
+  def rename(self, src, dst):
+    """Plans a rename, made by commit()."""
+    self._renames.append((src, dst))
+
+  def commit(self):
+    """Makes the planned renames, all of them or none.
+
+    Returns:
+        list of tuple: (original path, new path) of the renames
+    """
+    renames, self._renames = self._renames, []
+    if not renames:
+      return []
+    if self.log_file:
+      directory = os.path.dirname(self.log_file)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      temp_file = self.log_file + '.tmp'
+      with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(renames, f)
+      os.replace(temp_file, self.log_file)
+    done = []
+    try:
+      for src, dst in renames:
+        shutil.move(src, dst)
+        done.append((src, dst))
+    except:
+      print("Renaming failed, undid %d renames" % undo_renames(done))
+      self._remove_log()
+      raise
+    self._remove_log()
+    return renames
+
+  def _remove_log(self):
+    if self.log_file:
+      os.remove(self.log_file)
+
+  def close(self):
+    """Stops the I/O threads. The next copy starts them again."""
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
@@ -0,0 +1,174 @@
+"""Quarantine of the broken replays, so later runs don't try them again.
+Usage: python replay_quarantine.py list
+To move quarantined replays back where they were uploaded, for instance once
+a newer s2protocol can read them,
+  python replay_quarantine.py release [SHA-256 ...]
+
+A replay that isn't valid (see mpq_reader.check_archive) or times out is
+moved out of the upload folder into the quarantine folder, as
+<SHA-256>.SC2Replay, and the reason is recorded by content hash. Later runs
+don't see it, and a new upload of the same file is recognized from its hash
+by ReplayCache, before any decoding, and quarantined too.
+
+Attributes:
+    QUARANTINE_FILE (str): Default location of the quarantine records. The
+      replays are moved to the folder of the same name, without .json.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import metrics
+
+QUARANTINE_FILE = "data/quarantine.json"
+
+
+class Quarantine:
+
+  """Replays that couldn't be decoded, by content hash.
+
+  Attributes:
+      filename (str): JSON file of the quarantine records. None keeps them in
+        memory.
+      directory (str): Folder the replays are moved to. None leaves them
+        where they are.
+      entries (dict): SHA-256 => {'name', 'source', 'reason', 'time'}, the
+        file name and folder the replay was uploaded as, why it was
+        quarantined and when.
+  """
+
+  def __init__(self, filename=QUARANTINE_FILE, directory=None):
+    self.filename = filename
+    if directory is None and filename:
+      directory = os.path.splitext(filename)[0]
+    self.directory = directory
+    self.entries = {}
+    self._dirty = False
+    self.load()
+
+  def load(self):
+    if not self.filename:
+      return
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        self.entries = json.load(f)
+    except (OSError, ValueError):
+      return
+
+  def save(self):
+    """Writes the quarantine records, replacing the file in one step."""
+    if not self.filename or not self._dirty:
+      return
+    directory = os.path.dirname(self.filename)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    temp_file = self.filename + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+      json.dump(self.entries, f, ensure_ascii=False, indent=1)
+    os.replace(temp_file, self.filename)
+    self._dirty = False
+
+  def reason(self, sha):
+    """Gets why a replay was quarantined.
+
+    Args:
+        sha (string): SHA-256 of the replay
+
+    Returns:
+        string: the reason, None if it isn't quarantined.
+    """
+    entry = self.entries.get(sha)
+    return entry['reason'] if entry else None
+
+  def path(self, sha):
+    """Gets where a quarantined replay is kept."""
+    return os.path.join(self.directory, sha + ".SC2Replay")
+
+  def add(self, path, sha, reason):
+    """Quarantines a replay, moving it to the quarantine folder.
+
+    Args:
+        path (string): path of the replay file
+        sha (string): SHA-256 of the replay
+        reason (string): why it can't be decoded
+    """
+    if sha not in self.entries:
+      self.entries[sha] = {'name': os.path.basename(path),
+                           'source': os.path.dirname(path),
+                           'reason': reason, 'time': time.time()}
+      self._dirty = True
+      metrics.count('replays.quarantined')
+    if self.directory is None or not os.path.isfile(path):
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    if os.path.isfile(self.path(sha)):
+      # Another upload of a replay already in quarantine.
+      os.remove(path)
+    else:
+      shutil.move(path, self.path(sha))
+    print("Moved %s to %s" % (path, self.directory))
+
+  def release(self, shas=None):
+    """Moves quarantined replays back to where they were uploaded, and
+    forgets them.
+
+    Args:
+        shas (list of string): SHA-256 of the replays, all of them if None
+
+    Returns:
+        list of string: paths the replays were moved back to
+    """
+    released = []
+    for sha in list(self.entries) if shas is None else shas:
+      entry = self.entries.pop(sha, None)
+      if entry is None:
+        print("No replay %s in quarantine" % sha)
+        continue
+      self._dirty = True
+      if self.directory is None or not os.path.isfile(self.path(sha)):
+        continue
+      dst = os.path.join(entry['source'], entry['name'])
+      if os.path.exists(dst):
+        dst = os.path.join(entry['source'], sha + ".SC2Replay")
+      os.makedirs(entry['source'] or '.', exist_ok=True)
+      shutil.move(self.path(sha), dst)
+      released.append(dst)
+    return released
+
+
+def print_quarantine(quarantine):
+  if not quarantine.entries:
+    print("No replays in quarantine")
+    return
+  for sha, entry in sorted(quarantine.entries.items(),
+                           key=lambda item: item[1]['time']):
+    print("%s  %s  %s" % (sha[:12], time.strftime(
+        '%Y-%m-%d', time.localtime(entry['time'])),
+        os.path.join(entry['source'], entry['name'])))
+    print("\t%s" % entry['reason'])
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='List or release the replays that could not be decoded')
+  parser.add_argument('command', choices=['list', 'release'],
+                      help='What to do')
+  parser.add_argument('shas', nargs='*',
+                      help='SHA-256 of the replays to release, all if none')
+  parser.add_argument('--file', dest='filename', default=QUARANTINE_FILE,
+                      help='Quarantine records, ex: data/Fall2019/quarantine.json')
+  args = parser.parse_args()
+  quarantine = Quarantine(args.filename)
+  if args.command == 'list':
+    print_quarantine(quarantine)
+  else:
+    shas = args.shas or None
+    if shas:
+      # Accept the abbreviated hashes printed by list.
+      shas = [next((sha for sha in quarantine.entries if sha.startswith(prefix)),
+                   prefix) for prefix in shas]
+    for path in quarantine.release(shas):
+      print("Released %s" % path)
+    quarantine.save()
@@ -0,0 +1,304 @@
+"""Content-addressed store of replay files, so that the copies in the team
+folders don't each take up disk space.
+
+Each replay is stored once under its SHA-256, and the team/player/matchup
+folders get hardlinks to it. Where hardlinks aren't possible, reflinks (copy
+on write clones) are tried, and then plain copies.
+Usage: python replay_store.py import
+  Moves the replays already in the team folders of every season into the
+  store.
+Usage: python replay_store.py verify
+  Checks that every stored replay still matches its hash.
+Usage: python replay_store.py gc
+  Deletes stored replays that no team folder links to anymore.
+
+Attributes:
+    STORE_DIRECTORY (str): Default location of the store.
+"""
+import argparse
+import errno
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+import replay_cache
+import replay_parser
+
+STORE_DIRECTORY = "data/replay_store/"
+
+# ioctl to clone a file on filesystems that support reflinks, from linux/fs.h.
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+  """Clones src into a new file dst without copying the data.
+
+  Raises:
+      FileExistsError: if dst already exists.
+      OSError: if the platform or filesystem doesn't support reflinks.
+  """
+  try:
+    import fcntl
+  except ImportError:
+    raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported")
+  # dst may be a link to src, opening it with 'wb' would truncate both.
+  with open(src, 'rb') as src_file, open(dst, 'xb') as dst_file:
+    try:
+      fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+      dst_file.close()
+      os.remove(dst)
+      raise
+
+
+def copy_file(src, dst):
+  """Copies src into a new file dst inside the kernel, with copy_file_range
+  or else sendfile, falling back to a plain copy where neither works.
+
+  Raises:
+      FileExistsError: if dst already exists.
+  """
+  with open(src, 'rb', buffering=0) as src_file, \
+       open(dst, 'xb', buffering=0) as dst_file:
+    size = os.fstat(src_file.fileno()).st_size
+    for method in ('copy_file_range', 'sendfile'):
+      if not hasattr(os, method):
+        continue
+      offset = 0
+      try:
+        while offset < size:
+          if method == 'copy_file_range':
+            sent = os.copy_file_range(src_file.fileno(), dst_file.fileno(),
+                                      size - offset)
+          else:
+            sent = os.sendfile(dst_file.fileno(), src_file.fileno(), offset,
+                               size - offset)
+          if sent == 0:
+            break
+          offset += sent
+        if offset >= size:
+          return
+      except OSError as e:
+        # Not supported between these files, start over with the next one.
+        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                           errno.EOPNOTSUPP, errno.ENOTSOCK):
+          raise
+      src_file.seek(0)
+      dst_file.seek(0)
+      dst_file.truncate()
+    shutil.copyfileobj(src_file, dst_file)
+
+
+def link_or_copy(src, dst):
+  """Puts src at dst with a hardlink, a reflink or a copy, whichever works
+  first.
+
+  Returns:
+      string: 'hardlink', 'reflink' or 'copy'
+
+  Raises:
+      FileExistsError: if dst already exists.
+  """
+  try:
+    os.link(src, dst)
+    return 'hardlink'
+  except FileExistsError:
+    raise
+  except OSError:
+    pass
+  try:
+    reflink(src, dst)
+    return 'reflink'
+  except FileExistsError:
+    raise
+  except OSError:
+    pass
+  copy_file(src, dst)
+  return 'copy'
+
+
+def replace_with(src, dst):
+  """Puts src at dst like link_or_copy, replacing dst in one step if it
+  already exists. The link or copy is made under a unique temporary name
+  next to dst, so concurrent calls don't collide.
+
+  Returns:
+      string: 'hardlink', 'reflink' or 'copy'
+  """
+  fd, temp_path = tempfile.mkstemp(
+      prefix='.' + os.path.basename(dst) + '.', suffix='.tmp',
+      dir=os.path.dirname(dst) or '.')
+  os.close(fd)
+  os.remove(temp_path)
+  try:
+    method = link_or_copy(src, temp_path)
+    os.replace(temp_path, dst)
+  finally:
+    # Also left behind when dst was already a hardlink to src, renaming a
+    # link over another link to the same file does nothing.
+    if os.path.lexists(temp_path):
+      os.remove(temp_path)
+  return method
+
+
+class ReplayStore:
+
+  """Replay files stored by content hash.
+
+  Attributes:
+      directory (str): Root of the store.
+  """
+
+  def __init__(self, directory=STORE_DIRECTORY):
+    self.directory = directory
+    self._claimed = set()
+    self._lock = threading.Lock()
+
+  def object_path(self, sha):
+    """Gets where the replay with the given SHA-256 is stored."""
+    return os.path.join(self.directory, sha[:2], sha + ".SC2Replay")
+
+  def contains(self, sha):
+    """Checks whether the replay with the given SHA-256 is stored."""
+    return os.path.isfile(self.object_path(sha))
+
+  def claim(self, sha):
+    """Claims a replay that's about to be written and added, so that
+    concurrent downloads of the same replay only write it once.
+
+    Returns:
+        bool: False if the replay is already stored or claimed.
+    """
+    with self._lock:
+      if sha in self._claimed or self.contains(sha):
+        return False
+      self._claimed.add(sha)
+      return True
+
+  def add(self, path, sha=None):
+    """Adds a replay to the store, if it isn't there yet.
+
+    Args:
+        path (string): replay file
+        sha (string): SHA-256 of the file, computed if not given.
+
+    Returns:
+        string: SHA-256 of the file
+    """
+    if sha is None:
+      sha = replay_cache.hash_file(path)
+    object_path = self.object_path(sha)
+    if not self.contains(sha):
+      os.makedirs(os.path.dirname(object_path), exist_ok=True)
+      replace_with(path, object_path)
+    return sha
+
+  def materialize(self, sha, dst, replace=False):
+    """Puts the stored replay at dst.
+
+    Args:
+        sha (string): SHA-256 of a stored replay
+        dst (string): where to put it
+        replace (bool): replace dst if it already exists
+
+    Returns:
+        string: 'hardlink', 'reflink' or 'copy'
+
+    Raises:
+        FileExistsError: if dst already exists and replace is False.
+    """
+    object_path = self.object_path(sha)
+    if not replace:
+      return link_or_copy(object_path, dst)
+    return replace_with(object_path, dst)
+
+  def objects(self):
+    """Yields (sha, path) of every stored replay."""
+    if not os.path.isdir(self.directory):
+      return
+    for prefix in sorted(os.listdir(self.directory)):
+      prefix_directory = os.path.join(self.directory, prefix)
+      if not os.path.isdir(prefix_directory):
+        continue
+      for name in sorted(os.listdir(prefix_directory)):
+        if name.endswith(".SC2Replay"):
+          yield name[:-len(".SC2Replay")], os.path.join(prefix_directory, name)
+
+  def verify(self):
+    """Checks that every stored replay still matches its hash.
+
+    Returns:
+        list of string: paths of the stored replays that don't.
+    """
+    return [path for sha, path in self.objects()
+            if replay_cache.hash_file(path) != sha]
+
+  def gc(self):
+    """Deletes stored replays that nothing links to anymore.
+
+    Replays materialized with reflinks or copies don't depend on the store,
+    so only hardlinks keep a stored replay alive.
+
+    Returns:
+        int: number of bytes freed
+    """
+    freed = 0
+    for sha, path in list(self.objects()):
+      stat = os.stat(path)
+      if stat.st_nlink <= 1:
+        freed += stat.st_size
+        os.remove(path)
+    return freed
+
+  def import_directory(self, root, replay_directory=None):
+    """Moves the replays in the team folders into the store, replacing each
+    of them with a link to the stored replay.
+
+    Args:
+        root (string): directory containing the team folders
+        replay_directory (string): directory of the uploaded replays. These
+          are added to the store first, so team folders link to them too.
+
+    Returns:
+        Counter: number of replays per materialization method
+    """
+    methods = Counter()
+    if replay_directory:
+      for replay in replay_parser.list_replays(replay_directory):
+        self.add(os.path.join(replay_directory, replay))
+    for path in replay_parser.find_team_replays(root):
+      sha = self.add(path)
+      if os.path.samefile(path, self.object_path(sha)):
+        methods['already linked'] += 1
+      else:
+        methods[self.materialize(sha, path, replace=True)] += 1
+    return methods
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Manage the content-addressed replay store')
+  parser.add_argument('command', choices=['import', 'verify', 'gc'],
+                      help='import: move the team folders into the store, '
+                           'verify: check stored replays, '
+                           'gc: delete unused stored replays')
+  args = parser.parse_args()
+  store = ReplayStore()
+  if args.command == 'import':
+    import seasons
+    methods = Counter()
+    for season in seasons.all_seasons():
+      if os.path.isdir(season.replay_directory):
+        methods += store.import_directory(season.directory or ".",
+                                          season.replay_directory)
+    for method, count in sorted(methods.items()):
+      print(count, method)
+  elif args.command == 'verify':
+    corrupted = store.verify()
+    for path in corrupted:
+      print("Corrupted: %s" % path)
+    print("%d corrupted replays" % len(corrupted))
+  elif args.command == 'gc':
+    print("Freed %.1f MiB" % (store.gc() / (1 << 20)))
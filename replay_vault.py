@@ -0,0 +1,178 @@
+"""Gets the replay links of a season from the replay vault page, for
+download_replays.py.
+
+The page is only downloaded when it changed: the ETag and Last-Modified of
+the last download are sent back with If-None-Match and If-Modified-Since, and
+the links found then are kept in VAULT_FILE, so an unchanged page costs one
+304 round trip. A changed page is parsed with a SoupStrainer, which only
+builds the game accordions, and the links of every season tab of the
+Starcraft 2 accordion are saved by tab title.
+
+Attributes:
+    VAULT_FILE (str): Default location of the saved links.
+    VAULT_TIMEOUT (float): Seconds to wait for the vault to answer.
+    GAME_TITLE (str): Title of the Starcraft 2 accordion.
+"""
+import json
+import os
+import time
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+
+VAULT_FILE = "data/replay_vault.json"
+VAULT_TIMEOUT = 30
+GAME_TITLE = "Starcraft 2"
+
+
+def parse_vault_page(html):
+  """Gets the links of every season tab of the Starcraft 2 accordion.
+
+  Args:
+      html (string): replay vault page
+
+  Returns:
+      dict: tab title, ex: Spring 2020 => list of link hrefs, in page order.
+        None if the page has no Starcraft 2 accordion.
+  """
+  strainer = SoupStrainer("div", class_="shogun-accordion")
+  soup = BeautifulSoup(html, 'html.parser', parse_only=strainer)
+  for game in soup.find_all("div", class_="shogun-accordion"):
+    game_title = game.find("h4", class_="shogun-accordion-title")
+    if game_title is None or game_title.text.strip() != GAME_TITLE:
+      continue
+    titles = [title.text.strip()
+              for title in game.find_all(class_="shogun-tab-title")]
+    tabs = game.find_all("div", class_="shogun-tab-content")
+    if len(tabs) != len(titles):
+      print("Warning: %d tab titles but %d tab contents in the replay vault, "
+            "using the tab bodies" % (len(titles), len(tabs)))
+      # The first tab body is the body of every tab, then come the bodies of
+      # each tab, as download_replays.py used to read them.
+      tabs = game.find_all("div", class_="shogun-tabs-body")[1:]
+      if len(tabs) != len(titles):
+        # Only the first tab, the current season, is where it always was.
+        print("Warning: %d tab bodies, only reading the %s tab" % (
+            len(tabs), titles[0] if titles else "first"))
+        titles, tabs = titles[:1], tabs[:1]
+    return {title: [link.get('href') for link in tab.find_all('a')
+                    if link.get('href')]
+            for title, tab in zip(titles, tabs)}
+  return None
+
+
+class VaultPage:
+
+  """Replay vault page, downloaded again only when it changed.
+
+  Attributes:
+      url (str): URL of the replay vault.
+      filename (str): JSON file the links and validators are saved to. None
+        keeps them in memory.
+      etag, last_modified (str): Validators of the last download, None if
+        the server didn't send them.
+      seasons (dict): tab title => list of link hrefs, from parse_vault_page
+      fetched (float): When the page was last downloaded or validated.
+  """
+
+  def __init__(self, url, filename=VAULT_FILE):
+    self.url = url
+    self.filename = filename
+    self.etag = None
+    self.last_modified = None
+    self.seasons = None
+    self.fetched = None
+    self.load()
+
+  def load(self):
+    if not self.filename:
+      return
+    try:
+      with open(self.filename, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    except (OSError, ValueError):
+      return
+    if state.get('url') != self.url:
+      return
+    self.etag = state.get('etag')
+    self.last_modified = state.get('last_modified')
+    self.seasons = state.get('seasons')
+    self.fetched = state.get('fetched')
+
+  def save(self):
+    """Writes the links and validators, replacing the file in one step."""
+    if not self.filename:
+      return
+    directory = os.path.dirname(self.filename)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    state = {'url': self.url, 'etag': self.etag,
+             'last_modified': self.last_modified, 'seasons': self.seasons,
+             'fetched': self.fetched}
+    temp_file = self.filename + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+      json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_file, self.filename)
+
+  def refresh(self, session=None):
+    """Downloads the page if it changed since the last download.
+
+    Args:
+        session (requests.Session): session to send the request with.
+
+    Returns:
+        bool: whether the page was downloaded and parsed again
+    """
+    headers = {}
+    if self.seasons is not None:
+      if self.etag:
+        headers['If-None-Match'] = self.etag
+      if self.last_modified:
+        headers['If-Modified-Since'] = self.last_modified
+    with metrics.timer('vault.fetch'):
+      response = (session or requests).get(self.url, headers=headers,
+                                           timeout=VAULT_TIMEOUT)
+    if response.status_code == 304 and self.seasons is not None:
+      metrics.count('vault.not_modified')
+      self.fetched = time.time()
+      self.save()
+      return False
+    response.raise_for_status()
+    response.encoding = 'utf-8'
+    metrics.count('bytes.vault', len(response.content))
+    with metrics.timer('vault.parse'):
+      seasons = parse_vault_page(response.text)
+    if seasons is None:
+      raise ValueError("Starcraft 2 replays could not be found.")
+    self.seasons = seasons
+    self.etag = response.headers.get('ETag')
+    self.last_modified = response.headers.get('Last-Modified')
+    self.fetched = time.time()
+    self.save()
+    return True
+
+  def season_links(self, season_name, session=None):
+    """Gets the replay links of a season, downloading the page if it changed.
+    The saved links are used if the vault can't be reached.
+
+    Args:
+        season_name (string): title of the season's tab, ex: Spring 2020
+        session (requests.Session): session to send the request with.
+
+    Returns:
+        list of string: link hrefs, empty if the season has no tab.
+    """
+    try:
+      self.refresh(session)
+    except requests.RequestException as e:
+      if self.seasons is None:
+        raise
+      print("Error: the replay vault could not be reached (%s), using the "
+            "links saved %s" % (e, time.ctime(self.fetched)))
+    if season_name not in self.seasons:
+      print("Error: no replay vault tab is named %s, found: %s" % (
+          season_name, ", ".join(self.seasons)))
+      return []
+    return self.seasons[season_name]
@@ -0,0 +1,236 @@
+"""Watches the upload folder and runs the pipeline on replays as they land, so
+the team folders and the stats CSV are up to date seconds after an upload.
+Usage: python replay_watcher.py
+To only run some of the stages, or watch by polling instead of inotify,
+  python replay_watcher.py --stages organize,stats --poll
+
+Replays already in the folder are processed once on startup. After that, only
+new replays are decoded: they're added to the stages, which keep their
+aggregates between batches, and the stages are finished again so the renames
+happen and the CSV is rewritten. New files are batched until no new file has
+shown up for --debounce seconds, so a zip being extracted is processed at once.
+
+Attributes:
+    IN_CLOSE_WRITE, IN_MOVED_TO (int): inotify events meaning a file is ready.
+    POLL_INTERVAL (float): Seconds between two scans of the folder when
+      polling.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+import metrics
+import pipeline
+import replay_cache
+import replay_fingerprints
+import replay_journal
+import replay_parser
+import replay_quarantine
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+# struct inotify_event, followed by a name of len bytes
+INOTIFY_EVENT = struct.Struct('iIII')
+POLL_INTERVAL = 1.0
+
+
+class InotifyWatcher:
+
+  """Reports files written or moved into a directory, with Linux inotify."""
+
+  def __init__(self, directory):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = libc.inotify_init1(IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    if libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                              IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+      os.close(self.fd)
+      raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+  def wait(self, timeout=None):
+    """Waits for files to be ready.
+
+    Args:
+        timeout (float): seconds to wait. Waits until there are files if None.
+
+    Returns:
+        list of string: names of the files, empty if the timeout expired.
+    """
+    ready, _, _ = select.select([self.fd], [], [], timeout)
+    if not ready:
+      return []
+    data = os.read(self.fd, 64 * 1024)
+    names = []
+    offset = 0
+    while offset < len(data):
+      wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+      offset += INOTIFY_EVENT.size
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      if name:
+        names.append(os.fsdecode(name))
+    return names
+
+  def close(self):
+    os.close(self.fd)
+
+
+class PollingWatcher:
+
+  """Reports files added to or changed in a directory, by scanning it."""
+
+  def __init__(self, directory, interval=POLL_INTERVAL):
+    self.directory = directory
+    self.interval = interval
+    self.snapshot = self._scan()
+
+  def _scan(self):
+    with os.scandir(self.directory) as entries:
+      return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+              for entry in entries if entry.is_file()}
+
+  def wait(self, timeout=None):
+    """Waits for files to be added or changed, see InotifyWatcher.wait. A
+    file still being written keeps being reported until it stops changing."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      delay = self.interval
+      if deadline is not None:
+        delay = min(delay, deadline - time.monotonic())
+      if delay > 0:
+        time.sleep(delay)
+      snapshot = self._scan()
+      names = [name for name, stat in snapshot.items()
+               if self.snapshot.get(name) != stat]
+      self.snapshot = snapshot
+      if names or (deadline is not None and time.monotonic() >= deadline):
+        return names
+
+  def close(self):
+    pass
+
+
+def make_watcher(directory, poll=False):
+  """Watches with inotify where it's available, and by polling otherwise."""
+  if not poll and sys.platform.startswith('linux'):
+    try:
+      return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+      print("Can't use inotify (%s), polling instead" % e)
+  return PollingWatcher(directory)
+
+
+def finish_stages(stages):
+  """Finishes every stage, keeping going if one fails.
+
+  Returns:
+      dict: original path => new path of the replays the organizer renamed
+  """
+  renamed_files = {}
+  for name, stage in stages:
+    try:
+      with metrics.timer(name + '.finish'):
+        result = stage.finish()
+      if name == 'organize':
+        renamed_files = result
+    except:
+      metrics.record_failure(name + '.finish', sys.exc_info()[1])
+      print("Error finishing %s stage" % name)
+      traceback.print_exc()
+  return renamed_files
+
+
+def watch(directory, stage_names, cache=None, jobs=1, debounce=2.0, poll=False):
+  """Runs the stages on the replays in a directory, then on new replays as
+  they show up, until interrupted.
+
+  Args:
+      directory (string): replay directory
+      stage_names (list of string): stages to run, see pipeline.STAGES
+      cache (ReplayCache): cache of decoded replays. Uses the default
+        on-disk cache if not given.
+      jobs (int): number of processes used to decode replays
+      debounce (float): seconds without new files before a batch is processed
+      poll (bool): whether to scan the directory instead of using inotify
+  """
+  if cache is None:
+    cache = replay_cache.ReplayCache(
+        quarantine=replay_quarantine.Quarantine())
+  journal = replay_journal.ReplayJournal()
+  stages = pipeline.make_stages(stage_names, directory, cache, journal)
+  if not stages:
+    return
+  # Games fed to the stages so far, since they keep them between batches.
+  fingerprints = replay_fingerprints.FingerprintIndex()
+
+  # Watch before the first scan so no upload falls in between.
+  watcher = make_watcher(directory, poll)
+  replays = replay_parser.list_replays(directory)
+  print("Found %d replays to scan" % len(replays))
+  pipeline.feed_stages(stages, directory, replays, cache, journal, jobs,
+                       fingerprints=fingerprints)
+  finish_stages(stages)
+  cache.save()
+  seen = set(replay_parser.list_replays(directory))
+
+  print("Watching %s for new replays" % directory)
+  try:
+    while True:
+      names = set(watcher.wait())
+      while True:
+        more = watcher.wait(debounce)
+        if not more:
+          break
+        names.update(more)
+
+      replays = sorted(name for name in names
+                       if replay_parser.REPLAY_FILE.search(name)
+                       and name not in seen
+                       and os.path.isfile(os.path.join(directory, name)))
+      if not replays:
+        continue
+      start = time.perf_counter()
+      print("Found %d new replays" % len(replays))
+      pipeline.feed_stages(stages, directory, replays, cache, journal, jobs,
+                           fingerprints=fingerprints)
+      renamed_files = finish_stages(stages)
+      cache.save()
+      seen.update(replays)
+      seen.update(os.path.basename(path) for path in renamed_files.values())
+      print("Processed %d new replays in %.2f s" % (
+          len(replays), time.perf_counter() - start))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    watcher.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Organize and compile stats on replays as they are uploaded')
+  parser.add_argument('--stages', dest='stages',
+                      default=','.join(pipeline.DEFAULT_STAGES),
+                      help='Comma separated stages to run, out of: organize,matchups,stats')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  parser.add_argument('--debounce', type=float, dest='debounce', default=2.0,
+                      help='Seconds without new replays before they are processed')
+  parser.add_argument('--poll', action='store_true', dest='poll',
+                      help='Scan the folder instead of using inotify')
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+  stage_names = [name.strip() for name in args.stages.split(',') if name.strip()]
+  unknown_stages = set(stage_names) - set(pipeline.STAGES) | (
+      set(stage_names) & {'download'})
+  if unknown_stages:
+    parser.error('Unknown stages: ' + ', '.join(sorted(unknown_stages)))
+  metrics.run(args, watch, pipeline.REPLAY_DIRECTORY, stage_names,
+              jobs=args.jobs, debounce=args.debounce, poll=args.poll)
@@ -0,0 +1,451 @@
+"""Registry of the CEA seasons, so every season keeps its own uploads, team
+folders, caches and stats, and players can be followed from one season to the
+next.
+Usage: python seasons.py list
+  Lists the seasons, and whether their uploads changed since they were last
+  processed.
+Usage: python seasons.py process
+  Runs the pipeline on every season whose uploads or teams file changed since
+  it was last processed, several seasons at a time with --parallel N, then
+  writes the career stats. Seasons to process can be named, ex:
+    python seasons.py process Fall2019 --force
+Usage: python seasons.py history [PLAYER ...]
+  Prints the career of the given players, or writes the career stats of every
+  player to CAREER_CSV.
+
+Seasons are listed in SEASONS in consts.py. Each season has a folder with its
+UploadHere folder, team folders, teams file (cea_names.csv) and stats CSV,
+and a data folder with its replay cache, journal, game index and team
+inference. Replays are stored once for every season, in the replay store (see
+replay_store.py).
+
+Careers are read from the game index of each season, which the organizer
+fills in. Players are matched across seasons by their main name in each
+season's teams file.
+
+Attributes:
+    CAREER_CSV (str): Default location of the career stats.
+    STATE_FILE (str): Name of the file, in a season's data folder, recording
+      what its uploads looked like when it was last processed.
+    LOG_FILE (str): Name of the file, in a season's data folder, its output
+      goes to when seasons are processed in parallel.
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import json
+import os
+import time
+import traceback
+
+import cea_team_name_parser
+import consts
+import metrics
+
+CAREER_CSV = "cea_career_stats.csv"
+STATE_FILE = "season_state.json"
+LOG_FILE = "pipeline.log"
+
+
+class Season:
+
+  """Where a season's files are.
+
+  Attributes:
+      key (str): Name of the season in SEASONS, ex: Spring2020.
+      vault_name (str): Name of the season in the replay vault.
+      starting_date (str): Starting date, YYYYMMDD format. None if not
+        recorded, the season can't be processed then.
+      directory (str): Folder of the uploads, team folders, teams file and
+        stats CSV. Empty for the top level folder.
+      data_directory (str): Folder of the caches and indexes.
+  """
+
+  def __init__(self, key, vault_name, starting_date, directory, data_directory):
+    self.key = key
+    self.vault_name = vault_name
+    self.starting_date = starting_date
+    self.directory = directory
+    self.data_directory = data_directory
+
+  @property
+  def replay_directory(self):
+    return os.path.join(self.directory, "UploadHere/")
+
+  @property
+  def teams_file(self):
+    return os.path.join(self.directory, consts.TEAMS_FILE)
+
+  @property
+  def stats_file(self):
+    return os.path.join(self.directory, "cea_season_stats.csv")
+
+  def data_file(self, default):
+    """Gets the season's copy of a data file.
+
+    Args:
+        default (str): default location of the file, ex:
+          replay_cache.CACHE_FILE
+
+    Returns:
+        str: the file of the same name in the season's data folder
+    """
+    return os.path.join(self.data_directory, os.path.basename(default))
+
+  def upload_signature(self):
+    """Hashes the names, sizes and modification times of the uploads and the
+    teams file, which change when replays are added or the teams file is
+    edited."""
+    files = []
+    if os.path.isdir(self.replay_directory):
+      with os.scandir(self.replay_directory) as entries:
+        files = [(entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                 for entry in entries if entry.is_file()]
+    if os.path.isfile(self.teams_file):
+      stat = os.stat(self.teams_file)
+      files.append((self.teams_file, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha256(json.dumps(sorted(files)).encode()).hexdigest()
+
+  def load_state(self):
+    """Gets what was recorded when the season was last processed, None if it
+    never was."""
+    try:
+      with open(self.data_file(STATE_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def save_state(self, state):
+    os.makedirs(self.data_directory, exist_ok=True)
+    temp_file = self.data_file(STATE_FILE) + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+      json.dump(state, f, indent=2)
+    os.replace(temp_file, self.data_file(STATE_FILE))
+
+  def __repr__(self):
+    return "Season(%r)" % self.key
+
+
+def get(key):
+  """Gets a season by its name in SEASONS.
+
+  Raises:
+      KeyError: if there's no such season.
+  """
+  return Season(key, **consts.SEASONS[key])
+
+
+def all_seasons():
+  """Gets every season, in the order of SEASONS."""
+  return [get(key) for key in consts.SEASONS]
+
+
+def current():
+  """Gets the current season, CURRENT_SEASON in consts.py."""
+  return get(consts.CURRENT_SEASON)
+
+
+def check_season(season):
+  """Gets why a season can't be processed, None if it can."""
+  if season.starting_date is None:
+    return "its starting date isn't in consts.SEASONS"
+  if not os.path.isdir(season.replay_directory):
+    return "there's no %s folder" % season.replay_directory
+  if not os.path.isfile(season.teams_file):
+    return "there's no %s" % season.teams_file
+  return None
+
+
+def run_options(stage_names, tracker_cutoff):
+  """What a run computes, recorded with the upload signature so a season is
+  processed again when it's run with other stages."""
+  return {'stages': sorted(stage_names), 'tracker_cutoff': tracker_cutoff}
+
+
+def is_up_to_date(season, options):
+  """Whether the season was processed with these options since its uploads
+  last changed."""
+  state = season.load_state()
+  return (state is not None and state.get('options') == options
+          and state.get('signature') == season.upload_signature())
+
+
+def process_season(key, stage_names, jobs=1, tracker=False,
+                   tracker_cutoff=None, log_file=None):
+  """Runs the pipeline on a season, and records its upload signature.
+
+  Args:
+      key (str): name of the season
+      stage_names (list of string): stages to run, see pipeline.STAGES
+      jobs (int): number of processes used to decode replays
+      tracker (bool): whether to add the tracker event stats to the CSV
+      tracker_cutoff (float): see replay_analytics.make_analytics_cache
+      log_file (str): file the output goes to, printed if None
+
+  Returns:
+      tuple: (season name, seconds taken, traceback if it failed, else None,
+        exception type name if it failed, else None)
+  """
+  # pipeline imports this module.
+  import pipeline
+  import replay_analytics
+
+  season = get(key)
+  start = time.perf_counter()
+  with contextlib.ExitStack() as stack:
+    if log_file:
+      os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+      log = stack.enter_context(open(log_file, 'w', encoding='utf-8'))
+      stack.enter_context(contextlib.redirect_stdout(log))
+      stack.enter_context(contextlib.redirect_stderr(log))
+    try:
+      analytics = None
+      if tracker and 'stats' in stage_names:
+        analytics = replay_analytics.make_analytics_cache(
+            tracker_cutoff,
+            season.data_file(replay_analytics.ANALYTICS_CACHE_FILE))
+      pipeline.run_pipeline(season.replay_directory, stage_names, jobs=jobs,
+                            analytics=analytics, season=season)
+    except Exception as e:
+      error = traceback.format_exc()
+      if log_file:
+        print(error, end='')
+      return key, time.perf_counter() - start, error, type(e).__name__
+  # Recorded after the run, since the organizer renames the uploads.
+  season.save_state({
+      'signature': season.upload_signature(),
+      'options': run_options(stage_names,
+                             tracker_cutoff if tracker else None),
+      'processed': time.strftime('%Y-%m-%d %H:%M:%S')})
+  return key, time.perf_counter() - start, None, None
+
+
+def process_seasons(keys, stage_names, jobs=1, parallel=1, force=False,
+                    tracker=False, tracker_cutoff=None):
+  """Runs the pipeline on the seasons that changed since they were last
+  processed, `parallel` seasons at a time.
+
+  Args:
+      keys (list of str): seasons to consider, every season if empty
+      force (bool): whether to process the seasons even if they didn't change
+      See process_season for the others.
+
+  Returns:
+      list of str: seasons that were processed
+  """
+  options = run_options(stage_names, tracker_cutoff if tracker else None)
+  to_process = []
+  for season in [get(key) for key in keys] if keys else all_seasons():
+    problem = check_season(season)
+    if problem:
+      print("Skipping %s: %s" % (season.key, problem))
+    elif not force and is_up_to_date(season, options):
+      print("%s is up to date" % season.key)
+    else:
+      to_process.append(season.key)
+  if not to_process:
+    return []
+
+  if parallel <= 1 or len(to_process) == 1:
+    results = [process_season(key, stage_names, jobs, tracker, tracker_cutoff)
+               for key in to_process]
+  else:
+    # Each season's output goes to a log in its data folder, since they'd be
+    # interleaved otherwise.
+    from concurrent.futures import ProcessPoolExecutor
+    print("Processing %s, %d at a time" % (', '.join(to_process), parallel))
+    with ProcessPoolExecutor(max_workers=min(parallel, len(to_process))) as executor:
+      futures = [executor.submit(process_season, key, stage_names, jobs,
+                                 tracker, tracker_cutoff,
+                                 get(key).data_file(LOG_FILE))
+                 for key in to_process]
+      results = [future.result() for future in futures]
+
+  processed = []
+  for key, seconds, error, exception in results:
+    if error:
+      metrics.record_failure('season', exception)
+      print("Error processing season %s" % key)
+      print(error, end='')
+    else:
+      processed.append(key)
+      print("Processed %s in %.2f s" % (key, seconds))
+    metrics.observe('season.' + key, seconds)
+  return processed
+
+
+def career_histories(season_list=None):
+  """Gets the career of every player, from the game index of each season.
+
+  Args:
+      season_list (list of Season): seasons to read, every season if None
+
+  Returns:
+      list of dict: one per player, with keys
+          name (str): main name in the latest season played
+          seasons (dict): season name => [games, wins, highest MMR]
+          trajectory (list of tuple): (season name, week, highest MMR) of
+            every week with a known MMR, in the order they were played
+      sorted by name.
+  """
+  import cea_team_name_parser
+  import game_index
+
+  players = {}
+  for season in season_list if season_list is not None else all_seasons():
+    index_file = season.data_file(game_index.GAME_INDEX_FILE)
+    if not os.path.isfile(index_file):
+      continue
+    alias_index = None
+    if os.path.isfile(season.teams_file):
+      teams, aliases = cea_team_name_parser.init_dictionary(season.teams_file)
+      alias_index = cea_team_name_parser.AliasIndex(aliases)
+    index = game_index.GameIndex(index_file)
+    weeks = sorted(index.player_weeks(),
+                   key=lambda row: game_index.week_sort_key(row[1]))
+    index.close()
+    for player, week, games, wins, mmr in weeks:
+      name = (alias_index and alias_index.resolve(player)) or player
+      history = players.setdefault(
+          cea_team_name_parser.normalize_name(name),
+          {'name': name, 'seasons': {}, 'trajectory': []})
+      history['name'] = name
+      totals = history['seasons'].setdefault(season.key, [0, 0, 0])
+      totals[0] += games
+      totals[1] += wins
+      totals[2] = max(totals[2], mmr or 0)
+      if mmr:
+        history['trajectory'].append((season.key, week, mmr))
+  return sorted(players.values(), key=lambda history: history['name'].lower())
+
+
+def career_totals(history):
+  """Gets the games, wins and highest MMR of a player over every season."""
+  games = sum(totals[0] for totals in history['seasons'].values())
+  wins = sum(totals[1] for totals in history['seasons'].values())
+  mmr = max(totals[2] for totals in history['seasons'].values())
+  return games, wins, mmr
+
+
+def make_career_csv(histories, season_keys, filename=CAREER_CSV):
+  """Writes the career stats CSV: record, win rate and highest MMR over every
+  season and in each season, and the MMR of every week played.
+
+  Args:
+      histories (list of dict): from career_histories
+      season_keys (list of str): seasons to have columns for, in order
+      filename (str): CSV file to write
+  """
+  headers = ["Name", "Seasons", "Wins", "Losses", "Win Rate", "Peak MMR"]
+  for key in season_keys:
+    headers += [key + " Record", key + " MMR"]
+  headers.append("MMR Trajectory")
+  with open(filename, "w", newline='') as f:
+    writer = csv.writer(f, delimiter=',')
+    writer.writerow(headers)
+    for history in histories:
+      games, wins, mmr = career_totals(history)
+      row = [history['name'], len(history['seasons']), wins, games - wins,
+             "%.1f%%" % (100 * wins / games), mmr]
+      for key in season_keys:
+        if key in history['seasons']:
+          season_games, season_wins, season_mmr = history['seasons'][key]
+          row += ["%d-%d" % (season_wins, season_games - season_wins),
+                  season_mmr]
+        else:
+          row += ["", ""]
+      row.append(" ; ".join("%s %s %d" % point
+                            for point in history['trajectory']))
+      writer.writerow(row)
+  print("Saved the career stats of %d players to %s" % (len(histories), filename))
+
+
+def print_history(history):
+  games, wins, mmr = career_totals(history)
+  print("%s: %d-%d (%.1f%%) over %d seasons, peak MMR %d" % (
+      history['name'], wins, games - wins, 100 * wins / games,
+      len(history['seasons']), mmr))
+  for key, (season_games, season_wins, season_mmr) in history['seasons'].items():
+    print("\t%-12s %3d-%-3d peak MMR %d" % (
+        key, season_wins, season_games - season_wins, season_mmr))
+  for key, week, week_mmr in history['trajectory']:
+    print("\t\t%s %-9s %d" % (key, week, week_mmr))
+
+
+def write_careers():
+  """Writes CAREER_CSV from every season's game index."""
+  with metrics.timer('seasons.history'):
+    make_career_csv(career_histories(),
+                    [season.key for season in all_seasons()])
+
+
+def print_seasons():
+  for season in all_seasons():
+    problem = check_season(season)
+    state = season.load_state()
+    if problem:
+      status = "can't be processed, " + problem
+    elif state is None:
+      status = "never processed"
+    elif state['signature'] != season.upload_signature():
+      status = "changed since it was processed on %s" % state['processed']
+    else:
+      status = "processed on %s" % state['processed']
+    print("%-12s %-14s %s" % (season.key, season.vault_name, status))
+    print("\t%s, %s" % (season.replay_directory, season.data_directory))
+
+
+def main(args):
+  if args.command == 'list':
+    print_seasons()
+  elif args.command == 'history':
+    if not args.names:
+      write_careers()
+      return
+    wanted = {cea_team_name_parser.normalize_name(name) for name in args.names}
+    histories = [history for history in career_histories()
+                 if cea_team_name_parser.normalize_name(history['name']) in wanted]
+    if not histories:
+      print("None of these players is in a game index.")
+    for history in histories:
+      print_history(history)
+  else:
+    unknown = set(args.names) - set(consts.SEASONS)
+    if unknown:
+      print("Unknown seasons: %s. Seasons are: %s" % (
+          ', '.join(sorted(unknown)), ', '.join(consts.SEASONS)))
+      return
+    if process_seasons(args.names, args.stage_names, args.jobs, args.parallel,
+                       args.force, args.tracker, args.tracker_cutoff):
+      write_careers()
+
+
+if __name__ == "__main__":
+  import pipeline
+  import stats_compiler
+  parser = argparse.ArgumentParser(description='Process and compare seasons')
+  parser.add_argument('command', choices=['list', 'process', 'history'],
+                      help='list: seasons and whether they changed, '
+                           'process: run the pipeline on the seasons that changed, '
+                           'history: career stats of players across seasons')
+  parser.add_argument('names', nargs='*',
+                      help='Seasons to process, or players to show the career of')
+  parser.add_argument('--stages', dest='stages',
+                      default=','.join(pipeline.DEFAULT_STAGES),
+                      help='Comma separated stages to run, out of: organize,matchups,stats')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  parser.add_argument('--parallel', type=int, dest='parallel', default=1,
+                      help='Number of seasons processed at a time')
+  parser.add_argument('--force', action='store_true', dest='force',
+                      help='Process the seasons even if they did not change')
+  stats_compiler.add_tracker_arguments(parser)
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
+  args.stage_names = [name.strip() for name in args.stages.split(',') if name.strip()]
+  unknown_stages = set(args.stage_names) - set(pipeline.STAGES) | (
+      set(args.stage_names) & {'download'})
+  if unknown_stages:
+    parser.error('Unknown stages: ' + ', '.join(sorted(unknown_stages)))
+  metrics.run(args, main, args)
@@ -2,60 +2,107 @@
 
 Attributes:
     REPLAY_DIRECTORY (str): Directory where replays are stored.
+    TRACKER_COLUMNS (dict): replay_analytics summary statistic => CSV column
+      of its average, written with --tracker.
+    RATING_COLUMNS (list of str): CSV columns of the league ratings, see
+      ratings.py.
 """
-import mpyq
-import string
+import argparse
 import os
-import re
+import sys
 import traceback
-import json
 import csv
 import cea_team_name_parser
+import metrics
+import ratings
+import replay_analytics
+import replay_cache
+import replay_fingerprints
+import replay_parser
+import replay_quarantine
 from consts import TEAMS_FILE
-from s2protocol import versions
+from team_inference import UNKNOWN_TEAM
 from collections import Counter
 
 REPLAY_DIRECTORY = "UploadHere/"
+TRACKER_COLUMNS = {
+    'workers_6min': "Avg Workers at 6:00", 'income_6min': "Avg Income at 6:00",
+    'peak_supply': "Avg Peak Supply", 'peak_army_value': "Avg Peak Army Value",
+    'resources_lost': "Avg Resources Lost"}
+RATING_COLUMNS = ["Rating", "Rating Deviation", "Rating Change", "Team Rating",
+                  "Team Rating Change"]
 
 
 class PlayerObject:
 
-  """Contains player statistics.
+  """Contains player statistics. The statistics are kept up to date as games
+  are added, so reading them doesn't go through every game again.
 
   Attributes:
-      games (GameObject): Struct to store information that we want from a game
+      games (list of GameObject): Games played, one struct per game.
       losses (int): Number of losses.
       mmr (int): Maximum mmr of the player. Reports 0 when player is unranked
                  or something went wrong.
       name (str): Name of the player.
+      opponents_beaten (list of str): Names of the opponents beaten.
+      opponents_lost_to (list of str): Names of the opponents lost to.
+      race_counts (Counter): Race => number of games played as that race.
+      tracker_sums (dict): Summary statistic from replay_analytics =>
+                           [sum, number of games it was known for].
       wins (int): Number of wins.
   """
 
-  def __init__(self, name, wins, games):
+  __slots__ = ('name', 'wins', 'games', 'mmr', 'apm_sum', 'race_counts',
+               'opponents_beaten', 'opponents_lost_to', 'tracker_sums')
+
+  def __init__(self, name, games=()):
     self.name = name
-    self.wins = wins
-    self.games = games
+    self.wins = 0
+    self.games = []
+    self.mmr = None
+    self.apm_sum = 0
+    self.race_counts = Counter()
+    self.opponents_beaten = []
+    self.opponents_lost_to = []
+    self.tracker_sums = {}
+    for game in games:
+      self.add_game(game)
+
+  def add_game(self, game):
+    """Adds a game and updates the statistics with it.
+
+    Args:
+        game (GameObject): game played by this player
+    """
+    self.games.append(game)
+    self.mmr = game.mmr if self.mmr is None else max(self.mmr, game.mmr)
+    self.apm_sum += game.apm
+    self.race_counts[game.race] += 1
+    if game.win:
+      self.wins += 1
+      self.opponents_beaten.append(game.opponent)
+    else:
+      self.opponents_lost_to.append(game.opponent)
+    for key, value in (game.tracker or {}).items():
+      if value is not None:
+        sums = self.tracker_sums.setdefault(key, [0, 0])
+        sums[0] += value
+        sums[1] += 1
 
   losses = property(fget=lambda self: len(self.games) - self.wins)
-  mmr = property(fget=lambda self: max(game.mmr for game in self.games))
 
   @property
   def race(self):
-    race_counter = Counter([game.race for game in self.games])
-    return race_counter.most_common(1)[0][0]
-
-  @property
-  def opponents_beaten(self):
-    return [game.opponent for game in self.games if game.win]
-
-  @property
-  def opponents_lost_to(self):
-    return [game.opponent for game in self.games if not game.win]
+    return self.race_counts.most_common(1)[0][0]
 
   @property
   def apm(self):
-    apms = [game.apm for game in self.games]
-    return sum(apms) / len(apms)
+    return self.apm_sum / len(self.games)
+
+  def tracker_average(self, key):
+    """Average of a replay_analytics summary statistic, None if unknown."""
+    total, count = self.tracker_sums.get(key, (0, 0))
+    return total / count if count else None
 
 
 class GameObject:
@@ -66,83 +113,34 @@ class GameObject:
       duration (int): Length of the game in seconds
       opponent (str): Name of the opponent
       race (str): Selected race
+      tracker (dict): Summary statistics of the player from replay_analytics,
+                      None if the replay wasn't analyzed.
   """
 
-  def __init__(self, opponent, race, win, mmr, apm, duration):
+  __slots__ = ('opponent', 'race', 'win', 'mmr', 'apm', 'duration', 'tracker')
+
+  def __init__(self, opponent, race, win, mmr, apm, duration, tracker=None):
     self.opponent = opponent
     self.race = race
     self.win = win
     self.mmr = mmr
     self.apm = apm
     self.duration = duration
+    self.tracker = tracker
 
 
-def erase_punctuation(player_name):
-  """Player names can come in the form of
-    b'&lt;AMZN&gt;<sp/>Feniks'
-    so we remove all punctuation and everything
-    to the left of it, to remove b' and the tag   
-  Args:
-      player_name (String): full name of player
+def race_winrate(directory, cache=None, jobs=1):
+  """Counts the wins of each race against the others, over every replay in a
+  directory, from the matchup matrices (see matchup_matrices.py).
 
   Returns:
-      string: name of player, without tag or punctuation
+      dict: matchup, ex: PvZ => [wins of the first race, games]
   """
-  player_name = player_name.decode('UTF-8')
-  return player_name.split('>', 1)[-1]
-
-
-def race_winrate(directory):
-  # Using mypq, load the replay file
-  matcher = re.compile(r'\.SC2Replay$', re.IGNORECASE)
-  replays = [file for file in os.listdir(directory) if matcher.search(file)]
-  print("Found %d replays to scan" % len(replays))
-
-  # KEY: Name. VALUE: PlayerObject
-  race_dictionary = {
-      "Protoss": "P", "Zerg": "Z", "Terran": "T",
-      "异虫": "Z", "星灵": "P", "人类": "T"}
-  matchup_dictionary = {"PvZ": 0, "PvT": 0, "ZvT": 0}
-  for replay in replays:
-    try:
-      # necessary stuff from s2protocol
-      archive = mpyq.MPQArchive(os.path.join(directory, replay))
-      contents = archive.header['user_data_header']['content']
-      header = versions.latest().decode_replay_header(contents)
-      base_build = header['m_version']['m_baseBuild']
-      protocol = versions.build(base_build)
-
-      # get the general info about the replay
-      contents = archive.read_file('replay.details')
-      result = protocol.decode_replay_details(contents)
-
-      player_list = result['m_playerList']
-      # player result is 1 if won, 2 if not.
-      player_result = [player_list[0]['m_result'] == 1,
-                       player_list[1]['m_result'] == 1]
-
-      # ex: [P, Z]
-      player_races = [player_list[0]['m_race'].decode('UTF-8'),
-                      player_list[1]['m_race'].decode('UTF-8')]
-      player_races = [race_dictionary[race] for race in player_races]
-    except:
-      print("error")
-
-
-def get_metadata_key(metadata_json, value, i):
-  """Get the value for a specific key from the player metadata.
-  The metadata contains values for each player, 0 for player 1,
-  1 for player 2.
-
-  Args:
-      metadata_json (JSON): Replay metadata file
-      value (str): Value to retrieve from. Ex: 'MMR', 'APM'
-      i (int): Which player to retrieve metadata for.
-
-  Returns:
-      string: Value stored in file.
-  """
-  return metadata_json['Players'][i][value] if value in metadata_json['Players'][i] else 0
+  import matchup_matrices
+  matrices = matchup_matrices.build_matrices(directory, cache=cache, jobs=jobs)
+  matchup_dictionary = matchup_matrices.race_matchups(matrices)
+  matchup_matrices.print_race_matchups(matrices)
+  return matchup_dictionary
 
 
 def get_mmr(nickname_dict, mmr_exceptions, opponent):
@@ -153,83 +151,190 @@ def get_mmr(nickname_dict, mmr_exceptions, opponent):
     return opponent.mmr
 
 
-def compile_stats(directory, nicknames_dict):
-  # Using mypq, load the replay file
-  matcher = re.compile(r'\.SC2Replay$', re.IGNORECASE)
-  replays = [file for file in os.listdir(directory) if matcher.search(file)]
-  print("Found %d replays to scan" % len(replays))
+class StatsStage:
+
+  """Aggregates player statistics from replay records. Records with a
+  'tracker' key, the replay_analytics analysis of the replay, also add
+  economy and army statistics to the CSV.
 
-  # KEY: Name. VALUE: PlayerObject
-  player_dictionary = {}
+  Attributes:
+      player_dictionary (dict): KEY: Name. VALUE: PlayerObject
+      mmr_exceptions (dict): Manual MMR overrides. Insert new entries if you
+        want to manually override a player's MMR. ex: { "You" : 6700 }
+      csv_file (str): CSV file written by finish().
+      teams_file (str): Teams file the CSV's team names are read from.
+      ratings (RatingEngine): league ratings the games are rated with, and
+        written to the CSV, if given.
+      new_games (list of dict): games added since they were last rated, see
+        ratings.py.
+  """
 
   race_dictionary = {
       "Protoss": "P", "Zerg": "Zerg", "Terran": "T", "Rand": "Random",
       "Prot": "Protoss", "Terr": "Terran",
       "异虫": "Z", "星灵": "P", "人类": "T"}
 
-  # Manual MMR overrides. Insert new entries if you want to manually override a player's MMR.
-  # ex: { "You" : 6700 }
-  mmr_exceptions = {}
-  for replay in replays:
-    try:
-      # necessary stuff from s2protocol
-      archive = mpyq.MPQArchive(os.path.join(directory, replay))
-      contents = archive.header['user_data_header']['content']
-      header = versions.latest().decode_replay_header(contents)
-      base_build = header['m_version']['m_baseBuild']
-      if base_build == 76811:
-        protocol = versions.build(76114)
-      else:
-        protocol = versions.build(base_build)
-
-      # get the general info about the replay
-      contents = archive.read_file('replay.details')
-      result = protocol.decode_replay_details(contents)
-      player_list = result['m_playerList']
-
-      # get the metadata info about the replay
-      metadata_contents = archive.read_file('replay.gamemetadata.json')
-      metadata_json = json.loads(metadata_contents.decode('utf-8'))
-
-      # Get MMR, APM for each player
-      player_mmr = [get_metadata_key(
-          metadata_json, 'MMR', 0), get_metadata_key(metadata_json, 'MMR', 1)]
-      player_apm = [get_metadata_key(
-          metadata_json, 'APM', 0), get_metadata_key(metadata_json, 'APM', 1)]
-
-      # ex: ["P". "Z"]
-      player_races = [get_metadata_key(metadata_json, 'SelectedRace', 0), get_metadata_key(
-          metadata_json, 'SelectedRace', 1)]
-      player_races = [race_dictionary[race] for race in player_races]
-
-      # string array with 2 player names, i.e [Feniks, DarthNoob]
-      player_names = [erase_punctuation(player_list[0]['m_name']),
-                      erase_punctuation(player_list[1]['m_name'])]
-
-      # player result is 1 if won, 2 if not.
-      player_result = [player_list[0]['m_result'] == 1,
-                       player_list[1]['m_result'] == 1]
-
-      # record whether this player won
-      for i in [0, 1]:
-        player_name = player_names[i]
-        game_object = GameObject(opponent=player_names[1 - i], race=player_races[i], win=player_result[i],
-                                 mmr=player_mmr[i], apm=player_apm[i], duration=metadata_json['Duration'])
-        if player_name in mmr_exceptions:
-          game_object.mmr = max(game_object.mmr, mmr_exceptions[player_name])
-        if player_name.lower() in nicknames_dict:
-          player_name = nicknames_dict[player_name.lower()]
-        if player_name in player_dictionary:
-          player_dictionary[player_name].games.append(game_object)
-          player_dictionary[player_name].wins += player_result[i]
-        else:
-          player_dictionary[player_name] = PlayerObject(
-              player_name, player_result[i], [game_object])
-    except:
+  def __init__(self, nicknames_dict, alias_index=None,
+               csv_file="cea_season_stats.csv", teams_file=TEAMS_FILE,
+               ratings=None):
+    self.nicknames_dict = nicknames_dict
+    self.alias_index = alias_index or cea_team_name_parser.AliasIndex(
+        nicknames_dict)
+    self.player_dictionary = {}
+    self.mmr_exceptions = {}
+    self.csv_file = csv_file
+    self.teams_file = teams_file
+    self.ratings = ratings
+    self.new_games = []
+
+  def add(self, replay, record):
+    # get the general info and metadata about the replay
+    player_list = record['players']
+    if record['duration'] is None:
+      raise ValueError("Replay has no replay.gamemetadata.json")
+
+    # Get MMR, APM for each player
+    player_mmr = [player_list[0]['mmr'], player_list[1]['mmr']]
+    player_apm = [player_list[0]['apm'], player_list[1]['apm']]
+
+    # ex: ["P". "Z"]
+    player_races = [player_list[0]['selected_race'],
+                    player_list[1]['selected_race']]
+    player_races = [self.race_dictionary[race] for race in player_races]
+
+    # string array with 2 player names, i.e [Feniks, DarthNoob]
+    player_names = [player_list[0]['name'], player_list[1]['name']]
+
+    # player result is 1 if won, 2 if not.
+    player_result = [player_list[0]['result'] == 1,
+                     player_list[1]['result'] == 1]
+
+    # economy and army statistics, if the replay was analyzed
+    player_tracker = [None, None]
+    if record.get('tracker'):
+      player_tracker = [
+          {key: player[key] for key in replay_analytics.SUMMARY_KEYS}
+          for player in record['tracker']['players'][:2]]
+
+    # record whether this player won
+    main_names = []
+    for i in [0, 1]:
+      player_name = player_names[i]
+      opponent_name = player_names[1 - i]
+      main_name = self.alias_index.resolve(opponent_name)
+      if main_name is not None:
+        opponent_name = main_name
+      game_object = GameObject(opponent=opponent_name, race=player_races[i], win=player_result[i],
+                               mmr=player_mmr[i], apm=player_apm[i], duration=record['duration'],
+                               tracker=player_tracker[i])
+      if player_name in self.mmr_exceptions:
+        game_object.mmr = max(game_object.mmr, self.mmr_exceptions[player_name])
+      main_name = self.alias_index.resolve(player_name)
+      if main_name is not None:
+        player_name = main_name
+      if player_name not in self.player_dictionary:
+        self.player_dictionary[player_name] = PlayerObject(player_name)
+      self.player_dictionary[player_name].add_game(game_object)
+      main_names.append(player_name)
+
+    # Games without exactly one winner can't be rated.
+    if self.ratings is not None and player_result.count(True) == 1:
+      self.new_games.append({
+          'time_utc': record['time_utc'], 'fingerprint': record['fingerprint'],
+          'players': main_names, 'winner': player_result.index(True)})
+
+  def update_ratings(self, teams_dict):
+    """Rates the games added since the last call, and saves the ratings.
+
+    Args:
+        teams_dict (dict): player alias => team name, from
+          cea_team_name_parser.init_dictionary
+    """
+    if self.ratings is None:
+      return
+    for game in self.new_games:
+      game['teams'] = [teams_dict.get(name.lower()) for name in game['players']]
+    with metrics.timer('stats.ratings'):
+      rated, changed, removed = self.ratings.add_games(self.new_games)
+    self.new_games = []
+    self.ratings.save()
+    print("Rated %d new games" % rated)
+    if changed:
+      print("Rated every game again, the players or teams of %d games "
+            "changed" % changed)
+    if removed:
+      print("Rated every game again, %d games are gone" % removed)
+
+  def finish(self):
+    teams_dict, nickname_dict = cea_team_name_parser.init_dictionary(
+        self.teams_file)
+    self.update_ratings(teams_dict)
+    make_csv(self.player_dictionary, self.csv_file, teams_dict, nickname_dict,
+             self.ratings)
+
+
+def add_tracker(records, analyses):
+  """Adds the replay_analytics analysis of each replay to its record, under
+  the 'tracker' key.
+
+  Args:
+      records (list of tuple): (record, error) tuples from ReplayCache.get_many
+      analyses (list of tuple): (analysis, error) tuples for the same replays
+
+  Returns:
+      list of tuple: (record, error) tuples. Replays that couldn't be
+        analyzed keep their record without analysis.
+  """
+  return [(dict(record, tracker=analysis) if record and analysis else record,
+           error)
+          for (record, error), (analysis, _) in zip(records, analyses)]
+
+
+def compile_stats(directory, nicknames_dict, cache=None, jobs=1,
+                  analytics=None, ratings=None):
+  """Aggregates player statistics from every replay in a directory.
+
+  Args:
+      analytics (ReplayCache): cache from replay_analytics.make_analytics_cache,
+        to add economy and army statistics. Not computed if None.
+      ratings (RatingEngine): league ratings the new games are rated with.
+
+  Returns:
+      dict: KEY: Name. VALUE: PlayerObject
+  """
+  if cache is None:
+    cache = replay_cache.ReplayCache(
+        quarantine=replay_quarantine.Quarantine())
+
+  replays = replay_parser.list_replays(directory)
+  print("Found %d replays to scan" % len(replays))
+
+  stats = StatsStage(nicknames_dict, ratings=ratings)
+  paths = [os.path.join(directory, replay) for replay in replays]
+  records = cache.get_many(paths, jobs)
+  # Each game only counts once, however many replays of it were uploaded.
+  fingerprints = replay_fingerprints.FingerprintIndex()
+  replays, paths, records = fingerprints.drop_duplicates(replays, paths,
+                                                         records)
+  if analytics is not None:
+    records = add_tracker(records, analytics.get_many(paths, jobs))
+    analytics.save()
+  for replay, (result, error) in zip(replays, records):
+    if error:
       print("Error processing replay: %s" % replay)
-      traceback.print_exc()
+      print(error, end='')
+      continue
+    with metrics.timer('stats.add'):
+      try:
+        stats.add(replay, result)
+      except:
+        metrics.record_failure('stats', sys.exc_info()[1])
+        print("Error processing replay: %s" % replay)
+        traceback.print_exc()
+  cache.save()
+  stats.update_ratings(cea_team_name_parser.init_dictionary(TEAMS_FILE)[0])
 
-  return player_dictionary
+  return stats.player_dictionary
 
 
 def print_dictionary(player_dictionary):
@@ -242,21 +347,52 @@ def print_dictionary(player_dictionary):
     key = sorted_player_dict[i][0]
     value = sorted_player_dict[i][1]
     print("%d : %d %s %s" % (value.wins, value.losses,
-                             teams_dict[value.name.lower()] + " " + value.name, value.race))
+                             teams_dict.get(value.name.lower(), UNKNOWN_TEAM) + " " + value.name,
+                             value.race))
+
+
+def make_csv(player_dictionary, filename="cea_season_stats.csv",
+             teams_dict=None, nickname_dict=None, ratings=None):
+  """Writes the season stats CSV.
+
+  Args:
+      player_dictionary (dict): KEY: Name. VALUE: PlayerObject
+      filename (str): CSV file to write.
+      teams_dict, nickname_dict (dict): Dictionaries from
+        cea_team_name_parser.init_dictionary. Read from TEAMS_FILE if not
+        given.
+      ratings (RatingEngine): league ratings, written in RATING_COLUMNS if
+        given.
+  """
+  if teams_dict is None or nickname_dict is None:
+    teams_dict, nickname_dict = cea_team_name_parser.init_dictionary(TEAMS_FILE)
 
+  # KEY: lowercase alias. VALUE: MMR of the player with that alias. Players
+  # missing from the teams file are found by their own name.
+  mmr_table = {name.lower(): player.mmr
+               for name, player in player_dictionary.items()}
+  mmr_table.update({alias: player_dictionary[name].mmr
+                    for alias, name in nickname_dict.items()
+                    if name in player_dictionary})
 
-def make_csv(player_dictionary):
-  teams_dict, nickname_dict = cea_team_name_parser.init_dictionary(TEAMS_FILE)
   csv_arr = []
   headers_arr = ["Team Name", "Name", "Wins", "Losses", "MMR", "Race", "APM",
                  "Biggest Win (MMR Diff)", "Biggest Loss (MMR Diff)", "Players Defeated (MMR Diff)", "Players Lost To (MMR Diff)"]
-  with open("cea_season_stats.csv", "w", newline='') as my_csv:
+  # Economy and army columns, only when replays were analyzed.
+  tracker = any(value.tracker_sums for value in player_dictionary.values())
+  if tracker:
+    headers_arr += [TRACKER_COLUMNS[key] for key in replay_analytics.SUMMARY_KEYS]
+  if ratings is not None:
+    headers_arr += RATING_COLUMNS
+  with open(filename, "w", newline='') as my_csv:
     csvWriter = csv.writer(my_csv, delimiter=',')
     csvWriter.writerow(headers_arr)
     for key, value in player_dictionary.items():
       new_entry = []
+      # Players missing from the teams file are still written.
+      team = teams_dict.get(value.name.lower(), UNKNOWN_TEAM)
       # Name
-      new_entry.append(teams_dict[value.name.lower()])
+      new_entry.append(team)
       new_entry.append(value.name)
 
       # Wins
@@ -274,12 +410,12 @@ def make_csv(player_dictionary):
 
       # Retrieve list of opponents beaten / lost to, with MMR differential.
       def opponent_func(opponents_list, descending):
-        new_opponents_list = [opp_nickname for opp_nickname in opponents_list]
-        new_opponents_list = sorted(new_opponents_list, key=lambda item: (
-            player_dictionary[nickname_dict[item.lower()]].mmr), reverse=descending)
-        new_opponents_list = [opponent + " ({:+})".format(
-            player_dictionary[nickname_dict[opponent.lower()]].mmr - value.mmr) for opponent in new_opponents_list]
-        return new_opponents_list
+        opponent_mmrs = sorted(
+            ((mmr_table.get(opponent.lower(), 0), opponent)
+             for opponent in opponents_list),
+            key=lambda item: item[0], reverse=descending)
+        return [opponent + " ({:+})".format(mmr - value.mmr)
+                for mmr, opponent in opponent_mmrs]
 
       opponents_beaten = opponent_func(value.opponents_beaten, True)
       opponents_lost_to = opponent_func(value.opponents_lost_to, False)
@@ -294,18 +430,65 @@ def make_csv(player_dictionary):
       new_entry.append(" ; ".join(opponents_beaten))
       new_entry.append(" ; ".join(opponents_lost_to))
 
+      # Averages of the economy and army statistics
+      if tracker:
+        for key in replay_analytics.SUMMARY_KEYS:
+          average = value.tracker_average(key)
+          new_entry.append("" if average is None else round(average, 1))
+
+      # League ratings of the player and their team
+      if ratings is not None:
+        rating = ratings.players.get(value.name)
+        if rating is None:
+          new_entry += ["", "", ""]
+        else:
+          new_entry += [round(rating.rating), round(rating.deviation),
+                        "{:+}".format(round(rating.delta))]
+        team_rating = ratings.teams.get(team)
+        if team_rating is None:
+          new_entry += ["", ""]
+        else:
+          new_entry += [round(team_rating.rating),
+                        "{:+}".format(round(team_rating.delta))]
+
       csvWriter.writerow(new_entry)
       csv_arr.append(new_entry)
   print("Done creating CSV");
 
 
+def add_tracker_arguments(parser):
+  """Adds the --tracker and --tracker-cutoff flags to a script's parser."""
+  parser.add_argument('--tracker', action='store_true', dest='tracker',
+                      help='Add economy and army stats from the tracker events to the CSV')
+  parser.add_argument('--tracker-cutoff', type=float, dest='tracker_cutoff',
+                      help='Only read the tracker events up to this many seconds into each game')
+
+
 def print_names(teams_dictionary):
   for key, value in teams_dictionary.items():
     print(key)
 
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Compile a CSV with stats on the league')
+  parser.add_argument('--jobs', type=int, dest='jobs', default=1,
+                      help='Number of processes used to decode replays')
+  add_tracker_arguments(parser)
+  metrics.add_arguments(parser)
+  args = parser.parse_args()
   teams_dict, nicknames_dict = cea_team_name_parser.init_dictionary(TEAMS_FILE)
   print(nicknames_dict)
-  player_dictionary = compile_stats(REPLAY_DIRECTORY, nicknames_dict)
-  make_csv(player_dictionary)
+
+  def main():
+    analytics = None
+    if args.tracker:
+      analytics = replay_analytics.make_analytics_cache(args.tracker_cutoff)
+    rating_engine = ratings.RatingEngine()
+    player_dictionary = compile_stats(REPLAY_DIRECTORY, nicknames_dict,
+                                      jobs=args.jobs, analytics=analytics,
+                                      ratings=rating_engine)
+    with metrics.timer('stats.finish'):
+      make_csv(player_dictionary, ratings=rating_engine)
+
+  metrics.run(args, main)
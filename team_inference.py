@@ -0,0 +1,257 @@
+"""Infers the team of players missing from the teams file from who they played.
+
+Every week, each team plays a single opposing team, so the players a team
+faced in a week are teammates. Unknown players are grouped with a union-find:
+the unknown players each team faced in a week are merged together, over and
+over until nothing changes, so that groups spread across weeks and through
+games between two unknown players. Each group is then given the team that
+most often faced its opponents in the weeks it played, in rounds, so groups
+only linked to known teams through other groups get a team too.
+
+The result doesn't depend on the order of the games. Each pass over the
+games is near-linear in the number of games, and the number of passes is the
+length of the longest chain of inferences, which is small in practice.
+
+Attributes:
+    INFERENCE_FILE (str): Default location of the inference results.
+"""
+import json
+import os
+from collections import Counter, defaultdict
+
+INFERENCE_FILE = "data/team_inference.json"
+UNKNOWN_TEAM = "TEAM_NOT_KNOWN"
+
+
+class UnionFind:
+
+  """Disjoint sets of players.
+
+  Attributes:
+      parent (dict): player key => parent player key
+  """
+
+  def __init__(self):
+    self.parent = {}
+    self.size = {}
+
+  def add(self, player):
+    if player not in self.parent:
+      self.parent[player] = player
+      self.size[player] = 1
+
+  def find(self, player):
+    root = player
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[player] != root:
+      self.parent[player], player = root, self.parent[player]
+    return root
+
+  def union(self, first, second):
+    """Merges the sets of two players.
+
+    Returns:
+        bool: whether they were in different sets.
+    """
+    first, second = self.find(first), self.find(second)
+    if first == second:
+      return False
+    if self.size[first] < self.size[second]:
+      first, second = second, first
+    self.parent[second] = first
+    self.size[first] += self.size[second]
+    return True
+
+
+class TeamInference:
+
+  """Collects games and infers the team of unknown players.
+
+  Attributes:
+      games (list of tuple): (week, player key, player key)
+      names (dict): player key => player name as first seen
+  """
+
+  def __init__(self, teams, aliases):
+    self.teams = teams
+    self.aliases = aliases
+    self.games = []
+    self.names = {}
+
+  def _key(self, name):
+    name = self.aliases.get(name.lower(), name)
+    key = name.lower()
+    self.names.setdefault(key, name)
+    return key
+
+  def add_game(self, week, player_names):
+    """Adds a game between two players.
+
+    Args:
+        week (string): week the game was played, ex: Week4
+        player_names (list of string): the 2 players
+    """
+    self.games.append((week, self._key(player_names[0]),
+                       self._key(player_names[1])))
+
+  def _sides(self):
+    # Both sides of every game: (week, player, opponent)
+    for week, first, second in self.games:
+      yield week, first, second
+      yield week, second, first
+
+  def infer(self):
+    """Infers teams from the games added so far.
+
+    Returns:
+        dict: with keys
+          assignments (list of dict): suggested team of each unknown player,
+            most confident first. votes counts, for each team, the games its
+            players played against the opponents of the player's group in
+            the weeks they were played, and confidence is the share of votes
+            for the suggested team, smoothed so that few votes give less
+            confidence.
+          conflicts (list of dict): weeks in which a team faced players of
+            several known teams, and games between players of the same team.
+          unresolved (list of str): unknown players whose team can't be
+            inferred.
+    """
+    sets = UnionFind()
+    for week, player, opponent in self._sides():
+      sets.add(player)
+    # Players of a team in the teams file are one set.
+    roster = {}
+    for player in sets.parent:
+      if player in self.teams:
+        sets.union(roster.setdefault(self.teams[player], player), player)
+
+    changed = True
+    while changed:
+      changed = False
+      # (week, set of the team) => an unknown player that team faced that week
+      faced = {}
+      for week, player, opponent in self._sides():
+        if opponent in self.teams:
+          continue
+        side = (week, sets.find(player))
+        if side not in faced:
+          faced[side] = opponent
+        elif sets.union(faced[side], opponent):
+          changed = True
+
+    teams, votes = self._label(sets)
+    return {
+        'assignments': self._assignments(sets, teams, votes),
+        'conflicts': self._conflicts(sets),
+        'unresolved': sorted(self.names[player] for player in sets.parent
+                             if sets.find(player) not in teams)}
+
+  def _label(self, sets):
+    """Gives each set of players a team, in rounds: a set gets the team whose
+    players most often faced the set's opponents in the same week.
+
+    Returns:
+        tuple: (dict of root player key => team, dict of root player key =>
+          Counter of the votes for each team, for inferred teams)
+    """
+    teams = {}
+    for player in sets.parent:
+      if player in self.teams:
+        teams[sets.find(player)] = self.teams[player]
+
+    team_votes = {}
+    while True:
+      # (week, set of a team) => teams of the players who faced it that week
+      faced_teams = defaultdict(Counter)
+      for week, player, opponent in self._sides():
+        team = teams.get(sets.find(player))
+        if team:
+          faced_teams[(week, sets.find(opponent))][team] += 1
+
+      votes = defaultdict(Counter)
+      for week, player, opponent in self._sides():
+        root = sets.find(player)
+        faced = faced_teams.get((week, sets.find(opponent)))
+        # Players who only faced players of unknown teams get no vote.
+        if root not in teams and faced:
+          votes[root].update(faced)
+      if not votes:
+        break
+      for root, root_votes in votes.items():
+        teams[root] = min(root_votes.items(), key=lambda vote: (-vote[1], vote[0]))[0]
+        team_votes[root] = root_votes
+    return teams, team_votes
+
+  def _assignments(self, sets, teams, team_votes):
+    games = Counter()
+    weeks = defaultdict(set)
+    for week, player, opponent in self._sides():
+      if player not in self.teams:
+        games[player] += 1
+        weeks[player].add(week)
+
+    assignments = []
+    for player in games:
+      root = sets.find(player)
+      if root not in teams:
+        continue
+      votes = team_votes[root]
+      team = teams[root]
+      assignments.append({
+          'player': self.names[player], 'team': team,
+          'confidence': round((votes[team] + 1) / (sum(votes.values()) + 2), 3),
+          'games': games[player], 'weeks': sorted(weeks[player]),
+          'votes': dict(votes.most_common())})
+    assignments.sort(key=lambda a: (-a['confidence'], -a['games'], a['player']))
+    return assignments
+
+  def _conflicts(self, sets):
+    # (week, team) => known teams whose players it faced that week
+    faced = defaultdict(set)
+    for week, player, opponent in self._sides():
+      if player in self.teams and opponent in self.teams:
+        faced[(week, self.teams[player])].add(self.teams[opponent])
+    conflicts = [
+        {'type': 'faced multiple teams', 'week': week, 'team': team,
+         'opponent_teams': sorted(opponent_teams)}
+        for (week, team), opponent_teams in faced.items()
+        if len(opponent_teams - {team}) >= 2]
+
+    own_team_games = set()
+    for week, first, second in self.games:
+      game = (week, frozenset((first, second)))
+      if (first in self.teams and self.teams[first] == self.teams.get(second)
+          and game not in own_team_games):
+        own_team_games.add(game)
+        conflicts.append({
+            'type': 'played own team', 'week': week,
+            'team': self.teams[first],
+            'players': sorted([self.names[first], self.names[second]])})
+    conflicts.sort(key=lambda c: (c['week'], c['team']))
+    return conflicts
+
+
+def print_inference(inference):
+  """Prints suggested teams and potential errors in the teams file."""
+  for conflict in inference['conflicts']:
+    if conflict['type'] == 'faced multiple teams':
+      print("Potential error in teams file: In {0}, {1} faced multiple teams:".format(
+          conflict['week'], conflict['team']))
+      print('Teams: ', *conflict['opponent_teams'], sep='\n\t')
+    else:
+      print("Potential error in teams file: In {0}, {1} played their own team ({2})".format(
+          conflict['week'], ' vs '.join(conflict['players']), conflict['team']))
+  for assignment in inference['assignments']:
+    print("Suggested team for {0}: {1} (confidence {2:.0%}, {3} games in {4})".format(
+        assignment['player'], assignment['team'], assignment['confidence'],
+        assignment['games'], ', '.join(assignment['weeks'])))
+
+
+def save_inference(inference, filename=INFERENCE_FILE):
+  """Writes the inference results as JSON."""
+  directory = os.path.dirname(filename)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  with open(filename, 'w', encoding='utf-8') as f:
+    json.dump(inference, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,81 @@
+"""Tests of matchup_matrices.py: the head-to-head records match the games
+counted one by one.
+Usage: python -m pytest tests
+"""
+import pytest
+
+import matchup_matrices
+
+# week, map, players, teams, races, winner
+GAMES = [
+    ("Week1", "Triton LE", ["Feniks", "Slumdog"], ["Alexa", "Xbox"],
+     ["P", "Z"], 0),
+    ("Week1", "Triton LE", ["Slumdog", "Feniks"], ["Xbox", "Alexa"],
+     ["Z", "P"], 0),
+    ("Week1", "Ever Dream LE", ["Feniks", "viceamiral"], ["Alexa", "Alexa"],
+     ["P", "T"], 1),
+    ("Week2", "Triton LE", ["Feniks", "Slumdog"], ["Alexa", "Xbox"],
+     ["P", "Z"], 0),
+    ("Week2", "Ever Dream LE", ["Zuckerzerg", "Feniks"], ["Facebook", "Alexa"],
+     ["Z", "P"], 0),
+    ("Week2", "Ever Dream LE", ["Feniks", "Feniks"], ["Alexa", "Alexa"],
+     ["P", "P"], 1),
+]
+COLUMNS = {'player': 2, 'team': 3, 'race': 4}
+
+
+@pytest.fixture
+def matrices():
+  matrices = matchup_matrices.MatchupMatrices()
+  for game in GAMES:
+    matrices.add_game(*game)
+  return matrices
+
+
+def count_record(kind, label, week=None, map_name=None):
+  """Record of a label against each opponent, counted game by game."""
+  records = {}
+  for game in GAMES:
+    if week not in (None, game[0]) or map_name not in (None, game[1]):
+      continue
+    labels, winner = game[COLUMNS[kind]], game[5]
+    for i in (0, 1):
+      if labels[i] == label:
+        record = records.setdefault(labels[1 - i], [0, 0])
+        record[0 if winner == i else 1] += 1
+  return sorted(((opponent, wins, losses)
+                 for opponent, (wins, losses) in records.items()),
+                key=lambda record: (-record[1] - record[2], record[0]))
+
+
+@pytest.mark.parametrize('kind, label', [
+    ('player', "Feniks"), ('player', "Slumdog"), ('team', "Alexa"),
+    ('team', "Facebook"), ('race', "P")])
+@pytest.mark.parametrize('week, map_name', [
+    (None, None), ("Week1", None), (None, "Triton LE"),
+    ("Week2", "Ever Dream LE")])
+def test_record(matrices, kind, label, week, map_name):
+  assert matrices.record(kind, label, week, map_name) == count_record(
+      kind, label, week, map_name)
+
+
+def test_pairs(matrices):
+  winners, losers, wins = matrices.pairs('player')
+  labels = matrices.labels['player']
+  assert [(labels[i], labels[j], n)
+          for i, j, n in zip(winners, losers, wins)] == [
+              ("Feniks", "Feniks", 1), ("Feniks", "Slumdog", 2),
+              ("Slumdog", "Feniks", 1), ("viceamiral", "Feniks", 1),
+              ("Zuckerzerg", "Feniks", 1)]
+  assert wins.sum() == len(GAMES)
+
+
+def test_race_matchups(matrices):
+  assert matchup_matrices.race_matchups(matrices) == {
+      'PvZ': [2, 4], 'PvT': [0, 1], 'ZvT': [0, 0]}
+  with pytest.raises(ValueError):
+    matrices.wins('player')
+
+
+def test_unknown_label(matrices):
+  assert matrices.record('player', "Nobody") == []
@@ -0,0 +1,217 @@
+"""Tests of mpq_reader.py: files are read the same as with mpyq, from the
+replays of the upload folder and from an archive built here with files split
+in sectors, which replays don't have.
+Usage: python -m pytest tests
+"""
+import bz2
+import os
+import random
+import shutil
+import struct
+import zlib
+
+import mpyq
+import pytest
+
+import mpq_reader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPLAYS = [
+    "GapWeek-Facebook_Zuckerzerg-Findex_Fast_Expand-Juno-StoicWilly-Z-T-Simulacrum_LE.SC2Replay",
+    "Week1-Facebook_Lingstagram-IBM_Virtual_Private_Carriers-arcane-GreatArchon-P-T-Triton_LE.SC2Replay"]
+REPLAY = os.path.join(ROOT, "UploadHere", REPLAYS[1])
+HASH_TABLE_ENTRIES = 8
+# 512 byte sectors.
+SECTOR_SIZE_SHIFT = 0
+SECTOR_SIZE = 512 << SECTOR_SIZE_SHIFT
+
+
+def read_mpyq(path, names):
+  archive = mpyq.MPQArchive(path, listfile=False)
+  try:
+    return [archive.read_file(name) for name in names]
+  finally:
+    archive.file.close()
+
+
+def read_mpq_reader(path, names):
+  with mpq_reader.MPQReader(path) as archive:
+    return [archive.read_file(name) for name in names]
+
+
+def encrypt(words, key):
+  """Encrypts a hash table or block table, the reverse of mpq_reader.decrypt."""
+  seed2 = 0xEEEEEEEE
+  result = []
+  for value in words:
+    seed2 = (seed2 + mpq_reader.CRYPT_TABLE[0x400 + (key & 0xFF)]) & 0xFFFFFFFF
+    result.append(value ^ ((key + seed2) & 0xFFFFFFFF))
+    key = ((((~key) << 21) + 0x11111111) | (key >> 11)) & 0xFFFFFFFF
+    seed2 = (value + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+  return result
+
+
+def zlib_compress(data):
+  return bytes([mpq_reader.COMPRESSION_ZLIB]) + zlib.compress(data)
+
+
+def bz2_compress(data):
+  return bytes([mpq_reader.COMPRESSION_BZIP2]) + bz2.compress(data)
+
+
+def sectors(data, compressions):
+  """Stores a file in sectors, each compressed with the given function, or
+  left as is if None, after the table of their offsets."""
+  parts = [compress(data[i:i + SECTOR_SIZE]) if compress
+           else data[i:i + SECTOR_SIZE]
+           for i, compress in zip(range(0, len(data), SECTOR_SIZE),
+                                  compressions)]
+  positions = [4 * (len(parts) + 1)]
+  for part in parts:
+    positions.append(positions[-1] + len(part))
+  return struct.pack('<%dI' % len(positions), *positions) + b''.join(parts)
+
+
+def build_archive(path, files, user_data=b'replay header'):
+  """Writes a replay-like archive.
+
+  Args:
+      files (list of tuple): (name, stored bytes, size, flags) of each file
+  """
+  archive_offset = 64
+  blocks = []
+  body = b''
+  position = mpq_reader.ARCHIVE_HEADER.size
+  for name, stored, size, flags in files:
+    blocks.append((position + len(body), len(stored), size,
+                   flags | mpq_reader.FILE_EXISTS))
+    body += stored
+  hash_table = [(mpq_reader.HASH_ENTRY_EMPTY,) * 4] * HASH_TABLE_ENTRIES
+  for block_index, (name, stored, size, flags) in enumerate(files):
+    i = mpq_reader.mpq_hash(name, mpq_reader.TABLE_OFFSET) % HASH_TABLE_ENTRIES
+    while hash_table[i][3] != mpq_reader.HASH_ENTRY_EMPTY:
+      i = (i + 1) % HASH_TABLE_ENTRIES
+    hash_table[i] = (mpq_reader.mpq_hash(name, mpq_reader.HASH_A),
+                     mpq_reader.mpq_hash(name, mpq_reader.HASH_B), 0,
+                     block_index)
+  tables = b''
+  for name, table in (('hash', hash_table), ('block', blocks)):
+    words = encrypt([word for entry in table for word in entry],
+                    mpq_reader.mpq_hash('(%s table)' % name, mpq_reader.TABLE))
+    tables += struct.pack('<%dI' % len(words), *words)
+  hash_table_offset = position + len(body)
+  block_table_offset = hash_table_offset + HASH_TABLE_ENTRIES * 16
+  archive_size = block_table_offset + len(blocks) * 16
+  header = mpq_reader.USER_DATA_HEADER.pack(
+      mpq_reader.USER_DATA_MAGIC, archive_offset, archive_offset,
+      len(user_data)) + user_data
+  with open(path, 'wb') as f:
+    f.write(header.ljust(archive_offset, b'\0'))
+    f.write(mpq_reader.ARCHIVE_HEADER.pack(
+        mpq_reader.ARCHIVE_MAGIC, mpq_reader.ARCHIVE_HEADER.size,
+        archive_size, 0, SECTOR_SIZE_SHIFT, hash_table_offset,
+        block_table_offset, HASH_TABLE_ENTRIES, len(blocks)))
+    f.write(body)
+    f.write(tables)
+
+
+@pytest.mark.parametrize('replay', REPLAYS)
+def test_reads_replay_like_mpyq(replay):
+  path = os.path.join(ROOT, "UploadHere", replay)
+  names = read_mpyq(path, ['(listfile)'])[0].decode('utf-8').split()
+  names += ['(listfile)', '(attributes)', 'replay.missing']
+  with mpq_reader.MPQReader(path) as archive:
+    blocks = [archive._block(name) for name in names[:-1]]
+  # Replays have single unit files stored compressed and as they are.
+  single_unit = [(size, archived_size)
+                 for offset, archived_size, size, flags in blocks
+                 if flags & mpq_reader.FILE_SINGLE_UNIT]
+  assert any(size > archived_size for size, archived_size in single_unit)
+  assert any(size == archived_size for size, archived_size in single_unit)
+  assert read_mpq_reader(path, names) == read_mpyq(path, names)
+  assert read_mpq_reader(path, ['replay.missing']) == [None]
+
+
+def test_reads_sectors_like_mpyq(tmp_path):
+  # Three sectors, zlib and bz2 compressed, the last one shorter.
+  events = (b'replay.game.events ' * 100)[:SECTOR_SIZE * 2 + 300]
+  # A full sector that doesn't compress is stored as it is, between
+  # compressed ones.
+  tracker = (b'replay.tracker.events ' * 30)[:SECTOR_SIZE]
+  tracker += random.Random(0).randbytes(SECTOR_SIZE) + tracker
+  details = b'{"Players": [{"APM": 120, "MMR": 4000}]}' * 8
+  path = str(tmp_path / "sectors.SC2Replay")
+  build_archive(path, [
+      ('replay.game.events',
+       sectors(events, [zlib_compress, bz2_compress, zlib_compress]),
+       len(events), mpq_reader.FILE_COMPRESS),
+      ('replay.tracker.events',
+       sectors(tracker, [zlib_compress, None, zlib_compress]),
+       len(tracker), mpq_reader.FILE_COMPRESS),
+      ('replay.details', zlib_compress(details), len(details),
+       mpq_reader.FILE_COMPRESS | mpq_reader.FILE_SINGLE_UNIT),
+      ('replay.initData', details, len(details),
+       mpq_reader.FILE_COMPRESS | mpq_reader.FILE_SINGLE_UNIT)])
+
+  names = ['replay.game.events', 'replay.details', 'replay.initData']
+  assert read_mpq_reader(path, names) == [events, details, details]
+  assert read_mpyq(path, names) == [events, details, details]
+  # mpyq tries to decompress the sector stored as it is.
+  assert read_mpq_reader(path, ['replay.tracker.events']) == [tracker]
+  mpq_reader.check_archive(path, names + ['replay.tracker.events'])
+  with mpq_reader.MPQReader(path) as archive:
+    assert archive.user_data == b'replay header'
+
+
+def test_rejects_corrupted_sector(tmp_path):
+  events = (b'replay.game.events ' * 100)[:SECTOR_SIZE * 2]
+  stored = sectors(events, [zlib_compress, zlib_compress])
+  # Breaks the zlib stream of the second sector.
+  stored = stored[:-8] + b'\xff' * 8
+  path = str(tmp_path / "corrupted.SC2Replay")
+  build_archive(path, [('replay.game.events', stored, len(events),
+                        mpq_reader.FILE_COMPRESS)])
+  with pytest.raises(mpq_reader.InvalidReplay, match="Corrupted"):
+    read_mpq_reader(path, ['replay.game.events'])
+
+
+@pytest.mark.parametrize('size', [
+    10,  # inside the user data header
+    1100,  # inside the MPQ header or the files
+    -1,  # missing the end of the block table
+    0.5,
+    0.99])
+def test_check_rejects_truncated_archive(tmp_path, size):
+  path = str(tmp_path / "truncated.SC2Replay")
+  shutil.copy(REPLAY, path)
+  mpq_reader.check_archive(path)
+  if isinstance(size, float):
+    size = int(os.path.getsize(path) * size)
+  elif size < 0:
+    size += os.path.getsize(path)
+  with open(path, 'r+b') as f:
+    f.truncate(size)
+  with pytest.raises(mpq_reader.InvalidReplay):
+    mpq_reader.check_archive(path)
+
+
+def test_check_rejects_missing_file(tmp_path):
+  path = str(tmp_path / "missing.SC2Replay")
+  build_archive(path, [('replay.initData', b'init', 4,
+                        mpq_reader.FILE_SINGLE_UNIT)])
+  with pytest.raises(mpq_reader.InvalidReplay, match="Missing replay.details"):
+    mpq_reader.check_archive(path)
+
+
+def test_check_rejects_file_past_archive(tmp_path):
+  path = str(tmp_path / "cut.SC2Replay")
+  shutil.copy(REPLAY, path)
+  with mpq_reader.MPQReader(path) as archive:
+    offset, archived_size = archive._block('replay.details')[:2]
+    archive_offset = archive.offset
+  # Shrinks the archive in its header, as if the details were cut off.
+  with open(path, 'r+b') as f:
+    f.seek(archive_offset + 8)
+    f.write(struct.pack('<I', offset + archived_size - 1))
+  with pytest.raises(mpq_reader.InvalidReplay):
+    mpq_reader.check_archive(path)
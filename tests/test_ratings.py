@@ -0,0 +1,101 @@
+"""Tests of ratings.py: adding games over several runs rates them like
+rating every game at once.
+Usage: python -m pytest tests
+"""
+import pytest
+
+import ratings
+
+GAMES = [
+    {'time_utc': 100, 'fingerprint': "100:1-S2-1-1,1-S2-1-2",
+     'players': ["Feniks", "Slumdog"], 'teams': ["Alexa", "Xbox"],
+     'winner': 0},
+    {'time_utc': 200, 'fingerprint': "200:1-S2-1-2,1-S2-1-3",
+     'players': ["Slumdog", "viceamiral"], 'teams': ["Xbox", "Alexa"],
+     'winner': 1},
+    {'time_utc': 300, 'fingerprint': "300:1-S2-1-1,1-S2-1-3",
+     'players': ["Feniks", "viceamiral"], 'teams': ["Alexa", "Alexa"],
+     'winner': 0},
+    {'time_utc': 400, 'fingerprint': "400:1-S2-1-1,1-S2-1-4",
+     'players': ["Feniks", "Zuckerzerg"], 'teams': ["Alexa", None],
+     'winner': 1},
+]
+
+
+def state(engine):
+  """Ratings and rated games of an engine, without the deltas."""
+  return ({name: rating.to_list()[:4]
+           for name, rating in engine.players.items()},
+          {name: rating.to_list()[:4] for name, rating in engine.teams.items()},
+          engine.games)
+
+
+def rate_at_once(games):
+  engine = ratings.RatingEngine(None)
+  engine.add_games(games)
+  return engine
+
+
+def test_rates_new_games_in_order():
+  engine = ratings.RatingEngine(None)
+  assert engine.add_games(GAMES[:2]) == (2, 0, 0)
+  assert engine.add_games(GAMES) == (2, 0, 0)
+  assert state(engine) == state(rate_at_once(GAMES))
+  # Nothing changes when the same games are passed again.
+  assert engine.add_games(GAMES) == (0, 0, 0)
+  assert state(engine) == state(rate_at_once(GAMES))
+
+
+def test_rates_late_game_again_in_order():
+  engine = ratings.RatingEngine(None)
+  engine.add_games(GAMES[1:])
+  feniks = engine.players["Feniks"].rating
+  assert engine.add_games(GAMES) == (1, 0, 0)
+  assert state(engine) == state(rate_at_once(GAMES))
+  assert [game[0] for game in engine.games] == [100, 200, 300, 400]
+  assert engine.players["Feniks"].delta == pytest.approx(
+      engine.players["Feniks"].rating - feniks)
+
+
+def test_rates_changed_roster_again():
+  engine = ratings.RatingEngine(None)
+  engine.add_games(GAMES)
+  # Zuckerzerg turns out to be an alias of Slumdog, of a known team.
+  fixed = GAMES[:3] + [dict(GAMES[3], players=["Feniks", "Slumdog"],
+                            teams=["Alexa", "Xbox"])]
+  assert engine.add_games(fixed) == (0, 1, 0)
+  assert state(engine) == state(rate_at_once(fixed))
+  assert "Zuckerzerg" not in engine.players
+  assert engine.players["Slumdog"].games == 3
+
+
+def test_drops_removed_game():
+  engine = ratings.RatingEngine(None)
+  engine.add_games(GAMES)
+  slumdog = engine.players["Slumdog"].rating
+  remaining = GAMES[1:]
+  assert engine.add_games(remaining) == (0, 0, 1)
+  assert state(engine) == state(rate_at_once(remaining))
+  assert len(engine.games) == 3
+  assert engine.players["Feniks"].games == 2
+  assert engine.players["Slumdog"].delta == pytest.approx(
+      engine.players["Slumdog"].rating - slumdog)
+
+
+def test_drops_removed_game_of_saved_ratings(tmp_path):
+  filename = str(tmp_path / "ratings.json")
+  engine = ratings.RatingEngine(filename)
+  engine.add_games(GAMES)
+  engine.save()
+
+  # The replay of the last game was removed before the next run.
+  engine = ratings.RatingEngine(filename)
+  assert engine.add_games(GAMES[:3]) == (0, 0, 1)
+  assert state(engine) == state(rate_at_once(GAMES[:3]))
+  assert "Zuckerzerg" not in engine.players
+
+
+def test_rates_game_once():
+  engine = ratings.RatingEngine(None)
+  assert engine.add_games(GAMES + GAMES[:1]) == (4, 0, 0)
+  assert state(engine) == state(rate_at_once(GAMES))
@@ -0,0 +1,81 @@
+"""Tests of which decode errors ReplayCache quarantines, on a replay of the
+upload folder copied to a temporary folder.
+Usage: python -m pytest tests
+"""
+import os
+import shutil
+
+import pytest
+
+import replay_cache
+import replay_parser
+import replay_quarantine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPLAY = "Week1-Facebook_Lingstagram-IBM_Virtual_Private_Carriers-arcane-GreatArchon-P-T-Triton_LE.SC2Replay"
+
+
+@pytest.fixture
+def upload(tmp_path):
+  directory = tmp_path / "UploadHere"
+  directory.mkdir()
+  path = str(directory / "Game 1.SC2Replay")
+  shutil.copy(os.path.join(ROOT, "UploadHere", REPLAY), path)
+  return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+  return replay_cache.ReplayCache(None, quarantine=replay_quarantine.Quarantine(
+      str(tmp_path / "quarantine.json")))
+
+
+def test_decodes_replay(upload, cache):
+  [(record, error)] = cache.get_many([upload])
+  assert error is None
+  assert record['map_title'] == "Triton LE"
+  assert os.path.isfile(upload)
+  assert not cache.quarantine.entries
+
+
+def test_quarantines_truncated_replay(upload, cache):
+  with open(upload, 'r+b') as f:
+    f.truncate(os.path.getsize(upload) // 2)
+  sha = replay_cache.hash_file(upload)
+  [(record, error)] = cache.get_many([upload])
+  assert record is None
+  assert error.startswith("InvalidReplay:")
+  assert not os.path.exists(upload)
+  assert os.path.isfile(cache.quarantine.path(sha))
+  assert cache.quarantine.reason(sha) == error.strip()
+
+
+def test_quarantines_timeout(upload, cache, monkeypatch):
+  def decode_replay(path, timings=None, archive=None):
+    raise replay_parser.DecodeTimeout("Decoding took more than 60 seconds")
+  monkeypatch.setattr(replay_parser, 'decode_replay', decode_replay)
+  [(record, error)] = cache.get_many([upload])
+  assert error.startswith("DecodeTimeout:")
+  assert not os.path.exists(upload)
+  assert len(cache.quarantine.entries) == 1
+
+
+@pytest.mark.parametrize('exception', [
+    ImportError("No module named 's2protocol.versions.protocol99999'"),
+    OSError("Input/output error")])
+def test_keeps_replay_that_may_decode_later(upload, cache, monkeypatch,
+                                            exception):
+  def decode_replay(path, timings=None, archive=None):
+    raise exception
+  monkeypatch.setattr(replay_parser, 'decode_replay', decode_replay)
+  [(record, error)] = cache.get_many([upload])
+  assert record is None
+  assert type(exception).__name__ in error
+  assert os.path.isfile(upload)
+  assert not cache.quarantine.entries
+
+  # It's decoded on the next run, once the error is gone.
+  monkeypatch.undo()
+  [(record, error)] = cache.get_many([upload])
+  assert error is None
+  assert record['map_title'] == "Triton LE"
@@ -0,0 +1,53 @@
+"""Tests of the game fingerprints and of dropping duplicate replays.
+Usage: python -m pytest tests
+"""
+import replay_fingerprints
+import replay_parser
+
+
+def details(title, time_utc=132317307396938932):
+  toons = [(1, 1, 3024469), (1, 1, 2220136)]
+  return {'m_timeUTC': time_utc, 'm_title': title.encode('UTF-8'),
+          'm_playerList': [{'m_toon': {'m_region': region, 'm_realm': realm,
+                                       'm_id': toon_id}}
+                           for region, realm, toon_id in toons]}
+
+
+def test_fingerprint():
+  assert (replay_parser.game_fingerprint(details("Simulacrum LE"))
+          == "132317307396938932:1-1-2220136,1-1-3024469")
+
+
+def test_localized_map_titles():
+  # Saved by an English client and by a Chinese one.
+  english = replay_parser.game_fingerprint(details("Simulacrum LE"))
+  chinese = replay_parser.game_fingerprint(details("拟像之城-天梯版"))
+  assert english == chinese
+  later = replay_parser.game_fingerprint(details("Simulacrum LE",
+                                                 132317307396938933))
+  assert later != english
+
+
+def test_drop_localized_duplicates(capsys):
+  replays = ["b.SC2Replay", "a.SC2Replay", "c.SC2Replay"]
+  titles = ["拟像之城-天梯版", "Simulacrum LE", "Simulacrum LE"]
+  records = [({'fingerprint': replay_parser.game_fingerprint(details(title))},
+              None) for title in titles]
+  records[2] = (None, "Error")
+  paths = ["UploadHere/" + replay for replay in replays]
+  fingerprints = replay_fingerprints.FingerprintIndex()
+  replays, paths, records = fingerprints.drop_duplicates(replays, paths,
+                                                         records)
+  # The first in alphabetical order is kept, errors are left to the caller.
+  assert replays == ["a.SC2Replay", "c.SC2Replay"]
+  assert "UploadHere/b.SC2Replay (same game as a.SC2Replay)" in (
+      capsys.readouterr().out)
+
+
+def test_journaled_fingerprint_with_map_title():
+  fingerprints = replay_fingerprints.FingerprintIndex()
+  fingerprints.add_journaled("UploadHere/a.SC2Replay", {
+      'fingerprint': "132317307396938932:1-1-2220136,1-1-3024469:Simulacrum LE"})
+  assert fingerprints.add("UploadHere/b.SC2Replay",
+                          replay_parser.game_fingerprint(
+                              details("拟像之城-天梯版"))) == "UploadHere/a.SC2Replay"
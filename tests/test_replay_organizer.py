@@ -0,0 +1,117 @@
+"""Tests of replay_organizer.py on replays of the upload folder, organized in
+a temporary folder.
+Usage: python -m pytest tests
+"""
+import os
+import shutil
+
+import pytest
+
+import cea_team_name_parser
+import game_index
+import replay_cache
+import replay_journal
+import replay_organizer
+import replay_placement
+import replay_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Games between players of known teams, so they're organized, uploaded as
+# Game 1.SC2Replay and so on.
+ORGANIZED = [
+    "GapWeek-Facebook_Zuckerzerg-Findex_Fast_Expand-Juno-StoicWilly-Z-T-Simulacrum_LE.SC2Replay",
+    "Week1-Facebook_Lingstagram-IBM_Virtual_Private_Carriers-arcane-GreatArchon-P-T-Triton_LE.SC2Replay",
+    "Week5-Addeparchon-Facebook_Lingstagram-ender-cliking-P-Z-Ever_Dream_LE.SC2Replay"]
+REPLAYS = ["Game %d.SC2Replay" % (i + 1) for i in range(len(ORGANIZED))]
+
+
+@pytest.fixture
+def upload(tmp_path, monkeypatch):
+  directory = tmp_path / "UploadHere"
+  directory.mkdir()
+  for organized, replay in zip(ORGANIZED, REPLAYS):
+    shutil.copy(os.path.join(ROOT, "UploadHere", organized),
+                str(directory / replay))
+  # The team folders and the rename log are made in the working directory.
+  monkeypatch.chdir(tmp_path)
+  return str(directory) + os.sep
+
+
+def organize(upload, tmp_path):
+  """Organizes the uploads like a run of replay_organizer.py.
+
+  Returns:
+      tuple: (ReplayJournal, GameIndex) the run wrote to
+  """
+  teams, aliases = cea_team_name_parser.init_dictionary(
+      os.path.join(ROOT, "cea_names.csv"))
+  journal = replay_journal.ReplayJournal(str(tmp_path / "journal.jsonl"))
+  index = game_index.GameIndex(str(tmp_path / "index.sqlite3"))
+  replay_organizer.organize_replays(
+      upload, upload, teams, aliases, cache=replay_cache.ReplayCache(None),
+      store=replay_store.ReplayStore(str(tmp_path / "store")),
+      journal=journal, index=index)
+  return (replay_journal.ReplayJournal(journal.filename),
+          game_index.GameIndex(index.filename))
+
+
+def indexed_paths(index):
+  return [path for path, in index.db.execute('SELECT path FROM games')]
+
+
+def test_organize(upload, tmp_path):
+  journal, index = organize(upload, tmp_path)
+  assert len(journal.by_name) == len(REPLAYS)
+  assert sorted(os.listdir(upload)) == sorted(ORGANIZED)
+  assert sorted(journal.by_name) == sorted(ORGANIZED)
+  assert len(indexed_paths(index)) == len(REPLAYS)
+  assert all(os.path.isfile(path) for path in indexed_paths(index))
+
+
+def test_failed_copy_is_retried(upload, tmp_path, monkeypatch):
+  materialize = replay_store.ReplayStore.materialize
+  failing = os.path.join(upload, REPLAYS[1])
+
+  def fail_once(store, sha, dst, replace=False):
+    if sha == replay_cache.hash_file(failing):
+      raise OSError("Disk full")
+    return materialize(store, sha, dst, replace)
+
+  monkeypatch.setattr(replay_store.ReplayStore, 'materialize', fail_once)
+  journal, index = organize(upload, tmp_path)
+  # Neither journaled nor indexed, nor renamed, so the next run retries it.
+  assert len(journal.by_name) == len(REPLAYS) - 1
+  assert len(indexed_paths(index)) == len(REPLAYS) - 1
+  assert all(os.path.isfile(path) for path in indexed_paths(index))
+  assert os.path.isfile(failing)
+
+  monkeypatch.setattr(replay_store.ReplayStore, 'materialize', materialize)
+  journal, index = organize(upload, tmp_path)
+  assert len(journal.by_name) == len(REPLAYS)
+  assert not os.path.exists(failing)
+  assert all(os.path.isfile(path) for path in indexed_paths(index))
+
+
+def test_failed_rename_is_retried(upload, tmp_path, monkeypatch):
+  move = shutil.move
+  moves = []
+
+  def fail_second(src, dst):
+    moves.append(src)
+    if len(moves) == 2:
+      raise OSError("Permission denied")
+    return move(src, dst)
+
+  monkeypatch.setattr(replay_placement.shutil, 'move', fail_second)
+  with pytest.raises(OSError):
+    organize(upload, tmp_path)
+  journal = replay_journal.ReplayJournal(str(tmp_path / "journal.jsonl"))
+  index = game_index.GameIndex(str(tmp_path / "index.sqlite3"))
+  assert not journal.by_name
+  assert not indexed_paths(index)
+  # The renames were undone.
+  assert sorted(os.listdir(upload)) == sorted(REPLAYS)
+
+  monkeypatch.setattr(replay_placement.shutil, 'move', move)
+  journal, index = organize(upload, tmp_path)
+  assert len(journal.by_name) == len(REPLAYS)
@@ -0,0 +1,155 @@
+"""Tests of replay_vault.py against the replay vault page of
+fixtures/replay_vault.html, served by a local stand-in for the vault.
+Usage: python -m pytest tests
+"""
+import json
+import os
+import time
+
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+import replay_vault
+from fake_drive_server import FakeDriveServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, "fixtures", "replay_vault.html")
+PAGE_PATH = '/pages/replay-vault'
+SEASON_NAME = "Spring 2020"
+NEW_LINK = "https://drive.google.com/open?id=1NeWlYaDdEd"
+
+
+@pytest.fixture(scope='module')
+def page():
+  with open(FIXTURE, 'rb') as f:
+    return f.read()
+
+
+@pytest.fixture(scope='module')
+def links(page):
+  return replay_vault.parse_vault_page(page.decode('utf-8'))[SEASON_NAME]
+
+
+@pytest.fixture
+def server(page):
+  with FakeDriveServer({}, {PAGE_PATH: (page, time.time() - 60)}) as server:
+    yield server
+
+
+@pytest.fixture
+def vault_file(tmp_path):
+  return str(tmp_path / "replay_vault.json")
+
+
+def fetch(server, vault_file, season_name=SEASON_NAME):
+  """Gets the links of a season like a run of download_replays.py, with the
+  links saved by the previous runs."""
+  with requests.Session() as session:
+    return replay_vault.VaultPage(server.page_url(PAGE_PATH),
+                                  vault_file).season_links(season_name, session)
+
+
+def recorded_ids(season):
+  """Gets the Drive IDs download_replays.py recorded from the vault page."""
+  with open(os.path.join(ROOT, "data", season + "_id_dict.json"), 'r') as f:
+    return list(json.load(f))
+
+
+def drive_ids(links):
+  return [link.split("=")[-1] for link in links]
+
+
+def starcraft_accordion(html):
+  soup = BeautifulSoup(html, 'html.parser')
+  return next(game for game in soup.find_all("div", class_="shogun-accordion")
+              if game.find("h4").text.strip() == "Starcraft 2")
+
+
+def test_parse_vault_page(page, links):
+  html = page.decode('utf-8')
+  seasons = replay_vault.parse_vault_page(html)
+  assert list(seasons) == ["Spring 2020", "Fall 2019"]
+  assert drive_ids(seasons["Spring 2020"]) == recorded_ids("Spring2020")
+  assert drive_ids(seasons["Fall 2019"]) == recorded_ids("Fall2019")
+  # Where the current season was found before tabs were matched by title.
+  current_season = starcraft_accordion(html).find_all(
+      "div", class_="shogun-tabs-body")[1]
+  assert links == [link.get('href') for link in current_season.find_all('a')]
+
+
+def test_parse_extra_tab_content(page, capsys):
+  # A tab content without a tab title, ex: a banner, falls back to the tab
+  # bodies rather than shifting the seasons.
+  html = page.decode('utf-8')
+  starcraft = html.index("Starcraft 2", html.index("<body"))
+  tabs_body = html.index('<div class="shogun-tabs-body">', starcraft)
+  html = (html[:tabs_body]
+          + '<div class="shogun-tab-content"><a href="/pages/banner">New</a></div>'
+          + html[tabs_body:])
+  seasons = replay_vault.parse_vault_page(html)
+  assert drive_ids(seasons["Spring 2020"]) == recorded_ids("Spring2020")
+  assert drive_ids(seasons["Fall 2019"]) == recorded_ids("Fall2019")
+  assert "2 tab titles but 3 tab contents" in capsys.readouterr().out
+
+
+def test_parse_missing_tab_title(page, capsys):
+  # Only the current season can still be found without every title.
+  html = page.decode('utf-8')
+  starcraft = html.index("Starcraft 2", html.index("<body"))
+  html = html[:starcraft] + html[starcraft:].replace(
+      '<div class="shogun-tab-title">Fall 2019</div>', '', 1)
+  seasons = replay_vault.parse_vault_page(html)
+  assert list(seasons) == ["Spring 2020"]
+  assert drive_ids(seasons["Spring 2020"]) == recorded_ids("Spring2020")
+  assert "only reading the Spring 2020 tab" in capsys.readouterr().out
+
+
+def test_parse_page_without_starcraft(page):
+  html = page.decode('utf-8').replace("Starcraft 2", "Starcraft")
+  assert replay_vault.parse_vault_page(html) is None
+
+
+def test_first_fetch(server, vault_file, links):
+  assert fetch(server, vault_file) == links
+  assert server.requests == {(PAGE_PATH, 200): 1}
+  saved = replay_vault.VaultPage(server.page_url(PAGE_PATH), vault_file)
+  assert saved.seasons[SEASON_NAME] == links
+  assert saved.etag and saved.last_modified
+
+
+def test_unchanged_page(server, vault_file, links):
+  fetch(server, vault_file)
+  assert fetch(server, vault_file) == links
+  assert fetch(server, vault_file) == links
+  assert server.requests == {(PAGE_PATH, 200): 1, (PAGE_PATH, 304): 2}
+
+
+def test_changed_page(server, vault_file, page, links):
+  fetch(server, vault_file)
+  server.pages[PAGE_PATH] = (page.replace(links[0].encode('utf-8'),
+                                          NEW_LINK.encode('utf-8')),
+                             time.time())
+  assert fetch(server, vault_file) == [NEW_LINK] + links[1:]
+  assert fetch(server, vault_file) == [NEW_LINK] + links[1:]
+  assert server.requests == {(PAGE_PATH, 200): 2, (PAGE_PATH, 304): 1}
+
+
+def test_vault_unreachable(page, vault_file, links, capsys):
+  with FakeDriveServer({}, {PAGE_PATH: (page, time.time())}) as server:
+    fetch(server, vault_file)
+  # The server is shut down, its port refuses connections.
+  assert fetch(server, vault_file) == links
+  assert "could not be reached" in capsys.readouterr().out
+
+
+def test_vault_unreachable_without_saved_links(page, vault_file):
+  with FakeDriveServer({}, {PAGE_PATH: (page, time.time())}) as server:
+    pass
+  with pytest.raises(requests.ConnectionError):
+    fetch(server, vault_file)
+
+
+def test_missing_tab(server, vault_file, capsys):
+  assert fetch(server, vault_file, "Winter 2030") == []
+  assert "no replay vault tab is named Winter 2030" in capsys.readouterr().out
@@ -0,0 +1,61 @@
+"""Tests of the stats CSV written by stats_compiler.py.
+Usage: python -m pytest tests
+"""
+import csv
+
+import cea_team_name_parser
+import ratings
+import stats_compiler
+from team_inference import UNKNOWN_TEAM
+
+TEAMS = "Alexa 12 Pool,Feniks,Slum=Slumdog\nMicrosoft One Xbox One X,viceamiral\n"
+
+
+def record(winner, loser, time_utc, fingerprint):
+  """Gets the record of a game, see replay_parser.py."""
+  players = [{'name': name, 'mmr': mmr, 'apm': 100, 'selected_race': race,
+              'result': result}
+             for name, mmr, race, result in (winner + (1,), loser + (2,))]
+  return {'players': players, 'duration': 600, 'time_utc': time_utc,
+          'fingerprint': fingerprint}
+
+
+def compile_csv(tmp_path, records):
+  """Adds records to a StatsStage and writes its CSV.
+
+  Returns:
+      dict: player name => CSV row
+  """
+  teams_file = tmp_path / "teams.csv"
+  teams_file.write_text(TEAMS, encoding='utf-8')
+  teams_dict, nicknames_dict = cea_team_name_parser.init_dictionary(
+      str(teams_file))
+  csv_file = str(tmp_path / "stats.csv")
+  stats = stats_compiler.StatsStage(
+      nicknames_dict, csv_file=csv_file, teams_file=str(teams_file),
+      ratings=ratings.RatingEngine(None))
+  for i, game in enumerate(records):
+    stats.add("%d.SC2Replay" % i, game)
+  stats.finish()
+  with open(csv_file, newline='') as f:
+    return {row['Name']: row for row in csv.DictReader(f)}
+
+
+def test_player_missing_from_teams_file(tmp_path):
+  rows = compile_csv(tmp_path, [
+      record(("Feniks", 4000, "Protoss"), ("Stranger", 3000, "Zerg"), 1, "a"),
+      record(("Stranger", 3000, "Zerg"), ("Slumdog", 3500, "Terran"), 2, "b")])
+  assert rows["Stranger"]["Team Name"] == UNKNOWN_TEAM
+  assert rows["Stranger"]["Wins"] == "1"
+  assert rows["Stranger"]["Team Rating"] == ""
+  assert rows["Feniks"]["Biggest Win (MMR Diff)"] == "Stranger (-1000)"
+  # Slumdog is an alias of Slum.
+  assert rows["Slum"]["Players Lost To (MMR Diff)"] == "Stranger (-500)"
+
+
+def test_fuzzy_matched_opponent(tmp_path):
+  rows = compile_csv(tmp_path, [
+      record(("ViceAdmiral", 3300, "Terran"), ("Feniks", 4000, "Protoss"), 1,
+             "a")])
+  assert rows["viceamiral"]["Team Name"] == "Microsoft One Xbox One X"
+  assert rows["Feniks"]["Players Lost To (MMR Diff)"] == "viceamiral (-700)"